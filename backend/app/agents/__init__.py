@@ -12,6 +12,8 @@ from app.agents.decision import DecisionAgent
 from app.agents.notifier import NotifierAgent
 from app.agents.reporter import ReporterAgent
 from app.agents.feedback import FeedbackAgent
+from app.agents.rules import RulesAgent
+from app.agents.patterns import PatternAgent
 
 __all__ = [
     "BaseAgent",
@@ -25,5 +27,7 @@ __all__ = [
     "NotifierAgent",
     "ReporterAgent",
     "FeedbackAgent",
+    "RulesAgent",
+    "PatternAgent",
 ]
 
@@ -3,10 +3,42 @@ Anomaly Detection Agent - Detects fraud and outliers using statistical methods
 """
 from typing import Dict, Any, Optional, List
 from app.agents.base import BaseAgent
-from app.config import settings
 from sqlalchemy.orm import Session
+from app.config import settings
 from app.database import SessionLocal
-from app.models import Transaction
+from app.services import anomaly_model, stats
+from app.services.duplicates import duplicate_index
+from app.services.fx import base_amount_of
+from app.services.merchants import merchant_index
+from app.services.merchant_graph import (
+    NEW_EDGE_BURST,
+    NEW_EDGE_MIN_SHARE,
+    RING_MIN_SHARED,
+    graph_store,
+)
+from app.services.peer_baselines import peer_baselines
+from app.services.profiles import UserProfile, profile_cache
+from app.services.velocity import velocity_tracker, windows_for
+from app.services.anomaly_scoring import (
+    BUSINESS_HOURS,
+    CHECK_WEIGHTS,
+    MIN_ANOMALY_RISK,
+    MIN_CATEGORY_FREQUENCY,
+    MIN_CATEGORY_HISTORY,
+    MIN_HOUR_PROBABILITY,
+    MIN_MERCHANT_HISTORY,
+    MIN_TIME_HISTORY,
+    MAD_SCALE,
+    ROBUST_MIN_COUNT,
+    UNCATEGORIZED,
+    VELOCITY_LIMITS,
+    hour_probability,
+    load_history,
+    parse_date,
+    results_from_scores,
+    score_batch,
+    to_columns,
+)
 from datetime import datetime, timedelta
 import numpy as np
 import logging
@@ -26,6 +58,8 @@ class AnomalyAgent(BaseAgent):
                 "transaction": {
                     "id": int,
                     "amount": float,
+                    "currency": str (optional),
+                    "base_amount": float (optional, amount in the base currency),
                     "category": str,
                     "merchant": str,
                     "user_id": int,
@@ -35,50 +69,104 @@ class AnomalyAgent(BaseAgent):
             }
         """
         transaction = input_data.get("transaction", {})
+        classification = (input_data.get("classification") or {}).get("classification", {})
         
         self.log(f"Analyzing transaction for anomalies: ${transaction.get('amount', 0)}")
         
+        db = SessionLocal()
+        
         try:
-            db = SessionLocal()
             user_id = transaction.get("user_id")
-            amount = transaction.get("amount", 0.0)
-            category = transaction.get("category", "other")
+            amount = base_amount_of(transaction)
+            category = transaction.get("category") or classification.get("category") or UNCATEGORIZED
             merchant = transaction.get("merchant", "")
             
-            # Get historical data for comparison
-            historical = self._get_historical_data(db, user_id, category)
+            # Get the user's behaviour profile (cached, no database round-trip when warm)
+            profile = profile_cache.get(db, user_id)
+            
+            amount_stats = profile.amount_stats(category)
+            
+            # Users without enough history of their own are compared with peers in the same role
+            role_peers, category_peers = None, None
+            if (
+                amount_stats["count"] < ROBUST_MIN_COUNT
+                or profile.merchant_rows <= MIN_MERCHANT_HISTORY
+                or profile.category_rows <= MIN_CATEGORY_HISTORY
+            ):
+                role_peers = peer_baselines.get(db, profile.role)
+                category_peers = peer_baselines.get(db, profile.role, category)
             
             # Run anomaly detection checks
             anomalies = []
             risk_score = 0.0
             
-            # 1. Amount anomaly (Z-score)
-            amount_anomaly = self._check_amount_anomaly(amount, historical, category)
+            # 1. Amount anomaly (robust z-score from the quantile sketch)
+            if amount_stats["count"] < ROBUST_MIN_COUNT and category_peers:
+                amount_anomaly = self._check_amount_anomaly(
+                    amount, category_peers, category, peer_role=profile.role
+                )
+            else:
+                amount_anomaly = self._check_amount_anomaly(
+                    amount,
+                    amount_stats,
+                    category,
+                    profile.amount_percentile(category, amount),
+                )
             if amount_anomaly["is_anomaly"]:
                 anomalies.append(amount_anomaly)
-                risk_score += 0.4
+                risk_score += CHECK_WEIGHTS["amount"]
             
             # 2. Merchant anomaly (new merchant)
-            merchant_anomaly = self._check_merchant_anomaly(merchant, historical)
+            merchant_anomaly = self._check_merchant_anomaly(merchant, profile, role_peers)
             if merchant_anomaly["is_anomaly"]:
                 anomalies.append(merchant_anomaly)
-                risk_score += 0.2
+                risk_score += CHECK_WEIGHTS["merchant"]
             
             # 3. Category pattern anomaly
-            category_anomaly = self._check_category_anomaly(category, historical)
+            category_anomaly = self._check_category_anomaly(
+                category, profile, role_peers, category_peers
+            )
             if category_anomaly["is_anomaly"]:
                 anomalies.append(category_anomaly)
-                risk_score += 0.2
+                risk_score += CHECK_WEIGHTS["category"]
             
             # 4. Time-based anomaly (unusual time of day/month)
-            time_anomaly = self._check_time_anomaly(transaction.get("date"), historical)
+            time_anomaly = self._check_time_anomaly(transaction.get("date"), profile, role_peers)
             if time_anomaly["is_anomaly"]:
                 anomalies.append(time_anomaly)
-                risk_score += 0.2
+                risk_score += CHECK_WEIGHTS["time"]
+            
+            # 5. Learned model (Isolation Forest), when one has been published
+            model_anomaly = self._check_model_anomaly(
+                amount, transaction.get("date"), merchant, category, profile
+            )
+            if model_anomaly["is_anomaly"]:
+                anomalies.append(model_anomaly)
+                risk_score += CHECK_WEIGHTS["model"]
+            
+            # 6. Velocity (bursts of transactions in a short window)
+            velocity_anomaly = self._check_velocity_anomaly(
+                user_id, merchant, transaction.get("date")
+            )
+            if velocity_anomaly["is_anomaly"]:
+                anomalies.append(velocity_anomaly)
+                risk_score += CHECK_WEIGHTS["velocity"]
+            
+            # 7. Duplicate submission
+            duplicate_anomaly = self._check_duplicate_anomaly(db, transaction)
+            if duplicate_anomaly["is_anomaly"]:
+                anomalies.append(duplicate_anomaly)
+                risk_score += CHECK_WEIGHTS["near_duplicate" if duplicate_anomaly["near"] else "duplicate"]
+            
+            # 8. User-merchant graph (shared shell vendors, sudden new edges)
+            graph_anomaly = self._check_graph_anomaly(user_id, merchant, transaction.get("date"))
+            if graph_anomaly["is_anomaly"]:
+                anomalies.append(graph_anomaly)
+                risk_score += CHECK_WEIGHTS["graph"]
             
             # Normalize risk score
             risk_score = min(risk_score, 1.0)
-            is_anomaly = len(anomalies) > 0 and risk_score >= 0.3
+            is_anomaly = len(anomalies) > 0 and risk_score >= MIN_ANOMALY_RISK
             
             result = {
                 "status": "success",
@@ -93,7 +181,6 @@ class AnomalyAgent(BaseAgent):
                 data={"risk_score": risk_score, "anomaly_count": len(anomalies)}
             )
             
-            db.close()
             return result
         
         except Exception as e:
@@ -104,102 +191,188 @@ class AnomalyAgent(BaseAgent):
                 "is_anomaly": False,
                 "risk_score": 0.0,
             }
+        finally:
+            db.close()
     
-    def _get_historical_data(
-        self, db: Session, user_id: int, category: Optional[str] = None
-    ) -> List[Dict[str, Any]]:
-        """Get historical transactions for comparison"""
-        query = db.query(Transaction).filter(
-            Transaction.user_id == user_id,
-            Transaction.status != "rejected",
-        )
+    async def score_batch(self, transactions: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Score many transactions at once with vectorized checks
         
-        if category:
-            query = query.filter(Transaction.category == category)
+        Used for bulk imports and backfills. Each transaction is scored only
+        against history dated in the anomaly window before it, including the
+        earlier transactions of the batch, as if it had arrived live;
+        undated transactions are scored against history up to now. Items
+        with an unparseable date get an error result, the rest are scored.
+        """
+        if not transactions:
+            return []
         
-        # Get last 90 days
-        cutoff_date = datetime.utcnow() - timedelta(days=90)
-        query = query.filter(Transaction.date >= cutoff_date)
+        self.log(f"Batch scoring {len(transactions)} transactions")
         
-        transactions = query.all()
+        results: List[Optional[Dict[str, Any]]] = [None] * len(transactions)
+        valid, dates = [], []
+        for i, transaction in enumerate(transactions):
+            date = stats.naive_utc(parse_date(transaction.get("date")))
+            if transaction.get("date") and date is None:
+                results[i] = {
+                    "id": transaction.get("id"),
+                    "status": "error",
+                    "error": f"Invalid date: {transaction.get('date')}",
+                }
+                continue
+            valid.append(transaction)
+            if date is not None:
+                dates.append(date)
+        if not valid:
+            return results
         
-        return [
-            {
-                "amount": t.amount,
-                "merchant": t.merchant,
-                "category": t.category,
-                "date": t.date,
-            }
-            for t in transactions
-        ]
+        db = SessionLocal()
+        
+        try:
+            batch = to_columns(valid)
+            end = datetime.utcnow()
+            start = min(dates or [end]) - timedelta(days=settings.anomaly_history_days)
+            
+            history = load_history(
+                db, batch["user_id"].tolist(), start, end, exclude_ids=batch["id"].tolist()
+            )
+            # Batch rows may not be stored yet; each is history for the later ones
+            history = {key: np.concatenate([history[key], batch[key]]) for key in history}
+            scores = score_batch(batch, history, as_of=True)
+            scored = iter(results_from_scores(scores, batch))
+            results = [
+                result if result is not None else {"status": "success", **next(scored)}
+                for result in results
+            ]
+            
+            self.log(
+                "Batch scoring complete",
+                data={"count": len(valid), "anomalies": int(scores["is_anomaly"].sum())}
+            )
+            return results
+        except Exception as e:
+            self.log(f"Error in batch scoring: {str(e)}", level="ERROR")
+            return [
+                result or {"id": transaction.get("id"), "status": "error", "error": str(e)}
+                for result, transaction in zip(results, transactions)
+            ]
+        finally:
+            db.close()
     
     def _check_amount_anomaly(
-        self, amount: float, historical: List[Dict], category: str
+        self,
+        amount: float,
+        amount_stats: Dict[str, Any],
+        category: str,
+        percentile: Optional[float] = None,
+        peer_role: Optional[str] = None,
     ) -> Dict[str, Any]:
-        """Check if amount is anomalous using Z-score"""
-        if not historical:
+        """
+        Check if amount is anomalous
+        
+        Uses the median and MAD once there is enough history, so a single
+        large past expense cannot mask later outliers; falls back to the
+        mean/std Z-score for short histories. With peer_role set, the stats
+        are a peer-group baseline rather than the user's own history.
+        """
+        if not amount_stats.get("count"):
             return {"is_anomaly": False, "type": "amount", "reason": "No historical data"}
         
-        amounts = [h["amount"] for h in historical if h.get("amount")]
-        if not amounts:
-            return {"is_anomaly": False, "type": "amount", "reason": "No amount data"}
+        mean = amount_stats["mean"]
+        std = amount_stats["std"]
+        median = amount_stats.get("median")
+        mad = amount_stats.get("mad")
         
-        mean = np.mean(amounts)
-        std = np.std(amounts)
+        if amount_stats["count"] >= ROBUST_MIN_COUNT and median is not None:
+            center, spread = median, (mad or 0.0) / MAD_SCALE
+            label = "median"
+        else:
+            center, spread = mean, std
+            label = "average"
+        if peer_role:
+            label = f"{peer_role} peer {label}"
         
-        if std == 0:
-            # All amounts are the same
-            is_anomaly = abs(amount - mean) > mean * 0.5  # 50% difference
+        if spread == 0:
+            # All amounts are (nearly) the same
+            is_anomaly = abs(amount - center) > abs(center) * 0.5  # 50% difference
+            z_score = 0
         else:
-            z_score = abs((amount - mean) / std)
-            is_anomaly = z_score > settings.anomaly_threshold
+            z_score = (amount - center) / spread
+            is_anomaly = abs(z_score) > settings.anomaly_threshold
         
         return {
             "is_anomaly": is_anomaly,
             "type": "amount",
-            "z_score": (amount - mean) / std if std > 0 else 0,
+            "z_score": z_score,
             "mean": mean,
             "std": std,
-            "reason": f"Amount ${amount:.2f} is {'significantly higher' if amount > mean else 'significantly lower'} than average ${mean:.2f} for {category}",
+            "median": median,
+            "mad": mad,
+            "percentile": percentile,
+            "baseline": "peers" if peer_role else "user",
+            "reason": f"Amount ${amount:.2f} is {'significantly higher' if amount > center else 'significantly lower'} than {label} ${center:.2f} for {category}",
         }
     
     def _check_merchant_anomaly(
-        self, merchant: str, historical: List[Dict]
+        self, merchant: str, profile: UserProfile, role_peers: Optional[Dict[str, Any]] = None
     ) -> Dict[str, Any]:
         """Check if merchant is new/unusual"""
         if not merchant:
             return {"is_anomaly": False, "type": "merchant"}
         
-        merchants = [h.get("merchant", "").lower() for h in historical if h.get("merchant")]
-        is_new = merchant.lower() not in merchants
+        key = merchant_index.canonical(merchant)
+        is_new = key not in profile.merchants
+        
+        if profile.merchant_rows > MIN_MERCHANT_HISTORY:
+            is_anomaly = is_new
+            reason = f"New merchant: {merchant}" if is_new else "Known merchant"
+        elif role_peers:
+            # Not enough history of our own: only flag merchants none of the user's peers use.
+            # Baselines keep the popular merchants only, so a missing one is unknown if any were cut.
+            peer_share = role_peers["merchants"].get(key)
+            peer_unknown = peer_share is None and role_peers.get("tail_merchants", 0) > 0
+            is_anomaly = is_new and not peer_share and not peer_unknown
+            if is_anomaly:
+                reason = f"New merchant not used by {role_peers['role']} peers: {merchant}"
+            elif is_new and peer_unknown:
+                reason = f"New merchant, not among {role_peers['role']} peers' most used: {merchant}"
+            else:
+                reason = "Known merchant"
+        else:
+            is_anomaly = False
+            reason = f"New merchant: {merchant}" if is_new else "Known merchant"
         
         return {
-            "is_anomaly": is_new and len(merchants) > 5,  # Only flag if we have enough history
+            "is_anomaly": is_anomaly,
             "type": "merchant",
             "is_new": is_new,
-            "reason": f"New merchant: {merchant}" if is_new else "Known merchant",
+            "reason": reason,
         }
     
     def _check_category_anomaly(
-        self, category: str, historical: List[Dict]
+        self,
+        category: str,
+        profile: UserProfile,
+        role_peers: Optional[Dict[str, Any]] = None,
+        category_peers: Optional[Dict[str, Any]] = None,
     ) -> Dict[str, Any]:
         """Check if category is unusual for this user"""
-        if not historical:
+        total = profile.category_rows
+        category_count = profile.categories.get(category, 0)
+        if total <= MIN_CATEGORY_HISTORY and role_peers:
+            # Fall back to how often the user's peers spend in this category.
+            # No baseline may just mean too few peers use it to publish one.
+            if not category_peers:
+                return {"is_anomaly": False, "type": "category", "reason": "No peer baseline for category"}
+            total = role_peers["count"]
+            category_count = category_peers["count"]
+        if total <= 0:
             return {"is_anomaly": False, "type": "category"}
         
-        categories = [h.get("category") for h in historical if h.get("category")]
-        category_counts = {}
-        for cat in categories:
-            category_counts[cat] = category_counts.get(cat, 0) + 1
-        
-        total = len(categories)
-        if total == 0:
-            return {"is_anomaly": False, "type": "category"}
-        
-        category_frequency = category_counts.get(category, 0) / total
+        category_frequency = category_count / total
         
         # Flag if category appears less than 5% of the time
-        is_anomaly = category_frequency < 0.05 and total > 20
+        is_anomaly = category_frequency < MIN_CATEGORY_FREQUENCY and total > MIN_CATEGORY_HISTORY
         
         return {
             "is_anomaly": is_anomaly,
@@ -209,27 +382,172 @@ class AnomalyAgent(BaseAgent):
         }
     
     def _check_time_anomaly(
-        self, date_str: Optional[str], historical: List[Dict]
+        self,
+        date_str: Optional[str],
+        profile: UserProfile,
+        role_peers: Optional[Dict[str, Any]] = None,
     ) -> Dict[str, Any]:
-        """Check for time-based anomalies"""
+        """
+        Check for time-based anomalies
+        
+        Scores the hour of week against the user's own histogram, smoothed
+        towards their peers' pattern while history is short. The fixed
+        business-hours rule only applies when neither is available.
+        """
         if not date_str:
             return {"is_anomaly": False, "type": "time"}
         
-        try:
-            date = datetime.fromisoformat(date_str.replace("Z", "+00:00"))
-            hour = date.hour
-            
-            # Flag transactions outside business hours (9 AM - 6 PM) as potentially unusual
-            is_anomaly = hour < 9 or hour > 18
-            
+        date = stats.naive_utc(parse_date(date_str))
+        if date is None:
+            return {"is_anomaly": False, "type": "time", "reason": "Could not parse date"}
+        hour = date.hour
+        
+        prior = role_peers["hours"] if role_peers and role_peers.get("hours") else None
+        if profile.hour_rows >= MIN_TIME_HISTORY or prior:
+            probability = hour_probability(profile.hours, profile.hour_rows, stats.hour_of_week(date), prior)
+            is_anomaly = probability < MIN_HOUR_PROBABILITY
+            pattern = "this user's" if profile.hour_rows >= MIN_TIME_HISTORY else f"{role_peers['role']} peers'"
             return {
                 "is_anomaly": is_anomaly,
                 "type": "time",
                 "hour": hour,
-                "reason": f"Transaction at {hour}:00 (outside typical business hours)" if is_anomaly else "Normal business hours",
+                "probability": probability,
+                "reason": (
+                    f"Transaction on {date:%A} at {hour}:00 is unusual for {pattern} weekly pattern"
+                    if is_anomaly else "Typical time for this user"
+                ),
             }
-        except Exception:
-            return {"is_anomaly": False, "type": "time", "reason": "Could not parse date"}
+        
+        # Flag transactions outside business hours (9 AM - 6 PM) as potentially unusual
+        is_anomaly = hour < BUSINESS_HOURS[0] or hour > BUSINESS_HOURS[1]
+        
+        return {
+            "is_anomaly": is_anomaly,
+            "type": "time",
+            "hour": hour,
+            "reason": f"Transaction at {hour}:00 (outside typical business hours)" if is_anomaly else "Normal business hours",
+        }
+    
+    def _check_model_anomaly(
+        self,
+        amount: float,
+        date_str: Optional[str],
+        merchant: str,
+        category: str,
+        profile: UserProfile,
+    ) -> Dict[str, Any]:
+        """Score the transaction with the current Isolation Forest model"""
+        model = anomaly_model.registry.current()
+        if model is None:
+            return {"is_anomaly": False, "type": "model", "reason": "No model published"}
+        
+        features = anomaly_model.transaction_features(
+            amount, parse_date(date_str), merchant, category, profile
+        )
+        score = float(model.forest.score(features)[0])
+        is_anomaly = score > model.threshold
+        
+        return {
+            "is_anomaly": is_anomaly,
+            "type": "model",
+            "score": score,
+            "threshold": model.threshold,
+            "model_version": model.version,
+            "reason": f"Unusual transaction pattern (model score {score:.2f})" if is_anomaly else "Typical pattern",
+        }
+    
+    def _check_velocity_anomaly(
+        self, user_id: Optional[int], merchant: str, date_str: Optional[str]
+    ) -> Dict[str, Any]:
+        """Check for bursts of transactions from in-memory velocity counters"""
+        date = parse_date(date_str)
+        if date is None:
+            return {"is_anomaly": False, "type": "velocity"}
+        
+        velocity = velocity_tracker.lookup(user_id, merchant, date)
+        windows = windows_for(date)
+        
+        for (scope, window), limit in VELOCITY_LIMITS.items():
+            if window not in windows:
+                continue
+            window_totals = velocity[scope][window]
+            if window_totals["count"] >= limit:
+                where = f" at {merchant}" if scope == "pair" else ""
+                return {
+                    "is_anomaly": True,
+                    "type": "velocity",
+                    "scope": scope,
+                    "window": window,
+                    "count": window_totals["count"],
+                    "amount": window_totals["amount"],
+                    "reason": f"{window_totals['count']} transactions{where} totalling ${window_totals['amount']:.2f} within {window}",
+                }
+        
+        return {"is_anomaly": False, "type": "velocity", "velocity": velocity}
+    
+    def _check_duplicate_anomaly(self, db: Session, transaction: Dict[str, Any]) -> Dict[str, Any]:
+        """Check whether the same expense was already submitted"""
+        duplicates = duplicate_index.find(
+            db,
+            transaction.get("user_id"),
+            transaction.get("amount"),
+            transaction.get("merchant"),
+            parse_date(transaction.get("date")),
+            description=transaction.get("description"),
+            exclude_id=transaction.get("id"),
+        )
+        if not duplicates:
+            return {"is_anomaly": False, "type": "duplicate"}
+        
+        match = duplicates[0]
+        label = "Possible duplicate" if match["match"] == "near" else "Duplicate"
+        return {
+            "is_anomaly": True,
+            "type": "duplicate",
+            "near": match["match"] == "near",
+            "duplicates": duplicates,
+            "reason": f"{label} of transaction #{match['transaction_id']} (${match['amount']:.2f} on {match['date'][:10]})",
+        }
+    
+    def _check_graph_anomaly(
+        self, user_id: Optional[int], merchant: str, date_str: Optional[str]
+    ) -> Dict[str, Any]:
+        """Check the merchant's neighbourhood in the user-merchant graph"""
+        features = graph_store.features(user_id, merchant, parse_date(date_str))
+        if not features:
+            return {"is_anomaly": False, "type": "graph"}
+        
+        # A small group of users sharing several otherwise unused merchants
+        if len(features["shared_rare_merchants"]) >= RING_MIN_SHARED:
+            return {
+                "is_anomaly": True,
+                "type": "graph",
+                "pattern": "ring",
+                "features": features,
+                "reason": (
+                    f"{merchant} is used by only {features['fan_in']} users, who also share "
+                    f"{len(features['shared_rare_merchants'])} other rare merchants"
+                ),
+            }
+        
+        # Many users starting to use the same merchant at once
+        if (
+            features["edge_new"]
+            and features["merchant_new_edges"] >= NEW_EDGE_BURST
+            and features["merchant_new_edges"] >= NEW_EDGE_MIN_SHARE * features["fan_in"]
+        ):
+            return {
+                "is_anomaly": True,
+                "type": "graph",
+                "pattern": "new_edges",
+                "features": features,
+                "reason": (
+                    f"{features['merchant_new_edges']} of {features['fan_in']} users of {merchant} "
+                    f"started using it in the last week"
+                ),
+            }
+        
+        return {"is_anomaly": False, "type": "graph", "features": features}
     
     def _generate_anomaly_reason(self, anomalies: List[Dict]) -> str:
         """Generate human-readable reason for anomaly"""
@@ -4,12 +4,20 @@ Decision Agent - Reasons about risk and recommends actions
 from typing import Dict, Any, Optional
 from app.agents.base import BaseAgent
 from app.config import settings
+from app.services.rules import SEVERITY_ORDER
 from openai import OpenAI
 import logging
 import json
 
 logger = logging.getLogger(__name__)
 
+# Deterministic part of the risk aggregation (replayed by the backtester)
+REVIEW_RISK = 0.2  # Low classification confidence
+ANOMALY_RISK_WEIGHT = 0.6  # Share of the anomaly risk score carried over
+MISMATCH_RISK = 0.3  # Receipt mismatch or missing
+ALERT_RISK = 0.4  # Risk score that raises an alert on its own
+HIGH_RISK = 0.7  # Fallback severity "high", which flags the transaction
+
 
 class DecisionAgent(BaseAgent):
     """Agent responsible for making decisions about risk and recommending actions"""
@@ -27,13 +35,15 @@ class DecisionAgent(BaseAgent):
                 "transaction": dict,
                 "classification": dict,
                 "anomaly": dict,
-                "reconciliation": dict (optional)
+                "reconciliation": dict (optional),
+                "rules": dict (optional)
             }
         """
         transaction = input_data.get("transaction", {})
         classification = input_data.get("classification", {}).get("classification", {})
         anomaly = input_data.get("anomaly", {})
         reconciliation = input_data.get("reconciliation", {})
+        rules = input_data.get("rules") or {}
         
         self.log("Making risk decision for transaction")
         
@@ -45,26 +55,48 @@ class DecisionAgent(BaseAgent):
             # Classification risk
             if classification.get("needs_review"):
                 risk_factors.append("Low classification confidence")
-                risk_score += 0.2
+                risk_score += REVIEW_RISK
             
             # Anomaly risk
             if anomaly.get("is_anomaly"):
                 risk_factors.append(f"Anomaly detected: {anomaly.get('reason', '')}")
-                risk_score += anomaly.get("risk_score", 0.0) * 0.6
+                risk_score += anomaly.get("risk_score", 0.0) * ANOMALY_RISK_WEIGHT
             
             # Reconciliation risk
             if reconciliation:
                 if not reconciliation.get("is_reconciled"):
                     risk_factors.append("Receipt mismatch or missing")
-                    risk_score += 0.3
+                    risk_score += MISMATCH_RISK
             
-            # Use LLM to reason about overall risk and recommend actions
-            decision = await self._reason_about_risk(
-                transaction, classification, anomaly, risk_factors, risk_score
-            )
+            # Fraud rule risk
+            for rule in rules.get("matched_rules", []):
+                risk_factors.append(f"Fraud rule matched: {rule.get('name')}")
+            risk_score += rules.get("risk_score", 0.0)
+            
+            rule_severity = rules.get("severity") if rules.get("flag") else None
+            if rule_severity in ["high", "critical"]:
+                # Policy already demands review, no need to ask the LLM
+                decision = self._severity_decision(rule_severity)
+                decision["recommendation"] = "Flagged by fraud policy rules - requires review"
+            else:
+                # Use LLM to reason about overall risk and recommend actions
+                decision = await self._reason_about_risk(
+                    transaction, classification, anomaly, risk_factors, risk_score
+                )
+                llm_severity = decision.get("severity")
+                if rule_severity and (
+                    llm_severity not in SEVERITY_ORDER
+                    or SEVERITY_ORDER.index(rule_severity) > SEVERITY_ORDER.index(llm_severity)
+                ):
+                    decision["severity"] = rule_severity
+                    decision["actions"] = self._severity_decision(rule_severity)["actions"]
             
             # Determine if alert is needed
-            should_alert = risk_score >= 0.4 or decision.get("severity") in ["high", "critical"]
+            should_alert = (
+                risk_score >= ALERT_RISK
+                or decision.get("severity") in ["high", "critical"]
+                or bool(rules.get("flag"))
+            )
             
             result = {
                 "status": "success",
@@ -148,23 +180,35 @@ Return ONLY valid JSON."""
             return json.loads(response.choices[0].message.content)
         except json.JSONDecodeError as e:
             logger.error(f"Failed to parse decision response: {e}")
-            # Fallback decision
-            if risk_score >= 0.7:
-                severity = "high"
-                recommendation = "High risk transaction - requires immediate review"
-                actions = ["flag_for_review", "manager_approval"]
-            elif risk_score >= 0.4:
-                severity = "medium"
-                recommendation = "Medium risk - review recommended"
-                actions = ["flag_for_review"]
-            else:
-                severity = "low"
-                recommendation = "Low risk - appears normal"
-                actions = ["auto_approve"]
-            
-            return {
-                "severity": severity,
-                "recommendation": recommendation,
-                "actions": actions,
-            }
+            return self._fallback_decision(risk_score)
+    
+    def _fallback_decision(self, risk_score: float) -> Dict[str, Any]:
+        """Deterministic decision based on the aggregated risk score"""
+        if risk_score >= HIGH_RISK:
+            return self._severity_decision("high")
+        elif risk_score >= ALERT_RISK:
+            return self._severity_decision("medium")
+        return self._severity_decision("low")
+    
+    def _severity_decision(self, severity: str) -> Dict[str, Any]:
+        """Recommendation and actions that go with a severity"""
+        if severity == "critical":
+            recommendation = "Critical risk transaction - hold until reviewed"
+            actions = ["flag_for_review", "manager_approval"]
+        elif severity == "high":
+            recommendation = "High risk transaction - requires immediate review"
+            actions = ["flag_for_review", "manager_approval"]
+        elif severity == "medium":
+            recommendation = "Medium risk - review recommended"
+            actions = ["flag_for_review"]
+        else:
+            severity = "low"
+            recommendation = "Low risk - appears normal"
+            actions = ["auto_approve"]
+        
+        return {
+            "severity": severity,
+            "recommendation": recommendation,
+            "actions": actions,
+        }
 
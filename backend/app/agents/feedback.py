@@ -6,6 +6,7 @@ from app.agents.base import BaseAgent
 from sqlalchemy.orm import Session
 from app.database import SessionLocal
 from app.models import Feedback, Transaction, Alert
+from app.services import transaction_events
 from datetime import datetime
 import logging
 
@@ -113,6 +114,7 @@ class FeedbackAgent(BaseAgent):
             return
         
         # Update transaction with corrected classification
+        before = transaction_events.snapshot(transaction)
         if "category" in corrected:
             transaction.category = corrected["category"]
         if "subcategory" in corrected:
@@ -124,6 +126,7 @@ class FeedbackAgent(BaseAgent):
         metadata["correction_date"] = datetime.utcnow().isoformat()
         transaction.classification_metadata = metadata
         
+        transaction_events.on_transaction_change(db, before, transaction_events.snapshot(transaction))
         db.commit()
         
         self.log(
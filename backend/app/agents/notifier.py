@@ -55,6 +55,9 @@ class NotifierAgent(BaseAgent):
                     "risk_score": decision.get("risk_score", 0.0),
                     "risk_factors": decision.get("risk_factors", []),
                     "actions": decision.get("actions", []),
+                    **({"pattern": decision["pattern"]} if decision.get("pattern") else {}),
+                    **({"receipt_id": decision["receipt_id"]} if decision.get("receipt_id") else {}),
+                    **({"duplicate_of": decision["duplicate_of"]} if decision.get("duplicate_of") else {}),
                 },
             )
             
@@ -111,6 +114,16 @@ class NotifierAgent(BaseAgent):
             return f"Potential Fraud Alert: ${transaction.get('amount', 0):.2f}"
         elif alert_type == "mismatch":
             return f"Receipt Mismatch: {transaction.get('merchant', 'Unknown')}"
+        elif alert_type == "duplicate_receipt":
+            return f"Duplicate Receipt: {transaction.get('merchant') or 'Unknown'}"
+        elif alert_type == "pattern":
+            pattern = decision.get("pattern", {})
+            titles = {
+                "split": f"Possible Split Purchase: {transaction.get('merchant', 'Unknown')}",
+                "round_amounts": "Unusual Share of Round Amounts",
+                "benford": "Amounts Deviate from Benford's Law",
+            }
+            return titles.get(pattern.get("pattern"), "Suspicious Spending Pattern")
         elif alert_type == "classification":
             return f"Classification Review Needed: {transaction.get('description', 'Transaction')}"
         else:
@@ -121,6 +134,27 @@ class NotifierAgent(BaseAgent):
         risk_factors = decision.get("risk_factors", [])
         risk_score = decision.get("risk_score", 0.0)
         
+        if decision.get("pattern"):
+            pattern = decision["pattern"]
+            message = f"{pattern['description']}.\n\n"
+            if pattern.get("transaction_ids"):
+                message += "Transactions: " + ", ".join(f"#{i}" for i in pattern["transaction_ids"]) + "\n"
+            return message
+        
+        if decision.get("duplicate_of"):
+            message = f"Receipt #{decision['receipt_id']} is the same file as receipt(s) "
+            message += ", ".join(f"#{i}" for i in decision["duplicate_of"]) + " uploaded by other users.\n\n"
+            for factor in risk_factors:
+                message += f"• {factor}\n"
+            return message
+        
+        if decision.get("receipt_id"):
+            message = f"Receipt #{decision['receipt_id']} for ${transaction.get('amount') or 0:.2f} "
+            message += f"at {transaction.get('merchant') or 'Unknown'} has no matching transaction.\n\n"
+            for factor in risk_factors:
+                message += f"• {factor}\n"
+            return message
+        
         message = f"Transaction ${transaction.get('amount', 0):.2f} at {transaction.get('merchant', 'Unknown')} "
         message += f"has been flagged with a risk score of {risk_score:.2f}.\n\n"
         
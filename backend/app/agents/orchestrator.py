@@ -12,6 +12,10 @@ from app.agents.decision import DecisionAgent
 from app.agents.notifier import NotifierAgent
 from app.agents.reporter import ReporterAgent
 from app.agents.feedback import FeedbackAgent
+from app.agents.rules import RulesAgent
+from app.agents.patterns import PatternAgent
+from app.services.rules import merge_evaluations
+from datetime import datetime
 import logging
 
 logger = logging.getLogger(__name__)
@@ -37,6 +41,8 @@ class AgentOrchestrator:
             "notifier": NotifierAgent("Notifier", self.config),
             "reporter": ReporterAgent("Reporter", self.config),
             "feedback": FeedbackAgent("Feedback", self.config),
+            "rules": RulesAgent("Rules", self.config),
+            "patterns": PatternAgent("Patterns", self.config),
         }
     
     async def process_transaction(self, transaction_data: Dict[str, Any]) -> Dict[str, Any]:
@@ -44,18 +50,27 @@ class AgentOrchestrator:
         Full workflow for processing a new transaction
         
         Flow:
-        1. Retrieve transaction data (if needed)
-        2. Parse any associated receipts
-        3. Classify transaction
-        4. Detect anomalies
-        5. Reconcile with receipts
-        6. Make decisions about risk
-        7. Send notifications if needed
+        1. Evaluate fraud rules (before any LLM step)
+        2. Classify transaction, then evaluate rules on the category
+        3. Detect anomalies
+        4. Reconcile with receipts
+        5. Make decisions about risk
+        6. Send notifications if needed
+        7. Check multi-transaction spending patterns
         """
         workflow_log = []
         results = {}
         
         try:
+            # Step 0: Evaluate fraud rules
+            logger.info("Evaluating fraud rules...")
+            rules_result = await self.agents["rules"].execute({
+                "transaction": transaction_data,
+                "stage": "pre",
+            })
+            results["rules"] = rules_result
+            workflow_log.append({"step": "rules", "result": rules_result})
+            
             # Step 1: Classify transaction
             logger.info("Classifying transaction...")
             classification_result = await self.agents["classifier"].execute({
@@ -64,6 +79,16 @@ class AgentOrchestrator:
             results["classification"] = classification_result
             workflow_log.append({"step": "classification", "result": classification_result})
             
+            # Rules on the category need the classifier's answer
+            category_rules_result = await self.agents["rules"].execute({
+                "transaction": transaction_data,
+                "classification": classification_result,
+                "stage": "post",
+            })
+            rules_result = merge_evaluations(rules_result, category_rules_result)
+            results["rules"] = rules_result
+            workflow_log.append({"step": "category_rules", "result": category_rules_result})
+            
             # Step 2: Detect anomalies
             logger.info("Detecting anomalies...")
             anomaly_result = await self.agents["anomaly"].execute({
@@ -73,7 +98,7 @@ class AgentOrchestrator:
             results["anomaly"] = anomaly_result
             workflow_log.append({"step": "anomaly_detection", "result": anomaly_result})
             
-            # Step 3: Reconcile with receipts (if receipt_id provided)
+            # Step 3: Reconcile with the given receipt, or look for one already on file
             if transaction_data.get("receipt_id"):
                 logger.info("Reconciling with receipt...")
                 reconciliation_result = await self.agents["reconciler"].execute({
@@ -82,6 +107,14 @@ class AgentOrchestrator:
                 })
                 results["reconciliation"] = reconciliation_result
                 workflow_log.append({"step": "reconciliation", "result": reconciliation_result})
+            elif transaction_data.get("id"):
+                logger.info("Looking up receipts on file...")
+                lookup_result = await self.agents["reconciler"].execute({
+                    "transaction": transaction_data,
+                })
+                # A missing receipt is not a mismatch, so the decision step does not see it
+                results["receipt_lookup"] = lookup_result
+                workflow_log.append({"step": "receipt_lookup", "result": lookup_result})
             
             # Step 4: Make decision about risk and actions
             logger.info("Making risk decision...")
@@ -90,6 +123,7 @@ class AgentOrchestrator:
                 "classification": classification_result,
                 "anomaly": anomaly_result,
                 "reconciliation": results.get("reconciliation"),
+                "rules": rules_result,
             })
             results["decision"] = decision_result
             workflow_log.append({"step": "decision", "result": decision_result})
@@ -104,6 +138,16 @@ class AgentOrchestrator:
                 results["notification"] = notification_result
                 workflow_log.append({"step": "notification", "result": notification_result})
             
+            # Step 6: Check spending patterns across the user's recent transactions
+            logger.info("Checking spending patterns...")
+            pattern_result = await self.agents["patterns"].execute({
+                "transaction": transaction_data,
+            })
+            for alert in pattern_result.get("alerts", []):
+                await self.agents["notifier"].execute(alert)
+            results["patterns"] = pattern_result
+            workflow_log.append({"step": "patterns", "result": pattern_result})
+            
             results["workflow_log"] = workflow_log
             results["status"] = "success"
             
@@ -120,7 +164,7 @@ class AgentOrchestrator:
         Process a receipt document
         
         Flow:
-        1. Parse receipt
+        1. Parse receipt (or reuse receipt_data["cached_parse"] for a known file)
         2. Attempt to match with existing transaction
         3. If matched, reconcile
         4. If not matched, create alert
@@ -129,20 +173,27 @@ class AgentOrchestrator:
         results = {}
         
         try:
-            # Step 1: Parse receipt
-            logger.info("Parsing receipt...")
-            parse_result = await self.agents["parser"].execute({
-                "receipt": receipt_data,
-            })
+            # Step 1: Parse receipt, unless the same file was parsed before
+            if receipt_data.get("cached_parse"):
+                logger.info("Using cached parse of identical receipt file...")
+                parse_result = {"status": "success", "cached": True, **receipt_data["cached_parse"]}
+            else:
+                logger.info("Parsing receipt...")
+                parse_result = await self.agents["parser"].execute({
+                    "receipt": receipt_data,
+                })
             results["parsing"] = parse_result
             workflow_log.append({"step": "parsing", "result": parse_result})
             
-            # Step 2: Try to reconcile with transaction
-            if receipt_data.get("transaction_id"):
+            # Step 2: Reconcile with the given transaction, or search the owner's transactions
+            parsed_data = parse_result.get("parsed_data")
+            if parse_result.get("status") == "success" and parsed_data:
                 logger.info("Reconciling receipt with transaction...")
                 reconciliation_result = await self.agents["reconciler"].execute({
-                    "receipt": parse_result,
-                    "transaction_id": receipt_data["transaction_id"],
+                    "receipt": parsed_data,
+                    "transaction_id": receipt_data.get("transaction_id"),
+                    "receipt_id": receipt_data.get("receipt_id"),
+                    "user_id": receipt_data.get("user_id"),
                 })
                 results["reconciliation"] = reconciliation_result
                 workflow_log.append({"step": "reconciliation", "result": reconciliation_result})
@@ -158,6 +209,29 @@ class AgentOrchestrator:
         
         return results
     
+    async def sweep_receipts(self, dry_run: bool = False) -> Dict[str, Any]:
+        """
+        Periodic reconciliation sweep
+        
+        Links receipts to transactions that changed since the last sweep,
+        then alerts on receipts still unmatched after the grace period. The
+        alert watermark only moves past receipts whose alert was created;
+        after a failed notification the rest are retried by the next sweep.
+        """
+        result = await self.agents["reconciler"].sweep(dry_run=dry_run)
+        alerted = 0
+        if result.get("status") == "success" and not dry_run:
+            position = result["alert_position"]
+            for alert in result["alerts"]:
+                notification = await self.agents["notifier"].execute(alert)
+                if notification.get("status") != "success":
+                    position = result["alert_uploads"][alerted - 1] if alerted else result["alerted_until"]
+                    break
+                alerted += 1
+            await self.agents["reconciler"].mark_alerted(datetime.fromisoformat(position), alerted)
+        result["alerted"] = alerted
+        return result
+    
     async def generate_report(
         self, 
         report_type: str, 
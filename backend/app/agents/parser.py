@@ -4,9 +4,8 @@ Parser Agent - Processes receipts and invoices using LLM + OCR
 from typing import Dict, Any, Optional
 from app.agents.base import BaseAgent
 from app.config import settings
+from app.services.ocr import ocr_pool
 from openai import OpenAI
-from PIL import Image
-import pytesseract
 import logging
 import json
 import os
@@ -48,7 +47,7 @@ class ParserAgent(BaseAgent):
         
         try:
             # Step 1: Extract text using OCR (for images)
-            if file_type in ["image", "jpg", "jpeg", "png", "pdf"]:
+            if file_type in ["image", "jpg", "jpeg", "png", "pdf"] or file_type.startswith("image/"):
                 raw_text = await self._extract_text_ocr(file_path)
             else:
                 # For text files, read directly
@@ -78,11 +77,9 @@ class ParserAgent(BaseAgent):
             }
     
     async def _extract_text_ocr(self, file_path: str) -> str:
-        """Extract text from image using OCR"""
+        """Extract text from image using OCR, in the OCR worker pool"""
         try:
-            image = Image.open(file_path)
-            text = pytesseract.image_to_string(image)
-            return text
+            return await ocr_pool.extract_text(file_path)
         except Exception as e:
             logger.warning(f"OCR extraction failed: {e}, trying LLM vision")
             # Fallback to LLM vision API
@@ -117,6 +114,7 @@ class ParserAgent(BaseAgent):
         """Use LLM to parse and structure receipt data"""
         prompt = f"""Extract structured data from this receipt/invoice text. Return a JSON object with the following fields:
 - amount: float (total amount)
+- currency: string (ISO 4217 code, e.g. USD, EUR)
 - date: string (ISO format)
 - merchant: string (vendor/merchant name)
 - category: string (expense category: travel, meals, subscription, office_supplies, software, utilities, etc.)
@@ -170,6 +168,7 @@ Return ONLY valid JSON, no additional text."""
         # Ensure required fields exist
         validated = {
             "amount": data.get("amount", 0.0),
+            "currency": (data.get("currency") or settings.base_currency).upper(),
             "date": data.get("date", ""),
             "merchant": data.get("merchant", "Unknown"),
             "category": data.get("category", "uncategorized"),
@@ -178,6 +177,9 @@ Return ONLY valid JSON, no additional text."""
             "total": data.get("total", data.get("amount", 0.0)),
             "confidence": data.get("confidence", 0.5),
         }
+        # Keep the failure visible so the parse is not cached for identical files
+        if data.get("error"):
+            validated["error"] = data["error"]
         
         return validated
 
@@ -0,0 +1,106 @@
+"""
+Pattern Agent - Detects threshold splitting and suspicious amount distributions
+"""
+from typing import Dict, Any, List
+from datetime import timedelta
+from app.agents.base import BaseAgent
+from app.config import settings
+from app.database import SessionLocal
+from app.services import stats
+from app.services.anomaly_scoring import parse_date
+from app.services.fx import base_amount_of
+from app.services.patterns import (
+    alert_payload,
+    digit_findings,
+    digit_period,
+    find_splits,
+    first_digit,
+    is_round_amount,
+    load_frame,
+    transactions_by_id,
+    unreported,
+)
+from app.services.profiles import profile_cache
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class PatternAgent(BaseAgent):
+    """Agent responsible for multi-transaction spending patterns"""
+
+    async def execute(self, input_data: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Check the user's recent history for patterns involving a new transaction
+
+        Args:
+            input_data: {
+                "transaction": {
+                    "id": int,
+                    "user_id": int,
+                    ...
+                }
+            }
+
+        Returns findings plus NotifierAgent payloads for the ones not yet alerted.
+
+        Only the split window around the transaction is read from the
+        database; round-amount and Benford checks use the running counts of
+        the user's cached profile.
+        """
+        transaction = input_data.get("transaction", {})
+        user_id = transaction.get("user_id")
+        if not user_id:
+            return {"status": "success", "findings": [], "alerts": []}
+
+        db = SessionLocal()
+
+        try:
+            findings = []
+            df = None
+            date = stats.naive_utc(parse_date(transaction.get("date")))
+            if transaction.get("id") and date is not None:
+                # Any split sequence containing this transaction lies within one window of it
+                window = timedelta(hours=settings.split_window_hours)
+                df = load_frame(db, [user_id], date - window, date + window)
+                findings = [
+                    f for f in find_splits(df, settings.split_thresholds, settings.split_window_hours)
+                    if transaction["id"] in f["transaction_ids"]
+                ]
+            findings += self._digit_findings(db, transaction)
+
+            new_findings = unreported(db, findings)
+            transactions = transactions_by_id(
+                df, [f["transaction_ids"][-1] for f in new_findings if f.get("transaction_ids")]
+            ) if df is not None else {}
+
+            self.log(
+                f"Pattern check complete: {len(findings)} patterns, {len(new_findings)} new",
+                data={"user_id": user_id}
+            )
+
+            return {
+                "status": "success",
+                "findings": findings,
+                "alerts": [alert_payload(f, transactions) for f in new_findings],
+            }
+
+        except Exception as e:
+            self.log(f"Error detecting patterns: {str(e)}", level="ERROR")
+            return {"status": "error", "error": str(e), "findings": [], "alerts": []}
+        finally:
+            db.close()
+
+    def _digit_findings(self, db, transaction: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Round-amount and Benford findings from the profile counts plus this transaction"""
+        profile = profile_cache.get(db, transaction["user_id"])
+        count, round_count, digits = profile.category_rows, profile.round_rows, list(profile.digits)
+
+        # Profiles count a transaction once it is categorized, after the pipeline
+        amount = base_amount_of(transaction)
+        if not transaction.get("category") and amount:
+            count += 1
+            round_count += is_round_amount(amount)
+            digits[first_digit(amount)] += 1
+
+        return digit_findings(transaction["user_id"], count, round_count, digits[1:], digit_period())
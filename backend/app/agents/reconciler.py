@@ -1,15 +1,27 @@
 """
 Reconciler Agent - Matches receipts to transactions
 """
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Optional, List
 from app.agents.base import BaseAgent
+from sqlalchemy import func
 from sqlalchemy.orm import Session
+from app.config import settings
 from app.database import SessionLocal
 from app.models import Transaction, Receipt
+from app.services.anomaly_scoring import parse_date
+from app.services import stats
+from app.services.fx import base_amount_between, base_amount_of, fx_rates
+from app.services.merchants import merchant_index
+from app.services import reconciliation
+from datetime import datetime, timedelta
+import asyncio
 import logging
 
 logger = logging.getLogger(__name__)
 
+CANDIDATE_SCAN_LIMIT = 50  # Receipts closest in date, from the amount band, that are ranked
+AUTO_LINK_CONFIDENCE = 0.8  # Amount and merchant at least, for receipts found by reverse lookup
+
 
 class ReconcilerAgent(BaseAgent):
     """Agent responsible for reconciling receipts with transactions"""
@@ -24,33 +36,43 @@ class ReconcilerAgent(BaseAgent):
                 "transaction_id": int (optional),
                 OR
                 "transaction": dict,
-                "receipt_id": int (optional)
+                "receipt_id": int (optional),
+                "user_id": int (optional, owner of the receipt)
             }
+        
+        Without a transaction, the receipt owner's unreconciled transactions
+        are searched and ranked; the best one is linked if it matches.
+        Without a receipt, the transaction owner's unmatched receipts are
+        searched instead; the best one is linked only if it is confident
+        and unambiguous.
         """
         db = SessionLocal()
         
         try:
+            fx_rates.refresh(db)
             receipt_data = input_data.get("receipt")
             transaction_data = input_data.get("transaction")
             transaction_id = input_data.get("transaction_id")
             receipt_id = input_data.get("receipt_id")
+            user_id = input_data.get("user_id")
             
             # Get transaction and receipt from DB if IDs provided
             transaction = None
             receipt = None
             
-            if transaction_id:
-                transaction = db.query(Transaction).filter(Transaction.id == transaction_id).first()
-            
             if receipt_id:
                 receipt = db.query(Receipt).filter(Receipt.id == receipt_id).first()
                 if receipt:
-                    receipt_data = {
-                        "amount": receipt.amount,
-                        "date": receipt.date.isoformat() if receipt.date else None,
-                        "merchant": receipt.merchant,
-                        "total": receipt.total,
-                    }
+                    user_id = user_id or receipt.user_id
+                if receipt and not receipt_data:
+                    receipt_data = self._receipt_data(receipt)
+            
+            # Never pair a receipt with someone else's transaction
+            if transaction_id:
+                query = db.query(Transaction).filter(Transaction.id == transaction_id)
+                if user_id:
+                    query = query.filter(Transaction.user_id == user_id)
+                transaction = query.first()
             
             if not receipt_data and not transaction_data:
                 return {
@@ -58,6 +80,10 @@ class ReconcilerAgent(BaseAgent):
                     "error": "No receipt or transaction data provided",
                 }
             
+            # A new transaction without a receipt: look for one already on file
+            if transaction_data and not receipt_data and not receipt_id:
+                return self._reverse_lookup(db, transaction_data, transaction)
+            
             # If we have both, compare them
             if receipt_data and transaction_data:
                 match_result = self._match_receipt_transaction(receipt_data, transaction_data)
@@ -65,8 +91,7 @@ class ReconcilerAgent(BaseAgent):
                 if match_result["is_match"]:
                     # Update transaction with receipt link
                     if transaction:
-                        transaction.receipt_id = receipt.id if receipt else None
-                        transaction.is_reconciled = True
+                        self._link(transaction, receipt)
                         db.commit()
                     
                     self.log("Receipt matched with transaction", data=match_result)
@@ -82,15 +107,20 @@ class ReconcilerAgent(BaseAgent):
             # If we only have receipt, try to find matching transaction
             elif receipt_data and not transaction_data:
                 if transaction_id and transaction:
-                    match_result = self._match_receipt_transaction(receipt_data, {
-                        "amount": transaction.amount,
-                        "date": transaction.date.isoformat() if transaction.date else None,
-                        "merchant": transaction.merchant,
-                    })
+                    if user_id and transaction.user_id != user_id:
+                        return {
+                            "status": "success",
+                            "is_reconciled": False,
+                            "match_result": {
+                                "is_match": False,
+                                "reason": "Transaction belongs to another user",
+                            },
+                        }
+                    
+                    match_result = self._match_receipt_transaction(receipt_data, self._transaction_data(transaction))
                     
                     if match_result["is_match"]:
-                        transaction.receipt_id = receipt.id if receipt else None
-                        transaction.is_reconciled = True
+                        self._link(transaction, receipt)
                         db.commit()
                     
                     return {
@@ -99,31 +129,69 @@ class ReconcilerAgent(BaseAgent):
                         "match_result": match_result,
                     }
                 else:
+                    if not user_id:
+                        return {
+                            "status": "error",
+                            "error": "Receipt owner is required to search for a matching transaction",
+                        }
+                    
                     # Try to find transaction by matching criteria
-                    matching_transaction = self._find_matching_transaction(
-                        db, receipt_data
-                    )
+                    candidates = self._find_matching_transactions(db, receipt_data, user_id)
+                    summary = [
+                        {"transaction_id": txn.id, **match} for txn, match in candidates
+                    ]
                     
-                    if matching_transaction:
-                        matching_transaction.receipt_id = receipt.id if receipt else None
-                        matching_transaction.is_reconciled = True
+                    if candidates and candidates[0][1]["is_match"]:
+                        matching_transaction, match_result = candidates[0]
+                        self._link(matching_transaction, receipt)
                         db.commit()
                         
                         return {
                             "status": "success",
                             "is_reconciled": True,
                             "transaction_id": matching_transaction.id,
-                            "match_result": {"is_match": True, "confidence": 0.8},
+                            "match_result": match_result,
+                            "candidates": summary,
                         }
-                    else:
+                    
+                    # One receipt that may cover several charges, e.g. a hotel folio. Only
+                    # suggested here; the batch sweep links splits among all pending rows.
+                    split = reconciliation.find_split(
+                        db,
+                        user_id,
+                        (
+                            receipt_data.get("amount") or receipt_data.get("total"),
+                            (receipt_data.get("currency") or settings.base_currency).upper(),
+                            base_amount_of(receipt_data),
+                        ),
+                        receipt_data.get("merchant"),
+                        parse_date(receipt_data.get("date")),
+                    )
+                    if split:
+                        self.log("Receipt may cover split charges", data={"transaction_ids": [t.id for t in split]})
                         return {
                             "status": "success",
                             "is_reconciled": False,
                             "match_result": {
                                 "is_match": False,
-                                "reason": "No matching transaction found",
+                                "reason": "No single matching transaction found",
                             },
+                            "split_suggestion": {
+                                "transaction_ids": [t.id for t in split],
+                                "reason": f"Receipt amount equals the sum of {len(split)} charges",
+                            },
+                            "candidates": summary,
                         }
+                    
+                    return {
+                        "status": "success",
+                        "is_reconciled": False,
+                        "match_result": {
+                            "is_match": False,
+                            "reason": "No matching transaction found",
+                        },
+                        "candidates": summary,
+                    }
             
             return {
                 "status": "error",
@@ -140,12 +208,77 @@ class ReconcilerAgent(BaseAgent):
         finally:
             db.close()
     
+    async def reconcile_batch(self, user_id: Optional[int] = None, dry_run: bool = False) -> Dict[str, Any]:
+        """
+        Reconcile every pending receipt in one pass
+        
+        Unlike execute, receipts do not compete in arrival order: each user's
+        receipts and transactions are assigned jointly for the best total
+        match score.
+        """
+        try:
+            # Matching is CPU-bound, keep it off the event loop
+            result = await asyncio.to_thread(
+                self._in_session, reconciliation.reconcile_batch, user_id=user_id, dry_run=dry_run
+            )
+            self.log(
+                "Batch reconciliation complete",
+                data={"receipts": result["receipts"], "matched": result["matched"], "dry_run": dry_run}
+            )
+            return {"status": "success", **result}
+        except Exception as e:
+            self.log(f"Error in batch reconciliation: {str(e)}", level="ERROR")
+            return {"status": "error", "error": str(e)}
+    
+    async def sweep(self, dry_run: bool = False) -> Dict[str, Any]:
+        """
+        Incremental reconciliation of rows changed since the last sweep
+        
+        Returns NotifierAgent payloads for receipts that stayed unmatched
+        past the grace period.
+        """
+        try:
+            result = await asyncio.to_thread(self._in_session, reconciliation.sweep, dry_run=dry_run)
+            self.log(
+                "Reconciliation sweep complete",
+                data={
+                    "users": result["users"],
+                    "matched": result["matched"],
+                    "overdue": len(result["alerts"]),
+                    "dry_run": dry_run,
+                }
+            )
+            return {"status": "success", **result}
+        except Exception as e:
+            self.log(f"Error in reconciliation sweep: {str(e)}", level="ERROR")
+            return {"status": "error", "error": str(e)}
+    
+    async def mark_alerted(self, position: datetime, alerted: int) -> Dict[str, Any]:
+        """Advance the mismatch alert watermark once the sweep's alerts are persisted"""
+        try:
+            await asyncio.to_thread(
+                self._in_session, reconciliation.mark_alerted, position=position, alerted=alerted
+            )
+            return {"status": "success"}
+        except Exception as e:
+            self.log(f"Error advancing the alert watermark: {str(e)}", level="ERROR")
+            return {"status": "error", "error": str(e)}
+    
+    @staticmethod
+    def _in_session(job, **kwargs) -> Dict[str, Any]:
+        """Run a reconciliation job with a session of its own, for use from a worker thread"""
+        db = SessionLocal()
+        try:
+            return job(db, **kwargs)
+        finally:
+            db.close()
+    
     def _match_receipt_transaction(
         self, receipt: Dict[str, Any], transaction: Dict[str, Any]
     ) -> Dict[str, Any]:
-        """Match receipt data with transaction data"""
-        receipt_amount = receipt.get("amount") or receipt.get("total", 0.0)
-        transaction_amount = transaction.get("amount", 0.0)
+        """Match receipt data with transaction data, comparing amounts in the base currency"""
+        receipt_amount = base_amount_of(receipt)
+        transaction_amount = base_amount_of(transaction)
         
         receipt_merchant = (receipt.get("merchant") or "").lower().strip()
         transaction_merchant = (transaction.get("merchant") or "").lower().strip()
@@ -190,47 +323,165 @@ class ReconcilerAgent(BaseAgent):
         }
     
     def _fuzzy_merchant_match(self, merchant1: str, merchant2: str) -> bool:
-        """Fuzzy matching for merchant names"""
-        if not merchant1 or not merchant2:
-            return False
+        """Fuzzy matching for merchant names (normalized, trigram similarity)"""
+        return merchant_index.matches(merchant1, merchant2)
+    
+    def _reverse_lookup(
+        self, db: Session, transaction_data: Dict[str, Any], transaction: Optional[Transaction]
+    ) -> Dict[str, Any]:
+        """Link a new transaction to a receipt that was uploaded before it"""
+        user_id = transaction_data.get("user_id") or (transaction.user_id if transaction else None)
+        if not user_id:
+            return {"status": "error", "error": "Transaction owner is required to search for a receipt"}
         
-        # Simple substring matching
-        if merchant1 in merchant2 or merchant2 in merchant1:
-            return True
+        candidates = self._find_matching_receipts(db, transaction_data, user_id)
+        summary = [{"receipt_id": r.id, **match} for r, match in candidates]
         
-        # Word-based matching (if at least 2 words match)
-        words1 = set(merchant1.split())
-        words2 = set(merchant2.split())
-        common_words = words1.intersection(words2)
+        best = candidates[0][1] if candidates else None
+        confident = (
+            best is not None
+            and best["is_match"]
+            and best["confidence"] >= AUTO_LINK_CONFIDENCE
+            and (len(candidates) == 1 or candidates[1][1]["confidence"] < best["confidence"])
+        )
+        if not confident:
+            return {
+                "status": "success",
+                "is_reconciled": False,
+                "match_result": {"is_match": False, "reason": "No confident receipt match on file"},
+                "candidates": summary,
+            }
         
-        if len(common_words) >= 2:
-            return True
+        receipt = candidates[0][0]
+        if transaction is None and transaction_data.get("id"):
+            transaction = db.query(Transaction).filter(Transaction.id == transaction_data["id"]).first()
+        if transaction is None or transaction.is_reconciled:
+            return {
+                "status": "success",
+                "is_reconciled": False,
+                "match_result": {"is_match": False, "reason": "Transaction not found or already reconciled"},
+                "candidates": summary,
+            }
         
-        return False
+        self._link(transaction, receipt)
+        db.commit()
+        self.log("Transaction matched with receipt on file", data={"receipt_id": receipt.id, **best})
+        return {
+            "status": "success",
+            "is_reconciled": True,
+            "receipt_id": receipt.id,
+            "match_result": best,
+            "candidates": summary,
+        }
     
-    def _find_matching_transaction(
-        self, db: Session, receipt_data: Dict[str, Any]
-    ) -> Optional[Transaction]:
-        """Find transaction that matches receipt"""
-        receipt_amount = receipt_data.get("amount") or receipt_data.get("total", 0.0)
-        receipt_merchant = (receipt_data.get("merchant") or "").lower()
+    def _find_matching_receipts(
+        self, db: Session, transaction_data: Dict[str, Any], user_id: int
+    ) -> List[tuple]:
+        """
+        Rank the user's unmatched receipts that could belong to a transaction
+        
+        Candidates come from the (user_id, transaction_id, base_amount) index:
+        unmatched receipts in the 1% base-currency amount band, dated (or
+        uploaded, when undated) within the reconcile window of the
+        transaction. The CANDIDATE_SCAN_LIMIT closest in date are scored.
+        Returns up to reconcile_top_k (receipt, match_result) pairs, best
+        first.
+        """
+        amount = base_amount_of(transaction_data)
+        center = stats.naive_utc(parse_date(transaction_data.get("date"))) or datetime.utcnow()
+        window = timedelta(days=settings.reconcile_window_days)
+        tolerance = max(amount * 0.01, 0.01)
+        
+        receipt_date = func.coalesce(Receipt.date, Receipt.created_at)
+        query = db.query(Receipt).filter(
+            Receipt.user_id == user_id,
+            Receipt.transaction_id.is_(None),
+            base_amount_between(Receipt, amount - tolerance, amount + tolerance),
+            Receipt.is_processed == True,
+            receipt_date.between(center - window, center + window),
+        )
+        # Nearest first on each side of the transaction date, so the limit drops the farthest
+        receipts = query.filter(receipt_date >= center).order_by(
+            receipt_date, Receipt.id
+        ).limit(CANDIDATE_SCAN_LIMIT).all() + query.filter(receipt_date < center).order_by(
+            receipt_date.desc(), Receipt.id
+        ).limit(CANDIDATE_SCAN_LIMIT).all()
+        
+        nearest = []
+        for receipt in receipts:
+            date = stats.naive_utc(receipt.date or receipt.created_at)
+            nearest.append((receipt, abs((date - center).total_seconds()) / 86400))
+        nearest.sort(key=lambda c: c[1])
+        
+        ranked = []
+        for receipt, days in nearest[:CANDIDATE_SCAN_LIMIT]:
+            match = self._match_receipt_transaction(self._receipt_data(receipt), transaction_data)
+            ranked.append((receipt, match, days))
+        
+        ranked.sort(key=lambda c: (-c[1]["confidence"], c[1]["amount_diff"], c[2]))
+        return [(receipt, match) for receipt, match, _ in ranked[:settings.reconcile_top_k]]
+    
+    def _receipt_data(self, receipt: Receipt) -> Dict[str, Any]:
+        return {
+            "amount": receipt.amount,
+            "currency": receipt.currency,
+            "base_amount": receipt.base_amount,
+            "date": receipt.date.isoformat() if receipt.date else None,
+            "merchant": receipt.merchant,
+            "total": receipt.total,
+        }
+    
+    def _transaction_data(self, transaction: Transaction) -> Dict[str, Any]:
+        return {
+            "amount": transaction.amount,
+            "currency": transaction.currency,
+            "base_amount": transaction.base_amount,
+            "date": transaction.date.isoformat() if transaction.date else None,
+            "merchant": transaction.merchant,
+        }
+    
+    def _link(self, transaction: Transaction, receipt: Optional[Receipt]):
+        """Link both sides of a match"""
+        transaction.is_reconciled = True
+        if receipt:
+            transaction.receipt_id = receipt.id
+            receipt.transaction_id = transaction.id
+    
+    def _find_matching_transactions(
+        self, db: Session, receipt_data: Dict[str, Any], user_id: int
+    ) -> List[tuple]:
+        """
+        Rank the user's unreconciled transactions that could match a receipt
+        
+        Candidates are read from the (user_id, is_reconciled, base_amount, date)
+        index: the base-currency amount band within 1%, dated within the
+        reconcile window of the receipt (or of today when the receipt has no
+        date). Returns up to reconcile_top_k (transaction, match_result)
+        pairs, best first.
+        """
+        receipt_amount = base_amount_of(receipt_data)
+        receipt_date = stats.naive_utc(parse_date(receipt_data.get("date")))
+        window = timedelta(days=settings.reconcile_window_days)
+        center = receipt_date or datetime.utcnow()
         
         # Find transactions with similar amount (within 1%)
         tolerance = max(receipt_amount * 0.01, 0.01)
         transactions = db.query(Transaction).filter(
-            Transaction.amount >= receipt_amount - tolerance,
-            Transaction.amount <= receipt_amount + tolerance,
+            Transaction.user_id == user_id,
             Transaction.is_reconciled == False,
-        ).all()
+            base_amount_between(Transaction, receipt_amount - tolerance, receipt_amount + tolerance),
+            Transaction.date >= center - window,
+            Transaction.date <= center + window,
+        ).limit(CANDIDATE_SCAN_LIMIT).all()
         
-        # Filter by merchant if available
-        if receipt_merchant:
-            for txn in transactions:
-                if self._fuzzy_merchant_match(receipt_merchant, (txn.merchant or "").lower()):
-                    return txn
+        ranked = []
+        for txn in transactions:
+            match = self._match_receipt_transaction(receipt_data, self._transaction_data(txn))
+            days = abs((stats.naive_utc(txn.date) - center).total_seconds()) / 86400 if txn.date else 0.0
+            ranked.append((txn, match, days))
         
-        # Return first match if no merchant match
-        return transactions[0] if transactions else None
+        ranked.sort(key=lambda c: (-c[1]["confidence"], c[1]["amount_diff"], c[2]))
+        return [(txn, match) for txn, match, _ in ranked[:settings.reconcile_top_k]]
     
     def _generate_mismatch_reason(
         self, amount_match: bool, merchant_match: bool, date_match: bool
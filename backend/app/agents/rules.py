@@ -0,0 +1,95 @@
+"""
+Rules Agent - Evaluates configurable fraud rules before any LLM step
+"""
+from typing import Dict, Any
+from app.agents.base import BaseAgent
+from app.database import SessionLocal
+from app.models import User
+from app.services.anomaly_scoring import parse_date
+from app.services.rules import rule_engine, build_context
+from app.services.velocity import WINDOWS, velocity_tracker
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class RulesAgent(BaseAgent):
+    """Agent responsible for evaluating finance-defined fraud rules"""
+
+    async def execute(self, input_data: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Evaluate the active fraud rules against a transaction
+
+        Args:
+            input_data: {
+                "transaction": {
+                    "id": int,
+                    "amount": float,
+                    "merchant": str,
+                    "category": str (optional),
+                    "user_id": int,
+                    "date": str
+                },
+                "stage": "pre" | "post" (optional, default all rules),
+                "classification": dict (optional, ClassifierAgent result)
+            }
+
+        The "pre" stage runs before classification and skips rules on the
+        category; the "post" stage runs those with the classified category.
+        """
+        transaction = input_data.get("transaction", {})
+        stage = input_data.get("stage")
+        classified = (input_data.get("classification") or {}).get("classification") or {}
+        if classified.get("category") and not transaction.get("category"):
+            transaction = {**transaction, "category": classified["category"]}
+
+        db = SessionLocal()
+
+        try:
+            rule_engine.refresh(db)
+            if stage == "post" and not rule_engine.uses_classification:
+                return {"status": "success", "matched_rules": [], "risk_score": 0.0, "severity": None, "flag": False}
+
+            user_role = None
+            if transaction.get("user_id"):
+                user_role = db.query(User.role).filter(User.id == transaction["user_id"]).scalar()
+
+            velocity = self._get_velocity(transaction) if rule_engine.uses_velocity else None
+
+            context = build_context(transaction, user_role, velocity)
+            evaluation = rule_engine.evaluate(context, stage)
+
+            self.log(
+                f"Evaluated {len(rule_engine.rules)} rules, {len(evaluation['matched_rules'])} matched",
+                data={"risk_score": evaluation["risk_score"]}
+            )
+
+            return {"status": "success", **evaluation}
+
+        except Exception as e:
+            self.log(f"Error evaluating fraud rules: {str(e)}", level="ERROR")
+            return {
+                "status": "error",
+                "error": str(e),
+                "matched_rules": [],
+                "risk_score": 0.0,
+                "severity": None,
+                "flag": False,
+            }
+        finally:
+            db.close()
+
+    def _get_velocity(self, transaction: Dict[str, Any]) -> Dict[str, float]:
+        """User and user-merchant counts and sums in the trailing windows"""
+        date = parse_date(transaction.get("date"))
+        if not transaction.get("user_id") or date is None:
+            return {}
+
+        velocity = velocity_tracker.lookup(transaction["user_id"], transaction.get("merchant"), date)
+        fields = {}
+        for label in WINDOWS:
+            fields[f"velocity_count_{label}"] = float(velocity["user"][label]["count"])
+            fields[f"velocity_amount_{label}"] = float(velocity["user"][label]["amount"])
+            fields[f"user_merchant_velocity_count_{label}"] = float(velocity["pair"][label]["count"])
+
+        return fields
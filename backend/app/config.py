@@ -2,7 +2,7 @@
 Application configuration
 """
 from pydantic_settings import BaseSettings
-from typing import Optional
+from typing import Optional, List
 
 
 class Settings(BaseSettings):
@@ -23,10 +23,35 @@ class Settings(BaseSettings):
     # Storage
     upload_dir: str = "./uploads"
     receipt_dir: str = "./uploads/receipts"
+    receipt_max_bytes: int = 20 * 1024 * 1024  # Larger receipt uploads are rejected with 413
+    receipt_content_types: List[str] = ["image/jpeg", "image/png", "application/pdf", "text/plain"]  # Others get 415
+    
+    model_dir: str = "./models"
+    velocity_snapshot_path: str = "./models/velocity.json"  # One file per deployment; velocity assumes a single API worker
     
     # Agent Settings
     anomaly_threshold: float = 2.0  # Z-score threshold for anomaly detection
+    anomaly_history_days: int = 90  # History window used for anomaly baselines
     confidence_threshold: float = 0.7  # Minimum confidence for auto-classification
+    profile_cache_max_bytes: int = 64 * 1024 * 1024  # Memory budget for cached user behaviour profiles
+    profile_ttl_seconds: int = 3600  # Profiles are rebuilt after this long so old history ages out
+    anomaly_model_reload_seconds: int = 30  # How often workers check for a newly published anomaly model
+    duplicate_window_days: int = 30  # How far back new transactions are checked for duplicates
+    velocity_snapshot_seconds: int = 60  # How often velocity counters are snapshotted to disk
+    peer_baseline_refresh_seconds: int = 300  # How often workers reload peer-group baselines
+    split_thresholds: List[float] = [500.0, 1000.0, 5000.0]  # Approval limits checked for purchase splitting
+    split_window_hours: int = 48  # Charges this close together count as one split purchase
+    rules_refresh_seconds: int = 30  # How often workers reload fraud rules from the database
+    reconcile_window_days: int = 7  # Receipts match transactions dated within this many days
+    reconcile_top_k: int = 5  # Ranked candidates returned by receipt matching
+    reconcile_sweep_seconds: int = 300  # How often the reconciliation sweeper runs, 0 disables it
+    reconcile_grace_hours: int = 72  # Unmatched receipts are alerted on only after this long
+    reconcile_group_max_items: int = 4  # Most charges (or receipts) one split (or combined) match may cover
+    reconcile_group_timeout_ms: int = 20  # Time limit of one split/combined subset search
+    reconcile_group_budget_ms: int = 200  # Time limit of all split/combined searches for one user per run
+    base_currency: str = "USD"  # Matching and anomaly statistics use amounts converted to this currency
+    fx_refresh_seconds: int = 300  # How often workers reload FX rates from the database
+    ocr_workers: int = 0  # Concurrent tesseract jobs per API process, 0 = one per CPU core
     
     # LLM Settings
     model_name: str = "gpt-4-turbo-preview"
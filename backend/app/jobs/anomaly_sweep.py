@@ -0,0 +1,135 @@
+"""
+Re-score every transaction in a date range with the vectorized anomaly checks
+
+Usage: python -m app.jobs.anomaly_sweep [--days N] [--users-per-chunk N] [--dry-run]
+"""
+from typing import Dict, Any, List, Set
+from datetime import datetime, timedelta
+from sqlalchemy.orm import Session
+from app.config import settings
+from app.database import SessionLocal
+from app.models import Feedback, Transaction
+from app.services.anomaly_scoring import load_history, results_from_scores, score_batch
+import argparse
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def _user_chunks(db: Session, start: datetime, end: datetime, users_per_chunk: int) -> List[List[int]]:
+    user_ids = [
+        user_id
+        for (user_id,) in db.query(Transaction.user_id)
+        .filter(Transaction.date >= start, Transaction.date <= end)
+        .distinct()
+        .order_by(Transaction.user_id)
+    ]
+    return [user_ids[i:i + users_per_chunk] for i in range(0, len(user_ids), users_per_chunk)]
+
+
+def _marked_normal(db: Session, transaction_ids: List[int]) -> Set[int]:
+    """Transactions a user has confirmed are not anomalous"""
+    marked = set()
+    for i in range(0, len(transaction_ids), 500):
+        rows = db.query(Feedback.transaction_id, Feedback.corrected_value).filter(
+            Feedback.feedback_type == "anomaly",
+            Feedback.transaction_id.in_(transaction_ids[i:i + 500]),
+        )
+        for transaction_id, corrected in rows:
+            if isinstance(corrected, dict) and corrected.get("is_anomaly") is False:
+                marked.add(transaction_id)
+    return marked
+
+
+def sweep(days: int = 90, users_per_chunk: int = 500, dry_run: bool = False) -> Dict[str, Any]:
+    """
+    Score each transaction in the range against its user's earlier history
+
+    Every row sees only the anomaly_history_days before its own date, as
+    the live pipeline did. Users are processed in chunks, so memory is
+    bounded by the history of one chunk of users; each chunk is loaded
+    once, scored with the batch kernel and written back in one commit.
+
+    Results go to the sweep_* columns only: flags written by the live
+    pipeline (duplicates, velocity, model, graph) and user feedback stay
+    as they are, and transactions users marked as normal are not swept.
+    """
+    end = datetime.utcnow()
+    start = end - timedelta(days=days)
+    history_start = start - timedelta(days=settings.anomaly_history_days)
+    started = time.perf_counter()
+    scored = 0
+    anomalies = 0
+    skipped = 0
+
+    db = SessionLocal()
+
+    try:
+        chunks = _user_chunks(db, start, end, users_per_chunk)
+        for number, user_ids in enumerate(chunks, 1):
+            history = load_history(db, user_ids, history_start, end)
+            in_range = history["time"] >= (start - datetime(1970, 1, 1)).total_seconds()
+            batch = {name: values[in_range] for name, values in history.items()}
+            if len(batch["id"]) == 0:
+                continue
+
+            scores = score_batch(batch, history, as_of=True)
+            marked = _marked_normal(db, batch["id"].tolist())
+            results = [r for r in results_from_scores(scores, batch) if r["id"] not in marked]
+
+            if not dry_run:
+                swept_at = datetime.utcnow()
+                db.bulk_update_mappings(Transaction, [
+                    {
+                        "id": result["id"],
+                        "sweep_anomaly": result["is_anomaly"],
+                        "sweep_score": result["risk_score"],
+                        "sweep_reason": result["reason"],
+                        "swept_at": swept_at,
+                    }
+                    for result in results
+                ])
+                db.commit()
+
+            scored += len(results)
+            skipped += len(batch["id"]) - len(results)
+            anomalies += sum(1 for r in results if r["is_anomaly"])
+            logger.info(f"Chunk {number}/{len(chunks)}: {len(results)} transactions scored")
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+    elapsed = time.perf_counter() - started
+    return {
+        "transactions": scored,
+        "anomalies": anomalies,
+        "skipped_feedback": skipped,
+        "chunks": len(chunks),
+        "seconds": elapsed,
+        "rows_per_second": scored / elapsed if elapsed > 0 else 0.0,
+        "dry_run": dry_run,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-score transactions into the sweep_* columns")
+    parser.add_argument("--days", type=int, default=90, help="Sweep transactions from the last N days")
+    parser.add_argument("--users-per-chunk", type=int, default=500, help="Users loaded and committed together")
+    parser.add_argument("--dry-run", action="store_true", help="Score without writing results")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    summary = sweep(days=args.days, users_per_chunk=args.users_per_chunk, dry_run=args.dry_run)
+    print(
+        f"Scored {summary['transactions']} transactions in {summary['chunks']} chunks "
+        f"({summary['rows_per_second']:.0f} rows/s), {summary['anomalies']} anomalies, "
+        f"{summary['skipped_feedback']} marked normal by users"
+        + (" [dry run]" if summary["dry_run"] else "")
+    )
+
+
+if __name__ == "__main__":
+    main()
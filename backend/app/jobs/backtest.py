@@ -0,0 +1,87 @@
+"""
+Backtest anomaly and decision configurations against labeled history
+
+Usage: python -m app.jobs.backtest [--days N] [--config FILE] [--batch-size N]
+           [--min-precision P] [--min-recall R] [--min-rows-per-second N] [--max-p95-ms MS]
+
+--config is a JSON file holding one configuration or a list of them, e.g.
+[{"name": "current"}, {"name": "strict", "anomaly_threshold": 2.5, "weights": {"time": 0.1}}]
+"""
+from datetime import datetime, timedelta
+from app.database import SessionLocal
+from app.services.backtest import DEFAULT_BATCH_SIZE, check_budget, load_dataset, run
+import argparse
+import json
+import logging
+import sys
+
+
+def _print_report(name: str, report: dict, violations: list):
+    print(f"\n== {name} ==")
+    for target in ("anomaly", "alert"):
+        m = report[target]
+        print(
+            f"  {target:8s} precision {m['precision']:.3f}  recall {m['recall']:.3f}  f1 {m['f1']:.3f}  "
+            f"(tp {m['true_positives']}, fp {m['false_positives']}, fn {m['false_negatives']})"
+        )
+    latency = report["latency_ms"]
+    print(
+        f"  throughput {report['rows_per_second']:.0f} rows/s, batch latency p50 {latency['p50']:.1f}ms "
+        f"p95 {latency['p95']:.1f}ms ({report['batch_size']} rows/batch)"
+    )
+    print("  budget: " + ("OK" if not violations else "FAILED - " + "; ".join(violations)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay labeled history through the scoring stack")
+    parser.add_argument("--days", type=int, default=180, help="Backtest transactions from the last N days")
+    parser.add_argument("--config", help="JSON file with one configuration or a list of them")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--target", choices=["anomaly", "alert"], default="alert", help="Metrics the budget applies to")
+    parser.add_argument("--min-precision", type=float)
+    parser.add_argument("--min-recall", type=float)
+    parser.add_argument("--min-rows-per-second", type=float)
+    parser.add_argument("--max-p95-ms", type=float)
+    args = parser.parse_args()
+
+    configs = [{"name": "current"}]
+    if args.config:
+        with open(args.config) as f:
+            loaded = json.load(f)
+        configs = loaded if isinstance(loaded, list) else [loaded]
+
+    budget = {
+        "min_precision": args.min_precision,
+        "min_recall": args.min_recall,
+        "min_rows_per_second": args.min_rows_per_second,
+        "max_p95_ms": args.max_p95_ms,
+    }
+
+    logging.basicConfig(level=logging.INFO)
+    end = datetime.utcnow()
+    db = SessionLocal()
+
+    try:
+        dataset = load_dataset(db, end - timedelta(days=args.days), end)
+    finally:
+        db.close()
+
+    print(f"Loaded {len(dataset['label'])} labeled transactions ({int(dataset['label'].sum())} positive)")
+    if len(dataset["label"]) == 0:
+        return
+
+    failed = False
+    for number, config in enumerate(configs, 1):
+        config = dict(config)
+        name = config.pop("name", f"config {number}")
+        report = run(dataset, config, batch_size=args.batch_size)
+        violations = check_budget(report, budget, target=args.target)
+        failed = failed or bool(violations)
+        _print_report(name, report, violations)
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
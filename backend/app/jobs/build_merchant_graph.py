@@ -0,0 +1,37 @@
+"""
+Rebuild the user-merchant graph, intended to run nightly (e.g. from cron)
+
+Usage: python -m app.jobs.build_merchant_graph [--chunk-size N] [--output PATH]
+"""
+from app.database import SessionLocal
+from app.services.merchant_graph import build_graph, graph_store
+import argparse
+import logging
+import time
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild the user-merchant graph snapshot")
+    parser.add_argument("--chunk-size", type=int, default=10000, help="Rows fetched per database round-trip")
+    parser.add_argument("--output", default=graph_store.path, help="Where to write the snapshot")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    db = SessionLocal()
+
+    try:
+        started = time.perf_counter()
+        graph = build_graph(db, chunk_size=args.chunk_size)
+        graph.save(args.output)
+        print(
+            f"Built graph of {len(graph.user_ids)} users, {len(graph.merchants)} merchants and "
+            f"{graph.edge_total} edges in {time.perf_counter() - started:.1f}s"
+        )
+    except Exception as e:
+        print(f"Error building merchant graph: {e}")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
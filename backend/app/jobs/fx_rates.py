@@ -0,0 +1,135 @@
+"""
+Load FX rates from a CSV file and backfill base-currency amounts
+
+Usage: python -m app.jobs.fx_rates [--file PATH] [--backfill] [--chunk-size N]
+
+A backfill changes the amounts user statistics are built from. Statistics
+rows of the affected users are dropped and reseeded on next use, but the
+API keeps its own profile cache: restart it, or invalidate the cache, after
+a backfill. Peer baselines pick up the new amounts on their next run.
+"""
+from typing import Dict, List
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from app.database import SessionLocal
+from app.models import FxRate, Receipt, Transaction, UserCategoryStats
+from app.services.fx import RateRow, day_ordinal, fx_rates, read_rates_file
+import numpy as np
+import argparse
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# SQLite limits the number of bound parameters per statement
+_IN_CLAUSE_CHUNK = 500
+
+
+def load_rates(db: Session, rows: List[RateRow]) -> Dict[str, int]:
+    """Insert new (currency, date) rates and update existing ones, in one commit"""
+    existing = {
+        (currency, date.replace(tzinfo=None)): rate_id
+        for rate_id, currency, date in db.query(FxRate.id, FxRate.currency, FxRate.date)
+    }
+    inserts, updates = {}, {}
+    for currency, date, rate in rows:
+        key = (currency, date.replace(tzinfo=None))
+        rate_id = existing.get(key)
+        if rate_id is None:
+            inserts[key] = {"currency": currency, "date": date, "rate": rate}
+        else:
+            updates[rate_id] = {"id": rate_id, "rate": rate}
+
+    try:
+        db.bulk_insert_mappings(FxRate, list(inserts.values()))
+        db.bulk_update_mappings(FxRate, list(updates.values()))
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return {"inserted": len(inserts), "updated": len(updates)}
+
+
+def backfill(db: Session, model, chunk_size: int = 10000) -> Dict[str, int]:
+    """
+    Set base_amount on transactions or receipts that have none
+
+    Rows are converted at their own date, a chunk at a time with one bulk
+    update per chunk. Rows in a currency without rates stay empty and keep
+    falling back to their raw amount. Category statistics of users whose
+    transactions changed are deleted with each chunk, to be reseeded from
+    the new amounts.
+    """
+    if model is Receipt:
+        amount = func.coalesce(Receipt.amount, Receipt.total)
+        date = func.coalesce(Receipt.date, Receipt.created_at)
+    else:
+        amount, date = Transaction.amount, Transaction.date
+
+    converted, missing, last_id = 0, 0, 0
+    while True:
+        rows = db.query(model.id, amount, model.currency, date, model.user_id).filter(
+            model.base_amount.is_(None),
+            amount.isnot(None),
+            model.id > last_id,
+        ).order_by(model.id).limit(chunk_size).all()
+        if not rows:
+            break
+        last_id = rows[-1][0]
+
+        base = fx_rates.convert_many(
+            np.array([r[1] for r in rows], dtype=np.float64),
+            [r[2] for r in rows],
+            np.array([day_ordinal(r[3]) for r in rows], dtype=np.int64),
+        )
+        known = ~np.isnan(base)
+        db.bulk_update_mappings(model, [
+            {"id": r[0], "base_amount": float(value)}
+            for r, value, ok in zip(rows, base, known)
+            if ok
+        ])
+        if model is Transaction:
+            user_ids = sorted({r[4] for r, ok in zip(rows, known) if ok})
+            for i in range(0, len(user_ids), _IN_CLAUSE_CHUNK):
+                db.query(UserCategoryStats).filter(
+                    UserCategoryStats.user_id.in_(user_ids[i:i + _IN_CLAUSE_CHUNK])
+                ).delete(synchronize_session=False)
+        db.commit()
+        converted += int(known.sum())
+        missing += int((~known).sum())
+    return {"converted": converted, "missing_rate": missing}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load FX rates and backfill base-currency amounts")
+    parser.add_argument("--file", help="CSV with date, currency and rate columns")
+    parser.add_argument("--backfill", action="store_true", help="Convert rows without a base amount")
+    parser.add_argument("--chunk-size", type=int, default=10000, help="Rows converted per commit")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    db = SessionLocal()
+
+    try:
+        started = time.perf_counter()
+        if args.file:
+            result = load_rates(db, read_rates_file(args.file))
+            print(f"Loaded rates from {args.file}: {result['inserted']} new, {result['updated']} updated")
+
+        if args.backfill:
+            fx_rates.refresh(db, force=True)
+            for model in (Transaction, Receipt):
+                result = backfill(db, model, chunk_size=args.chunk_size)
+                print(
+                    f"Backfilled {result['converted']} {model.__tablename__}, "
+                    f"{result['missing_rate']} without a rate for their currency"
+                )
+        print(f"Done in {time.perf_counter() - started:.1f}s")
+    except Exception as e:
+        print(f"Error updating FX data: {e}")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Scan transaction history for spending patterns and raise alerts
+
+Usage: python -m app.jobs.pattern_scan [--days N] [--users-per-chunk N] [--dry-run]
+"""
+from typing import Dict, Any
+from datetime import datetime, timedelta
+from app.agents.notifier import NotifierAgent
+from app.database import SessionLocal
+from app.models import Transaction
+from app.services.patterns import (
+    alert_payload,
+    detect,
+    load_frame,
+    transactions_by_id,
+    unreported,
+)
+import argparse
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+async def scan(days: int = 90, users_per_chunk: int = 500, dry_run: bool = False) -> Dict[str, Any]:
+    """Detect patterns per chunk of users and alert on the ones not yet reported"""
+    start = datetime.utcnow() - timedelta(days=days)
+    notifier = NotifierAgent("Notifier")
+    found = 0
+    alerted = 0
+
+    db = SessionLocal()
+
+    try:
+        user_ids = [
+            user_id
+            for (user_id,) in db.query(Transaction.user_id)
+            .filter(Transaction.date >= start)
+            .distinct()
+            .order_by(Transaction.user_id)
+        ]
+        for i in range(0, len(user_ids), users_per_chunk):
+            df = load_frame(db, user_ids[i:i + users_per_chunk], start)
+            findings = detect(df)
+            new_findings = unreported(db, findings)
+            found += len(findings)
+
+            if dry_run:
+                for finding in new_findings:
+                    print(f"[{finding['pattern']}] user {finding['user_id']}: {finding['description']}")
+                continue
+
+            transactions = transactions_by_id(
+                df, [f["transaction_ids"][-1] for f in new_findings if f.get("transaction_ids")]
+            )
+            for finding in new_findings:
+                result = await notifier.execute(alert_payload(finding, transactions))
+                if result.get("status") == "success":
+                    alerted += 1
+    finally:
+        db.close()
+
+    return {"users": len(user_ids), "patterns": found, "alerts": alerted, "dry_run": dry_run}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Scan history for splitting, round-amount and Benford patterns")
+    parser.add_argument("--days", type=int, default=90, help="Scan transactions from the last N days")
+    parser.add_argument("--users-per-chunk", type=int, default=500)
+    parser.add_argument("--dry-run", action="store_true", help="Print findings without creating alerts")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    summary = asyncio.run(scan(days=args.days, users_per_chunk=args.users_per_chunk, dry_run=args.dry_run))
+    print(
+        f"Scanned {summary['users']} users: {summary['patterns']} patterns, {summary['alerts']} alerts created"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,31 @@
+"""
+Recompute peer-group baselines, intended to run nightly (e.g. from cron)
+
+Usage: python -m app.jobs.peer_baselines [--chunk-size N]
+"""
+from app.database import SessionLocal
+from app.services.peer_baselines import compute_baselines
+import argparse
+import logging
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recompute peer-group anomaly baselines")
+    parser.add_argument("--chunk-size", type=int, default=5000, help="Rows fetched per database round-trip")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    db = SessionLocal()
+
+    try:
+        count = compute_baselines(db, chunk_size=args.chunk_size)
+        print(f"Computed {count} peer baselines")
+    except Exception as e:
+        print(f"Error computing peer baselines: {e}")
+        db.rollback()
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
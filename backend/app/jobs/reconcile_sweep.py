@@ -0,0 +1,33 @@
+"""
+Run one incremental reconciliation sweep, e.g. from cron when the API's
+periodic sweeper is disabled (RECONCILE_SWEEP_SECONDS=0)
+
+Usage: python -m app.jobs.reconcile_sweep [--dry-run]
+"""
+from app.agents.orchestrator import AgentOrchestrator
+import argparse
+import asyncio
+import logging
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Link receipts and transactions changed since the last sweep")
+    parser.add_argument("--dry-run", action="store_true", help="Match without linking, alerting or moving watermarks")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    result = asyncio.run(AgentOrchestrator().sweep_receipts(dry_run=args.dry_run))
+    if result.get("status") != "success":
+        print(f"Error in reconciliation sweep: {result.get('error')}")
+        raise SystemExit(1)
+
+    print(
+        f"Swept {result['users']} users: {result['matched']} of {result['receipts']} pending receipts linked, "
+        f"{len(result['alerts'])} past the grace period, {result['alerted']} alerts created "
+        f"in {result['seconds']:.2f}s"
+        + (" [dry run]" if result["dry_run"] else "")
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""
+Train the Isolation Forest anomaly model from transaction history
+
+Usage: python -m app.jobs.train_anomaly_model [--chunk-size N] [--sample-size N]
+"""
+from typing import Iterator, Tuple, Dict, Any
+from collections import deque
+from datetime import timedelta
+from sqlalchemy.orm import Session
+from sklearn.ensemble import IsolationForest
+from app.config import settings
+from app.database import SessionLocal
+from app.models import Transaction, TransactionStatus
+from app.services import anomaly_model, stats
+from app.services.fx import base_amount_column
+from app.services.profiles import UserProfile
+import numpy as np
+import argparse
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+
+def stream_features(db: Session, chunk_size: int) -> Iterator[np.ndarray]:
+    """
+    Yield point-in-time feature vectors for every counted transaction
+
+    Rows are streamed in (user, date) order, so only the current user's
+    rolling window is held in memory.
+    """
+    window = timedelta(days=settings.anomaly_history_days)
+    query = db.query(
+        Transaction.id,
+        Transaction.user_id,
+        base_amount_column(),
+        Transaction.category,
+        Transaction.merchant,
+        Transaction.date,
+    ).filter(
+        Transaction.status != TransactionStatus.REJECTED.value,
+        Transaction.category.isnot(None),
+        Transaction.amount.isnot(None),
+        Transaction.date.isnot(None),
+    ).order_by(Transaction.user_id, Transaction.date, Transaction.id).yield_per(chunk_size)
+
+    profile = None
+    recent: deque = deque()
+    for row in query:
+        date = stats.naive_utc(row.date)
+        if profile is None or profile.user_id != row.user_id:
+            profile = UserProfile(row.user_id, date - window)
+            recent.clear()
+
+        while recent and recent[0]["date"] < date - window:
+            profile.apply(recent.popleft(), -1)
+
+        yield np.array(
+            anomaly_model.transaction_features(row.amount, date, row.merchant, row.category, profile)
+        )
+
+        snap = {"merchant": row.merchant, "category": row.category, "amount": row.amount, "date": date}
+        profile.apply(snap, 1)
+        recent.append(snap)
+
+
+def reservoir_sample(rows: Iterator[np.ndarray], size: int, seed: int) -> Tuple[np.ndarray, int]:
+    """Uniform sample of at most `size` rows from a stream of unknown length"""
+    rng = np.random.default_rng(seed)
+    sample = np.empty((size, len(anomaly_model.FEATURES)))
+    seen = 0
+    for row in rows:
+        if seen < size:
+            sample[seen] = row
+        else:
+            slot = rng.integers(0, seen + 1)
+            if slot < size:
+                sample[slot] = row
+        seen += 1
+    return sample[: min(seen, size)], seen
+
+
+def train(
+    chunk_size: int = 5000,
+    sample_size: int = 200000,
+    n_estimators: int = 100,
+    contamination: str = "auto",
+    seed: int = 42,
+) -> Dict[str, Any]:
+    """Fit a model on sampled history and publish it"""
+    db = SessionLocal()
+
+    try:
+        sample, seen = reservoir_sample(stream_features(db, chunk_size), sample_size, seed)
+    finally:
+        db.close()
+
+    if len(sample) < 2:
+        raise ValueError(f"Not enough transactions to train on ({seen})")
+
+    model = IsolationForest(
+        n_estimators=n_estimators,
+        contamination=contamination if contamination == "auto" else float(contamination),
+        random_state=seed,
+    ).fit(sample)
+    forest = anomaly_model.CompiledForest.from_sklearn(model)
+
+    # Compiled scores must reproduce sklearn's before they are published
+    check = sample[: min(len(sample), 1000)]
+    if not np.allclose(forest.score(check), -model.score_samples(check)):
+        raise RuntimeError("Compiled forest does not match the trained model")
+
+    return anomaly_model.publish(
+        anomaly_model.registry.directory,
+        forest,
+        # sklearn flags samples whose score_samples fall below offset_
+        threshold=float(-model.offset_),
+        metadata={
+            "transactions_seen": seen,
+            "samples": len(sample),
+            "n_estimators": n_estimators,
+            "contamination": contamination,
+        },
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train the anomaly detection model")
+    parser.add_argument("--chunk-size", type=int, default=5000, help="Rows fetched per database round-trip")
+    parser.add_argument("--sample-size", type=int, default=200000, help="Maximum rows kept for training")
+    parser.add_argument("--n-estimators", type=int, default=100)
+    parser.add_argument("--contamination", default="auto")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    manifest = train(
+        chunk_size=args.chunk_size,
+        sample_size=args.sample_size,
+        n_estimators=args.n_estimators,
+        contamination=args.contamination,
+        seed=args.seed,
+    )
+    print(f"Published anomaly model {manifest['version']} ({manifest['samples']} samples)")
+    print(f"Location: {os.path.join(anomaly_model.registry.directory, manifest['artifact'])}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,11 @@
 """
 Main FastAPI application entry point
 """
-from fastapi import FastAPI
+from fastapi import FastAPI, Request, status
 from fastapi.middleware.cors import CORSMiddleware
-from app.database import engine, Base
+from fastapi.responses import JSONResponse
+from app.config import settings
+from app.database import engine, Base, SessionLocal
 from app.routers import (
     auth,
     transactions,
@@ -13,7 +15,20 @@ from app.routers import (
     feedback,
     integrations,
     dashboard,
+    rules,
+    simulations,
 )
+from app.agents.orchestrator import AgentOrchestrator
+from app.services.fx import fx_rates
+from app.services.merchants import merchant_index
+from app.services.ocr import ocr_pool
+from app.services.velocity import velocity_tracker
+import asyncio
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+orchestrator = AgentOrchestrator()
 
 # Create database tables
 Base.metadata.create_all(bind=engine)
@@ -24,7 +39,19 @@ app = FastAPI(
     version="1.0.0",
 )
 
-# CORS middleware
+
+@app.middleware("http")
+async def reject_oversized_receipts(request: Request, call_next):
+    """Refuse receipt uploads by their declared size, before the multipart body is parsed"""
+    if receipts.declared_too_large(request):
+        return JSONResponse(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            content={"detail": f"Receipt files are limited to {settings.receipt_max_bytes} bytes"},
+        )
+    return await call_next(request)
+
+
+# CORS middleware, added last so it also wraps the responses above
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["http://localhost:3000", "http://localhost:5173"],
@@ -42,6 +69,52 @@ app.include_router(reports.router, prefix="/api/reports", tags=["reports"])
 app.include_router(feedback.router, prefix="/api/feedback", tags=["feedback"])
 app.include_router(integrations.router, prefix="/api/integrations", tags=["integrations"])
 app.include_router(dashboard.router, prefix="/api/dashboard", tags=["dashboard"])
+app.include_router(rules.router, prefix="/api/rules", tags=["rules"])
+app.include_router(simulations.router, prefix="/api/simulations", tags=["simulations"])
+
+
+async def _snapshot_velocity():
+    """Periodically persist velocity counters so restarts start warm"""
+    while True:
+        await asyncio.sleep(settings.velocity_snapshot_seconds)
+        try:
+            await asyncio.to_thread(velocity_tracker.save)
+        except Exception as e:
+            logger.error(f"Velocity snapshot failed: {e}")
+
+
+async def _sweep_receipts():
+    """Periodically reconcile receipts and transactions changed since the last sweep"""
+    while True:
+        await asyncio.sleep(settings.reconcile_sweep_seconds)
+        try:
+            result = await orchestrator.sweep_receipts()
+            if result.get("status") != "success":
+                logger.error(f"Reconciliation sweep failed: {result.get('error')}")
+        except Exception as e:
+            logger.error(f"Reconciliation sweep failed: {e}")
+
+
+@app.on_event("startup")
+async def startup():
+    db = SessionLocal()
+    try:
+        fx_rates.refresh(db, force=True)
+        merchant_index.warm(db)
+        velocity_tracker.warm(db)
+    finally:
+        db.close()
+    if int(os.environ.get("WEB_CONCURRENCY", "1")) > 1:
+        logger.warning("Velocity counters are per process; run a single worker for complete velocity checks")
+    asyncio.create_task(_snapshot_velocity())
+    if settings.reconcile_sweep_seconds > 0:
+        asyncio.create_task(_sweep_receipts())
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    velocity_tracker.save()
+    ocr_pool.shutdown()
 
 
 @app.get("/")
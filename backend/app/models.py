@@ -1,7 +1,7 @@
 """
 Database models
 """
-from sqlalchemy import Column, Integer, String, Float, DateTime, Boolean, ForeignKey, Text, JSON
+from sqlalchemy import Column, Integer, String, Float, DateTime, Boolean, ForeignKey, Text, JSON, UniqueConstraint, Index
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from app.database import Base
@@ -48,12 +48,17 @@ class User(Base):
 
 class Transaction(Base):
     __tablename__ = "transactions"
+    __table_args__ = (
+        # Receipt matching: a user's unreconciled transactions by amount band, then date
+        Index("ix_transactions_reconcile", "user_id", "is_reconciled", "base_amount", "date"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     external_id = Column(String, unique=True, index=True)  # ID from external system
     amount = Column(Float, nullable=False)
     currency = Column(String, default="USD")
+    base_amount = Column(Float)  # amount in settings.base_currency at the date's rate, set at ingest
     date = Column(DateTime(timezone=True), nullable=False)
     description = Column(String)
     merchant = Column(String)
@@ -66,6 +71,12 @@ class Transaction(Base):
     anomaly_score = Column(Float)
     anomaly_reason = Column(Text)
     
+    # Offline re-scoring (jobs/anomaly_sweep), kept apart from the live flags above
+    sweep_anomaly = Column(Boolean)
+    sweep_score = Column(Float)
+    sweep_reason = Column(Text)
+    swept_at = Column(DateTime(timezone=True))
+    
     # Classification
     classification_confidence = Column(Float)
     classification_metadata = Column(JSON)
@@ -81,8 +92,8 @@ class Transaction(Base):
     # Metadata
     source = Column(String)  # stripe, quickbooks, manual, etc.
     extra_metadata = Column(JSON)  # Renamed from 'metadata' to avoid SQLAlchemy conflict
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
-    updated_at = Column(DateTime(timezone=True), onupdate=func.now())
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), index=True)
+    updated_at = Column(DateTime(timezone=True), onupdate=func.now(), index=True)
     
     # Relationships
     user = relationship("User", back_populates="transactions")
@@ -92,6 +103,10 @@ class Transaction(Base):
 
 class Receipt(Base):
     __tablename__ = "receipts"
+    __table_args__ = (
+        # Unmatched receipts (transaction_id IS NULL) by amount, for reverse lookup
+        Index("ix_receipts_pending", "user_id", "transaction_id", "base_amount"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     transaction_id = Column(Integer, ForeignKey("transactions.id"), nullable=True)
@@ -101,9 +116,12 @@ class Receipt(Base):
     file_path = Column(String, nullable=False)
     file_name = Column(String, nullable=False)
     file_type = Column(String)
+    content_hash = Column(String, index=True)  # SHA-256 of the uploaded file
     
     # Parsed data
     amount = Column(Float)
+    currency = Column(String)
+    base_amount = Column(Float)  # amount (or total) in settings.base_currency, set when parsed
     date = Column(DateTime(timezone=True))
     merchant = Column(String)
     category = Column(String)
@@ -120,8 +138,8 @@ class Receipt(Base):
     is_processed = Column(Boolean, default=False)
     is_verified = Column(Boolean, default=False)
     
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
-    updated_at = Column(DateTime(timezone=True), onupdate=func.now())
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), index=True)
+    updated_at = Column(DateTime(timezone=True), onupdate=func.now(), index=True)
     
     # Relationships
     transaction = relationship("Transaction", back_populates="receipt", uselist=False, foreign_keys="[Receipt.transaction_id]", primaryjoin="Receipt.transaction_id==Transaction.id")
@@ -221,3 +239,100 @@ class Integration(Base):
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
 
+
+
+class FraudRule(Base):
+    __tablename__ = "fraud_rules"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String, nullable=False)
+    description = Column(Text)
+    
+    # Rule definition
+    conditions = Column(JSON, nullable=False)  # [{"field": "amount", "op": "gt", "value": 1000}, ...]
+    weight = Column(Float, default=0.0)  # Added to the risk score when the rule matches
+    severity = Column(String, default=AlertSeverity.MEDIUM.value)
+    action = Column(String, default="score")  # score, flag
+    priority = Column(Integer, default=100)  # Lower runs first
+    is_active = Column(Boolean, default=True)
+    
+    created_by = Column(Integer, ForeignKey("users.id"), nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), onupdate=func.now())
+
+
+class UserCategoryStats(Base):
+    __tablename__ = "user_category_stats"
+    __table_args__ = (
+        UniqueConstraint("user_id", "category", name="uq_user_category_stats"),
+    )
+    
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    category = Column(String, nullable=False)
+    
+    # Running amount statistics (Welford) over the anomaly history window
+    count = Column(Integer, default=0)
+    mean = Column(Float, default=0.0)
+    m2 = Column(Float, default=0.0)
+    sketch = Column(JSON)  # Serialized QuantileSketch for median/MAD and percentiles
+    window_start = Column(DateTime(timezone=True), nullable=False)  # Older transactions are no longer counted
+    
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+
+class PeerBaseline(Base):
+    __tablename__ = "peer_baselines"
+    __table_args__ = (
+        UniqueConstraint("role", "category", name="uq_peer_baseline"),
+    )
+    
+    id = Column(Integer, primary_key=True, index=True)
+    role = Column(String, nullable=False)
+    category = Column(String, nullable=False)  # "*" aggregates all categories for the role
+    
+    user_count = Column(Integer, default=0)
+    transaction_count = Column(Integer, default=0)
+    mean = Column(Float, default=0.0)
+    std = Column(Float, default=0.0)
+    median = Column(Float)
+    mad = Column(Float)
+    quantiles = Column(JSON)  # {"p05": ..., "p99": ...}
+    merchants = Column(JSON)  # Most popular canonical merchants -> share of transactions
+    tail_merchants = Column(Integer, default=0)  # Distinct merchants beyond the popular ones, shares not kept
+    hours = Column(JSON)  # 168 hour-of-week shares, Monday 00:00 first
+    
+    computed_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
+class SweepWatermark(Base):
+    __tablename__ = "sweep_watermarks"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String, unique=True, nullable=False)
+    position = Column(DateTime(timezone=True))  # Rows changed before this have been processed
+    last_run_at = Column(DateTime(timezone=True))
+    last_result = Column(JSON)
+
+
+class FxRate(Base):
+    __tablename__ = "fx_rates"
+    __table_args__ = (
+        UniqueConstraint("currency", "date", name="uq_fx_rate"),
+    )
+    
+    id = Column(Integer, primary_key=True, index=True)
+    currency = Column(String, nullable=False)
+    date = Column(DateTime(timezone=True), nullable=False)
+    rate = Column(Float, nullable=False)  # Units of the base currency per unit of currency
+
+
+class ReceiptParseCache(Base):
+    __tablename__ = "receipt_parse_cache"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    content_hash = Column(String, unique=True, nullable=False)  # SHA-256 of the receipt file
+    raw_text = Column(Text)
+    parsed_data = Column(JSON, nullable=False)
+    hits = Column(Integer, default=0)  # Uploads served from this entry instead of the parser
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
@@ -1,22 +1,38 @@
 """
 Receipt routes
 """
-from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File
+from fastapi import APIRouter, Depends, HTTPException, Request, status, UploadFile, File
 from sqlalchemy.orm import Session
 from pydantic import BaseModel
-from typing import Optional
+from typing import Optional, Tuple
 from app.database import get_db
-from app.auth import get_current_user
-from app.models import Receipt, Transaction
+from app.auth import get_current_user, require_role
+from app.models import Receipt, Transaction, UserRole
 from app.agents.orchestrator import AgentOrchestrator
 from app.config import settings
+from app.services.anomaly_scoring import parse_date
+from app.services.fx import fx_rates
+from app.services.ocr import ocr_pool
+from app.services import receipt_cache
 import os
 import aiofiles
+import hashlib
 from datetime import datetime
 
 router = APIRouter()
 orchestrator = AgentOrchestrator()
 
+UPLOAD_CHUNK_BYTES = 64 * 1024  # Read and write size while streaming an upload to disk
+MULTIPART_OVERHEAD_BYTES = 16 * 1024  # Boundaries and part headers around the file in an upload request
+UPLOAD_PATH = "/api/receipts/upload"
+
+# Leading bytes a file of the declared type must start with
+FILE_SIGNATURES = {
+    "image/jpeg": b"\xff\xd8\xff",
+    "image/png": b"\x89PNG\r\n\x1a\n",
+    "application/pdf": b"%PDF-",
+}
+
 
 class ReceiptResponse(BaseModel):
     id: int
@@ -24,6 +40,8 @@ class ReceiptResponse(BaseModel):
     transaction_id: Optional[int]
     file_name: str
     amount: Optional[float]
+    currency: Optional[str]
+    base_amount: Optional[float]
     date: Optional[datetime]
     merchant: Optional[str]
     category: Optional[str]
@@ -35,6 +53,65 @@ class ReceiptResponse(BaseModel):
         from_attributes = True
 
 
+def declared_too_large(request: Request) -> bool:
+    """
+    Whether a receipt upload's Content-Length already exceeds the size limit
+
+    Checked by middleware before the multipart body is read. Chunked
+    requests declare no length and are caught while streaming instead.
+    """
+    if request.method != "POST" or request.url.path != UPLOAD_PATH:
+        return False
+    length = request.headers.get("content-length", "")
+    return length.isdigit() and int(length) > settings.receipt_max_bytes + MULTIPART_OVERHEAD_BYTES
+
+
+async def _save_upload(file: UploadFile, file_path: str) -> Tuple[str, int]:
+    """
+    Stream an upload to file_path in fixed-size chunks, returning its SHA-256 and size
+
+    The file is written next to its final path and moved into place only
+    once complete, so readers never see a partial receipt. Oversized or
+    mislabelled files are rejected as soon as that is known and the
+    partial file is removed. Requests declaring an oversized body never
+    get here (see declared_too_large); these checks are the backstop.
+    """
+    if file.size is not None and file.size > settings.receipt_max_bytes:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"Receipt files are limited to {settings.receipt_max_bytes} bytes",
+        )
+
+    digest = hashlib.sha256()
+    size = 0
+    signature = FILE_SIGNATURES.get(file.content_type)
+    tmp = f"{file_path}.part"
+    try:
+        async with aiofiles.open(tmp, 'wb') as out_file:
+            while chunk := await file.read(UPLOAD_CHUNK_BYTES):
+                if size == 0 and signature and not chunk.startswith(signature):
+                    raise HTTPException(
+                        status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+                        detail=f"File content is not {file.content_type}",
+                    )
+                size += len(chunk)
+                if size > settings.receipt_max_bytes:
+                    raise HTTPException(
+                        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                        detail=f"Receipt files are limited to {settings.receipt_max_bytes} bytes",
+                    )
+                digest.update(chunk)
+                await out_file.write(chunk)
+        if size == 0:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Empty receipt file")
+        os.replace(tmp, file_path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    return digest.hexdigest(), size
+
+
 @router.post("/upload", response_model=ReceiptResponse, status_code=status.HTTP_201_CREATED)
 async def upload_receipt(
     file: UploadFile = File(...),
@@ -43,23 +120,41 @@ async def upload_receipt(
     db: Session = Depends(get_db),
 ):
     """Upload and process a receipt"""
+    if file.content_type not in settings.receipt_content_types:
+        raise HTTPException(
+            status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+            detail=f"Unsupported receipt type {file.content_type}, expected one of {settings.receipt_content_types}",
+        )
+    
+    # Receipts can only be attached to the uploader's own transactions
+    transaction = None
+    if transaction_id is not None:
+        transaction = db.query(Transaction).filter(
+            Transaction.id == transaction_id,
+            Transaction.user_id == current_user.id,
+        ).first()
+        if transaction is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Transaction not found",
+            )
+    
     # Create upload directory if it doesn't exist
     os.makedirs(settings.receipt_dir, exist_ok=True)
     
     # Save file
-    file_path = os.path.join(settings.receipt_dir, f"{current_user.id}_{datetime.utcnow().timestamp()}_{file.filename}")
-    
-    async with aiofiles.open(file_path, 'wb') as out_file:
-        content = await file.read()
-        await out_file.write(content)
+    file_name = os.path.basename(file.filename or "receipt")
+    file_path = os.path.join(settings.receipt_dir, f"{current_user.id}_{datetime.utcnow().timestamp()}_{file_name}")
+    content_hash, _ = await _save_upload(file, file_path)
     
     # Create receipt record
     receipt = Receipt(
         user_id=current_user.id,
         transaction_id=transaction_id,
         file_path=file_path,
-        file_name=file.filename,
-        file_type=file.content_type or "image",
+        file_name=file_name,
+        file_type=file.content_type,
+        content_hash=content_hash,
     )
     
     db.add(receipt)
@@ -70,34 +165,58 @@ async def upload_receipt(
     try:
         receipt_data = {
             "file_path": file_path,
-            "file_type": file.content_type or "image",
+            "file_type": file.content_type,
             "user_id": current_user.id,
             "transaction_id": transaction_id,
+            "receipt_id": receipt.id,
         }
         
+        # Identical files skip OCR and the LLM parse
+        cached = receipt_cache.lookup(db, content_hash)
+        if cached is not None:
+            receipt_data["cached_parse"] = {"parsed_data": cached.parsed_data, "raw_text": cached.raw_text}
+            db.commit()
+        
         result = await orchestrator.process_receipt(receipt_data)
         
         # Update receipt with parsed data
         if result.get("status") == "success":
-            parsed_data = result.get("parsing", {}).get("parsed_data", {})
+            parsing = result.get("parsing", {})
+            parsed_data = parsing.get("parsed_data", {})
+            if cached is None and parsing.get("status") == "success" and parsed_data:
+                receipt_cache.store(db, content_hash, parsing.get("raw_text"), parsed_data)
             
             receipt.amount = parsed_data.get("amount")
             receipt.total = parsed_data.get("total", parsed_data.get("amount"))
+            receipt.date = parse_date(parsed_data.get("date"))
+            receipt.currency = parsed_data.get("currency") or settings.base_currency
+            fx_rates.refresh(db)
+            receipt.base_amount = fx_rates.convert(
+                receipt.amount if receipt.amount is not None else receipt.total,
+                receipt.currency,
+                receipt.date,
+            )
             receipt.merchant = parsed_data.get("merchant")
             receipt.category = parsed_data.get("category")
             receipt.parsing_confidence = parsed_data.get("confidence", 0.0)
             receipt.parsing_metadata = parsed_data
+            receipt.raw_text = parsing.get("raw_text")
             receipt.is_processed = True
             
-            # Try to match with transaction
-            if transaction_id:
-                transaction = db.query(Transaction).filter(Transaction.id == transaction_id).first()
-                if transaction:
-                    transaction.receipt_id = receipt.id
-                    db.commit()
+            # Attach to the transaction it was uploaded for, even when the amounts differ
+            if transaction is not None:
+                transaction.receipt_id = receipt.id
+                db.commit()
         
         db.commit()
         db.refresh(receipt)
+        
+        # The same file submitted by another employee may be a double claim
+        others = receipt_cache.other_uploads(db, content_hash, current_user.id)
+        if others:
+            await orchestrator.get_agent("notifier").execute(
+                receipt_cache.duplicate_alert_payload(receipt, others)
+            )
     
     except Exception as e:
         print(f"Error processing receipt: {e}")
@@ -105,6 +224,32 @@ async def upload_receipt(
     return receipt
 
 
+@router.post("/reconcile-batch")
+async def reconcile_receipts_batch(
+    user_id: Optional[int] = None,
+    dry_run: bool = False,
+    current_user = Depends(require_role([UserRole.FINANCE_ADMIN, UserRole.ADMIN])),
+):
+    """Assign all pending receipts to transactions at once (finance admin only)"""
+    result = await orchestrator.get_agent("reconciler").reconcile_batch(user_id=user_id, dry_run=dry_run)
+    
+    if result.get("status") != "success":
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=result.get("error", "Batch reconciliation failed"),
+        )
+    
+    return result
+
+
+@router.get("/ocr-stats")
+async def get_ocr_stats(
+    current_user = Depends(require_role([UserRole.FINANCE_ADMIN, UserRole.ADMIN])),
+):
+    """OCR worker pool load and recent job timings (finance admin only)"""
+    return ocr_pool.stats()
+
+
 @router.get("/{receipt_id}", response_model=ReceiptResponse)
 async def get_receipt(
     receipt_id: int,
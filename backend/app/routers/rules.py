@@ -0,0 +1,190 @@
+"""
+Fraud rule routes
+"""
+from fastapi import APIRouter, Depends, HTTPException, status
+from sqlalchemy.orm import Session
+from pydantic import BaseModel
+from typing import Any, List, Optional
+from datetime import datetime
+from app.database import get_db
+from app.auth import require_role
+from app.models import FraudRule, UserRole
+from app.services.rules import CompiledRule, RuleCompileError, build_context, rule_engine
+
+router = APIRouter()
+
+
+class RuleCondition(BaseModel):
+    field: str
+    op: str
+    value: Any
+
+
+class RuleCreate(BaseModel):
+    name: str
+    description: Optional[str] = None
+    conditions: List[RuleCondition]
+    weight: float = 0.0
+    severity: str = "medium"
+    action: str = "score"
+    priority: int = 100
+    is_active: bool = True
+
+
+class RuleUpdate(BaseModel):
+    name: Optional[str] = None
+    description: Optional[str] = None
+    conditions: Optional[List[RuleCondition]] = None
+    weight: Optional[float] = None
+    severity: Optional[str] = None
+    action: Optional[str] = None
+    priority: Optional[int] = None
+    is_active: Optional[bool] = None
+
+
+class RuleResponse(BaseModel):
+    id: int
+    name: str
+    description: Optional[str]
+    conditions: List[dict]
+    weight: float
+    severity: str
+    action: str
+    priority: int
+    is_active: bool
+    created_at: Optional[datetime]
+    updated_at: Optional[datetime]
+
+    class Config:
+        from_attributes = True
+
+
+class RuleEvaluateRequest(BaseModel):
+    transaction: dict
+    user_role: Optional[str] = None
+    velocity: Optional[dict] = None
+
+
+def _validate_rule(rule: FraudRule):
+    """Make sure a rule compiles before it is stored"""
+    try:
+        CompiledRule(
+            rule_id=rule.id,
+            name=rule.name,
+            conditions=rule.conditions,
+            weight=rule.weight,
+            severity=rule.severity,
+            action=rule.action,
+            priority=rule.priority,
+        )
+    except RuleCompileError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e),
+        )
+
+
+@router.post("/", response_model=RuleResponse, status_code=status.HTTP_201_CREATED)
+async def create_rule(
+    rule_data: RuleCreate,
+    current_user = Depends(require_role([UserRole.FINANCE_ADMIN, UserRole.ADMIN])),
+    db: Session = Depends(get_db),
+):
+    """Create a fraud rule"""
+    rule = FraudRule(
+        name=rule_data.name,
+        description=rule_data.description,
+        conditions=[c.model_dump() for c in rule_data.conditions],
+        weight=rule_data.weight,
+        severity=rule_data.severity,
+        action=rule_data.action,
+        priority=rule_data.priority,
+        is_active=rule_data.is_active,
+        created_by=current_user.id,
+    )
+    _validate_rule(rule)
+
+    db.add(rule)
+    db.commit()
+    db.refresh(rule)
+
+    rule_engine.invalidate()
+    return rule
+
+
+@router.get("/", response_model=List[RuleResponse])
+async def get_rules(
+    include_inactive: bool = False,
+    current_user = Depends(require_role([UserRole.FINANCE_ADMIN, UserRole.ADMIN])),
+    db: Session = Depends(get_db),
+):
+    """Get fraud rules"""
+    query = db.query(FraudRule)
+    if not include_inactive:
+        query = query.filter(FraudRule.is_active == True)
+
+    return query.order_by(FraudRule.priority, FraudRule.id).all()
+
+
+@router.patch("/{rule_id}", response_model=RuleResponse)
+async def update_rule(
+    rule_id: int,
+    rule_data: RuleUpdate,
+    current_user = Depends(require_role([UserRole.FINANCE_ADMIN, UserRole.ADMIN])),
+    db: Session = Depends(get_db),
+):
+    """Update a fraud rule"""
+    rule = db.query(FraudRule).filter(FraudRule.id == rule_id).first()
+
+    if not rule:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Rule not found",
+        )
+
+    updates = rule_data.model_dump(exclude_unset=True)
+    if "conditions" in updates:
+        updates["conditions"] = [c.model_dump() for c in rule_data.conditions]
+    for field, value in updates.items():
+        setattr(rule, field, value)
+    _validate_rule(rule)
+
+    db.commit()
+    db.refresh(rule)
+
+    rule_engine.invalidate()
+    return rule
+
+
+@router.delete("/{rule_id}")
+async def delete_rule(
+    rule_id: int,
+    current_user = Depends(require_role([UserRole.FINANCE_ADMIN, UserRole.ADMIN])),
+    db: Session = Depends(get_db),
+):
+    """Delete a fraud rule"""
+    rule = db.query(FraudRule).filter(FraudRule.id == rule_id).first()
+
+    if not rule:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Rule not found",
+        )
+
+    db.delete(rule)
+    db.commit()
+
+    rule_engine.invalidate()
+    return {"status": "success", "rule_id": rule_id}
+
+
+@router.post("/evaluate")
+async def evaluate_rules(
+    request: RuleEvaluateRequest,
+    current_user = Depends(require_role([UserRole.FINANCE_ADMIN, UserRole.ADMIN])),
+    db: Session = Depends(get_db),
+):
+    """Dry-run the active rule set against a sample transaction"""
+    rule_engine.refresh(db)
+    context = build_context(request.transaction, request.user_role, request.velocity)
+    return rule_engine.evaluate(context)
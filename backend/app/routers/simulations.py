@@ -0,0 +1,74 @@
+"""
+What-if simulation routes
+"""
+from fastapi import APIRouter, Depends, HTTPException, status
+from sqlalchemy.orm import Session
+from pydantic import BaseModel, Field
+from typing import List, Optional
+from datetime import datetime, timedelta
+from app.database import get_db
+from app.auth import require_role
+from app.config import settings
+from app.models import UserRole
+from app.services import stats
+from app.services.simulator import simulate
+import asyncio
+
+router = APIRouter()
+
+MAX_SETTINGS = 400  # Combinations evaluated per request
+
+
+class ThresholdSimulationRequest(BaseModel):
+    anomaly_thresholds: List[float] = Field(default_factory=list)
+    confidence_thresholds: List[float] = Field(default_factory=list)
+    start: Optional[datetime] = None
+    end: Optional[datetime] = None
+    days: int = Field(90, ge=1, le=730)  # Window length when start is not given
+    user_id: Optional[int] = None
+
+
+@router.post("/thresholds")
+async def simulate_thresholds(
+    request: ThresholdSimulationRequest,
+    current_user = Depends(require_role([UserRole.FINANCE_ADMIN, UserRole.ADMIN])),
+    db: Session = Depends(get_db),
+):
+    """
+    Re-score a historical window under candidate thresholds
+
+    Returns the anomalies, alerts, flags and review items each combination
+    of anomaly and confidence threshold would have produced, compared with
+    the current settings. No LLM calls are made.
+    """
+    anomaly_thresholds = request.anomaly_thresholds or [settings.anomaly_threshold]
+    confidence_thresholds = request.confidence_thresholds or [settings.confidence_threshold]
+    if len(anomaly_thresholds) * len(confidence_thresholds) > MAX_SETTINGS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"At most {MAX_SETTINGS} threshold combinations per simulation",
+        )
+    if any(t <= 0 for t in anomaly_thresholds) or any(not 0 <= t <= 1 for t in confidence_thresholds):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Anomaly thresholds must be positive and confidence thresholds between 0 and 1",
+        )
+
+    end = stats.naive_utc(request.end) if request.end else datetime.utcnow()
+    start = stats.naive_utc(request.start) if request.start else end - timedelta(days=request.days)
+    if start >= end:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="start must be before end",
+        )
+
+    # Scoring is CPU-bound, keep it off the event loop
+    return await asyncio.to_thread(
+        simulate,
+        db,
+        start,
+        end,
+        sorted(set(anomaly_thresholds)),
+        sorted(set(confidence_thresholds)),
+        request.user_id,
+    )
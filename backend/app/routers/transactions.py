@@ -6,11 +6,15 @@ from sqlalchemy.orm import Session
 from sqlalchemy import desc
 from pydantic import BaseModel
 from typing import Optional, List
-from datetime import datetime
+from datetime import datetime, timedelta
 from app.database import get_db
 from app.auth import get_current_user, require_role
 from app.models import Transaction, User, TransactionStatus, UserRole
 from app.agents.orchestrator import AgentOrchestrator
+from app.services import transaction_events
+from app.services.duplicates import find_duplicate_clusters
+from app.services.fx import fx_rates
+from app.services.merchant_graph import graph_store
 
 router = APIRouter()
 orchestrator = AgentOrchestrator()
@@ -27,11 +31,26 @@ class TransactionCreate(BaseModel):
     metadata: Optional[dict] = None
 
 
+class BatchScoreItem(BaseModel):
+    id: Optional[int] = None
+    user_id: Optional[int] = None
+    amount: float
+    currency: Optional[str] = None
+    date: str
+    merchant: Optional[str] = None
+    category: Optional[str] = None
+
+
+class BatchScoreRequest(BaseModel):
+    transactions: List[BatchScoreItem]
+
+
 class TransactionResponse(BaseModel):
     id: int
     user_id: int
     amount: float
     currency: str
+    base_amount: Optional[float]
     date: datetime
     description: Optional[str]
     merchant: Optional[str]
@@ -40,6 +59,8 @@ class TransactionResponse(BaseModel):
     status: str
     is_anomaly: bool
     anomaly_score: Optional[float]
+    sweep_anomaly: Optional[bool]
+    sweep_score: Optional[float]
     risk_score: Optional[float]
     is_reconciled: bool
 
@@ -54,12 +75,18 @@ async def create_transaction(
     db: Session = Depends(get_db),
 ):
     """Create a new transaction and process it through the agent system"""
+    date = datetime.fromisoformat(transaction_data.date.replace("Z", "+00:00"))
+    
+    # Convert to the base currency once, at ingest
+    fx_rates.refresh(db)
+    
     # Create transaction
     transaction = Transaction(
         user_id=current_user.id,
         amount=transaction_data.amount,
         currency=transaction_data.currency,
-        date=datetime.fromisoformat(transaction_data.date.replace("Z", "+00:00")),
+        base_amount=fx_rates.convert(transaction_data.amount, transaction_data.currency, date),
+        date=date,
         description=transaction_data.description,
         merchant=transaction_data.merchant,
         source=transaction_data.source,
@@ -70,12 +97,15 @@ async def create_transaction(
     db.add(transaction)
     db.commit()
     db.refresh(transaction)
+    transaction_events.on_transaction_created(transaction)
     
     # Process through agent system
     try:
         transaction_dict = {
             "id": transaction.id,
             "amount": transaction.amount,
+            "currency": transaction.currency,
+            "base_amount": transaction.base_amount,
             "description": transaction.description,
             "merchant": transaction.merchant,
             "date": transaction.date.isoformat(),
@@ -109,6 +139,7 @@ async def create_transaction(
                 if decision.get("severity") in ["high", "critical"]:
                     transaction.status = TransactionStatus.FLAGGED.value
         
+        transaction_events.on_transaction_change(db, None, transaction_events.snapshot(transaction))
         db.commit()
         db.refresh(transaction)
     
@@ -119,6 +150,20 @@ async def create_transaction(
     return transaction
 
 
+@router.post("/score-batch")
+async def score_transactions_batch(
+    request: BatchScoreRequest,
+    current_user: User = Depends(require_role([UserRole.FINANCE_ADMIN, UserRole.ADMIN])),
+):
+    """Score a batch of transactions for anomalies without the LLM steps (bulk imports, backfills)"""
+    transactions = [
+        {**item.model_dump(), "user_id": item.user_id or current_user.id}
+        for item in request.transactions
+    ]
+    results = await orchestrator.get_agent("anomaly").score_batch(transactions)
+    return {"count": len(results), "results": results}
+
+
 @router.get("/", response_model=List[TransactionResponse])
 async def get_transactions(
     skip: int = Query(0, ge=0),
@@ -148,6 +193,29 @@ async def get_transactions(
     return transactions
 
 
+@router.get("/duplicates")
+async def get_duplicate_clusters(
+    user_id: Optional[int] = None,
+    days: int = Query(90, ge=1, le=3650),
+    current_user: User = Depends(require_role([UserRole.FINANCE_ADMIN, UserRole.ADMIN])),
+    db: Session = Depends(get_db),
+):
+    """Scan transaction history for clusters of duplicate submissions"""
+    clusters = find_duplicate_clusters(
+        db, user_id=user_id, start=datetime.utcnow() - timedelta(days=days)
+    )
+    return {"count": len(clusters), "clusters": clusters}
+
+
+@router.get("/merchant-rings")
+async def get_merchant_rings(
+    current_user: User = Depends(require_role([UserRole.FINANCE_ADMIN, UserRole.ADMIN])),
+):
+    """Groups of users connected through several rarely used merchants"""
+    rings = graph_store.find_rings()
+    return {"graph": graph_store.info(), "count": len(rings), "rings": rings}
+
+
 @router.get("/{transaction_id}", response_model=TransactionResponse)
 async def get_transaction(
     transaction_id: int,
@@ -195,7 +263,9 @@ async def update_transaction_status(
             detail="Invalid status",
         )
     
+    before = transaction_events.snapshot(transaction)
     transaction.status = new_status
+    transaction_events.on_transaction_change(db, before, transaction_events.snapshot(transaction))
     db.commit()
     db.refresh(transaction)
     
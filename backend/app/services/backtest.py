@@ -0,0 +1,242 @@
+"""
+Offline backtesting of anomaly scoring and risk decisions against labeled history
+"""
+from typing import Dict, Any, Optional, List
+from datetime import datetime, timedelta
+from sqlalchemy.orm import Session
+from app.agents.decision import ALERT_RISK, ANOMALY_RISK_WEIGHT, MISMATCH_RISK, REVIEW_RISK
+from app.config import settings
+from app.models import Alert, Feedback, Transaction
+from app.services.anomaly_scoring import load_history, score_batch, to_columns
+from app.services.fx import base_amount_column
+import numpy as np
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# Alert types whose resolution labels the transaction; pipeline alerts are "risk" (NotifierAgent's default)
+LABEL_ALERT_TYPES = ("risk", "anomaly", "fraud")
+DEFAULT_BATCH_SIZE = 1000
+
+
+def load_labels(db: Session, start: datetime, end: datetime) -> Dict[int, bool]:
+    """
+    Ground truth per transaction id
+
+    A resolved risk, anomaly or fraud alert is a positive, unless it was dismissed
+    through alert feedback (is_valid = false). Explicit anomaly feedback
+    (corrected_value.is_anomaly) overrides alerts, the newest one winning.
+    """
+    labels: Dict[int, bool] = {}
+
+    dismissed = {
+        alert_id
+        for alert_id, corrected in db.query(Feedback.alert_id, Feedback.corrected_value).filter(
+            Feedback.feedback_type == "alert",
+            Feedback.alert_id.isnot(None),
+        )
+        if (corrected or {}).get("is_valid") is False
+    }
+    alerts = db.query(Alert.id, Alert.transaction_id).join(
+        Transaction, Transaction.id == Alert.transaction_id
+    ).filter(
+        Alert.is_resolved == True,
+        Alert.type.in_(LABEL_ALERT_TYPES),
+        Transaction.date >= start,
+        Transaction.date <= end,
+    )
+    for alert_id, transaction_id in alerts:
+        labels[transaction_id] = labels.get(transaction_id, False) or alert_id not in dismissed
+
+    feedback = db.query(Feedback.transaction_id, Feedback.corrected_value).join(
+        Transaction, Transaction.id == Feedback.transaction_id
+    ).filter(
+        Feedback.feedback_type == "anomaly",
+        Transaction.date >= start,
+        Transaction.date <= end,
+    ).order_by(Feedback.created_at, Feedback.id)
+    for transaction_id, corrected in feedback:
+        value = (corrected or {}).get("is_anomaly")
+        if isinstance(value, bool):
+            labels[transaction_id] = value
+
+    return labels
+
+
+def load_dataset(db: Session, start: datetime, end: datetime) -> Dict[str, Any]:
+    """
+    Labeled transactions plus the history they are scored against
+
+    Labeled rows are sorted by user so consecutive batches touch few users.
+    History keeps the labeled rows: run scores each row as of its own date,
+    so a row only ever sees the transactions dated before it.
+    """
+    labels = load_labels(db, start, end)
+    ids = sorted(labels)
+
+    rows = []
+    for i in range(0, len(ids), 500):
+        rows.extend(db.query(
+            Transaction.id,
+            Transaction.user_id,
+            base_amount_column(),
+            Transaction.category,
+            Transaction.merchant,
+            Transaction.date,
+            Transaction.classification_confidence,
+            Transaction.receipt_id,
+            Transaction.is_reconciled,
+        ).filter(Transaction.id.in_(ids[i:i + 500])).all())
+    rows.sort(key=lambda r: (r.user_id, r.date, r.id))
+
+    batch = to_columns(
+        {
+            "id": r.id,
+            "user_id": r.user_id,
+            "amount": r.amount,
+            "category": r.category,
+            "merchant": r.merchant,
+            "date": r.date,
+        }
+        for r in rows
+    )
+    history = load_history(
+        db,
+        batch["user_id"].tolist(),
+        start - timedelta(days=settings.anomaly_history_days),
+        end,
+    )
+    return {
+        "batch": batch,
+        "history": history,
+        "label": np.array([labels[r.id] for r in rows], dtype=bool),
+        # Classification failures fall back to confidence 0.0
+        "confidence": np.array([r.classification_confidence or 0.0 for r in rows], dtype=np.float64),
+        "mismatch": np.array([r.receipt_id is not None and not r.is_reconciled for r in rows], dtype=bool),
+        "start": start,
+        "end": end,
+    }
+
+
+def _slice(columns: Dict[str, np.ndarray], mask: np.ndarray) -> Dict[str, np.ndarray]:
+    return {name: values[mask] for name, values in columns.items()}
+
+
+def decision_risk(
+    anomaly_risk: np.ndarray,
+    is_anomaly: np.ndarray,
+    confidence: np.ndarray,
+    mismatch: np.ndarray,
+    config: Optional[Dict[str, Any]] = None,
+) -> np.ndarray:
+    """DecisionAgent's deterministic risk aggregation, vectorized"""
+    config = config or {}
+    confidence_threshold = config.get("confidence_threshold", settings.confidence_threshold)
+    return (
+        REVIEW_RISK * (confidence < confidence_threshold)
+        + config.get("anomaly_risk_weight", ANOMALY_RISK_WEIGHT) * anomaly_risk * is_anomaly
+        + MISMATCH_RISK * mismatch
+    )
+
+
+def metrics(predicted: np.ndarray, label: np.ndarray) -> Dict[str, Any]:
+    tp = int(np.sum(predicted & label))
+    fp = int(np.sum(predicted & ~label))
+    fn = int(np.sum(~predicted & label))
+    tn = int(np.sum(~predicted & ~label))
+    precision = tp / (tp + fp) if tp + fp else 0.0
+    recall = tp / (tp + fn) if tp + fn else 0.0
+    return {
+        "true_positives": tp,
+        "false_positives": fp,
+        "false_negatives": fn,
+        "true_negatives": tn,
+        "precision": precision,
+        "recall": recall,
+        "f1": 2 * precision * recall / (precision + recall) if precision + recall else 0.0,
+    }
+
+
+def run(
+    dataset: Dict[str, Any],
+    config: Optional[Dict[str, Any]] = None,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+) -> Dict[str, Any]:
+    """
+    Replay a dataset through the vectorized scorer and the decision rules
+
+    config keys (all optional): anomaly_threshold, weights (check weight
+    overrides), confidence_threshold, anomaly_risk_weight, alert_risk.
+    The decision replay covers DecisionAgent's deterministic score; fraud
+    rules and the LLM severity are not replayed. Rows are scored as of
+    their own date, against the history the live pipeline had then.
+    """
+    config = config or {}
+    batch, history, label = dataset["batch"], dataset["history"], dataset["label"]
+    n = len(label)
+
+    risk = np.zeros(n)
+    is_anomaly = np.zeros(n, dtype=bool)
+    latencies = []
+    started = time.perf_counter()
+
+    for i in range(0, n, batch_size):
+        batch_started = time.perf_counter()
+        part = _slice(batch, np.arange(i, min(i + batch_size, n)))
+        part_history = _slice(history, np.isin(history["user_id"], part["user_id"]))
+        scores = score_batch(
+            part,
+            part_history,
+            anomaly_threshold=config.get("anomaly_threshold"),
+            weights=config.get("weights"),
+            as_of=True,
+        )
+        risk[i:i + batch_size] = scores["risk_score"]
+        is_anomaly[i:i + batch_size] = scores["is_anomaly"]
+        latencies.append((time.perf_counter() - batch_started) * 1000)
+
+    elapsed = time.perf_counter() - started
+
+    should_alert = decision_risk(
+        risk, is_anomaly, dataset["confidence"], dataset["mismatch"], config
+    ) >= config.get("alert_risk", ALERT_RISK)
+
+    return {
+        "config": config,
+        "rows": n,
+        "positives": int(label.sum()),
+        "anomaly": metrics(is_anomaly, label),
+        "alert": metrics(should_alert, label),
+        "batch_size": batch_size,
+        "batches": len(latencies),
+        "seconds": elapsed,
+        "rows_per_second": n / elapsed if elapsed > 0 else 0.0,
+        "latency_ms": {
+            "p50": float(np.percentile(latencies, 50)) if latencies else 0.0,
+            "p95": float(np.percentile(latencies, 95)) if latencies else 0.0,
+            "max": float(max(latencies)) if latencies else 0.0,
+            "per_row": elapsed * 1000 / n if n else 0.0,
+        },
+    }
+
+
+def check_budget(report: Dict[str, Any], budget: Dict[str, Any], target: str = "alert") -> List[str]:
+    """
+    Budget violations of a backtest report, empty when it fits
+
+    budget keys (all optional): min_precision, min_recall,
+    min_rows_per_second, max_p95_ms. target picks the "anomaly" or
+    "alert" metrics.
+    """
+    violations = []
+    quality = report[target]
+    if budget.get("min_precision") is not None and quality["precision"] < budget["min_precision"]:
+        violations.append(f"{target} precision {quality['precision']:.3f} < {budget['min_precision']}")
+    if budget.get("min_recall") is not None and quality["recall"] < budget["min_recall"]:
+        violations.append(f"{target} recall {quality['recall']:.3f} < {budget['min_recall']}")
+    if budget.get("min_rows_per_second") is not None and report["rows_per_second"] < budget["min_rows_per_second"]:
+        violations.append(f"{report['rows_per_second']:.0f} rows/s < {budget['min_rows_per_second']}")
+    if budget.get("max_p95_ms") is not None and report["latency_ms"]["p95"] > budget["max_p95_ms"]:
+        violations.append(f"p95 batch latency {report['latency_ms']['p95']:.1f}ms > {budget['max_p95_ms']}ms")
+    return violations
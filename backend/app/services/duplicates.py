@@ -0,0 +1,306 @@
+"""
+Duplicate and near-duplicate transaction detection
+"""
+from typing import Dict, Any, Optional, List, Tuple
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from sqlalchemy.orm import Session
+from app.config import settings
+from app.models import Transaction, TransactionStatus
+from app.services import stats
+from app.services.merchants import normalize_merchant
+from app.services.velocity import is_date_only
+import pandas as pd
+import numpy as np
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+DAY_TOLERANCE = 1  # Submissions up to this many days apart can be duplicates
+AMOUNT_TOLERANCE = 1.0  # Near-duplicates differ by at most this amount
+DUPLICATE_MINUTES = 10  # Same-amount charges this close are a resubmission, not a repeat purchase
+MAX_INDEXED_USERS = 10000
+
+# (user_id, rounded amount, merchant, day) - day and amount neighbours are probed too
+Key = Tuple[int, int, str, int]
+# (transaction id, amount, date, reference)
+Entry = Tuple[int, float, datetime, str]
+
+
+def _merchant_of(merchant: Optional[str], description: Optional[str]) -> str:
+    return normalize_merchant(merchant) or normalize_merchant(description)
+
+
+def _reference_of(description: Optional[str]) -> str:
+    """Normalized description when it carries a reference (invoice or order number), else "" """
+    text = " ".join((description or "").lower().split())
+    return text if any(c.isdigit() for c in text) else ""
+
+
+def _match_type(
+    amount: float, date: datetime, reference: str, other_amount: float, other_date: datetime, other_reference: str
+) -> Optional[str]:
+    """
+    "exact" for the same amount and merchant on the same day with the same
+    reference or within minutes, "reference" for the same amount and
+    reference a day or so apart, "near" for other close pairs
+
+    Only exact and reference matches are duplicate evidence on their own;
+    near matches, including a bare same-amount charge later the same day,
+    are routine for repeat purchases (a daily coffee, a commute).
+    """
+    if abs(amount - other_amount) > AMOUNT_TOLERANCE:
+        return None
+    if abs((date.date() - other_date.date()).days) > DAY_TOLERANCE:
+        return None
+    if round(amount, 2) == round(other_amount, 2):
+        same_day = date.date() == other_date.date()
+        if reference and reference == other_reference:
+            return "exact" if same_day else "reference"
+        if same_day and _within_minutes(date, other_date):
+            return "exact"
+    return "near"
+
+
+def _within_minutes(date: datetime, other_date: datetime) -> bool:
+    """Both carry a time of day and are at most DUPLICATE_MINUTES apart"""
+    if is_date_only(date) or is_date_only(other_date):
+        return False
+    return abs((date - other_date).total_seconds()) <= DUPLICATE_MINUTES * 60
+
+
+class DuplicateIndex:
+    """
+    Hash index of recent transactions for O(1) duplicate lookups
+
+    Users are loaded lazily from the database on first lookup, then kept
+    current by add() and apply_change(). Rejected transactions are not
+    indexed, days that fall out of the window are pruned once a day per
+    user, and the least recently used users are dropped once
+    MAX_INDEXED_USERS is exceeded.
+    """
+
+    def __init__(self, window_days: int, max_users: int = MAX_INDEXED_USERS):
+        self.window_days = window_days
+        self.max_users = max_users
+        self._users: "OrderedDict[int, Dict[Key, List[Entry]]]" = OrderedDict()
+        self._pruned: Dict[int, int] = {}  # user_id -> day ordinal of the last prune
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(user_id: int, amount: float, merchant: str, date: datetime) -> Key:
+        return (user_id, int(round(amount)), merchant, date.toordinal())
+
+    def _insert(self, buckets: Dict, transaction_id: int, user_id: int, amount: float, merchant: str, date: datetime, reference: str):
+        key = self._key(user_id, amount, merchant, date)
+        entries = buckets.setdefault(key, [])
+        if all(entry[0] != transaction_id for entry in entries):
+            entries.append((transaction_id, amount, date, reference))
+
+    def _prune(self, user_id: int, buckets: Dict):
+        """Drop days older than the window (lock held)"""
+        today = datetime.utcnow().toordinal()
+        if self._pruned.get(user_id) == today:
+            return
+        oldest = today - self.window_days - DAY_TOLERANCE
+        for key in [k for k in buckets if k[3] < oldest]:
+            del buckets[key]
+        self._pruned[user_id] = today
+
+    def _warm(self, db: Session, user_id: int) -> Dict:
+        buckets: Dict = {}
+        cutoff = datetime.utcnow() - timedelta(days=self.window_days)
+        rows = db.query(
+            Transaction.id, Transaction.amount, Transaction.merchant, Transaction.description, Transaction.date
+        ).filter(
+            Transaction.user_id == user_id,
+            Transaction.date >= cutoff,
+            Transaction.status != TransactionStatus.REJECTED.value,
+        ).all()
+        for row in rows:
+            merchant = _merchant_of(row.merchant, row.description)
+            if merchant and row.amount is not None and row.date is not None:
+                self._insert(
+                    buckets, row.id, user_id, row.amount, merchant, stats.naive_utc(row.date), _reference_of(row.description)
+                )
+        return buckets
+
+    def _buckets(self, db: Session, user_id: int) -> Dict:
+        with self._lock:
+            buckets = self._users.get(user_id)
+            if buckets is not None:
+                self._users.move_to_end(user_id)
+                self._prune(user_id, buckets)
+                return buckets
+
+        buckets = self._warm(db, user_id)
+
+        with self._lock:
+            # Keep entries another request added while this one was loading
+            existing = self._users.pop(user_id, None) or {}
+            for key, entries in existing.items():
+                for entry in entries:
+                    self._insert(buckets, entry[0], user_id, entry[1], key[2], entry[2], entry[3])
+            self._users[user_id] = buckets
+            self._pruned[user_id] = datetime.utcnow().toordinal()
+            while len(self._users) > self.max_users:
+                evicted, _ = self._users.popitem(last=False)
+                self._pruned.pop(evicted, None)
+        return buckets
+
+    def add(self, transaction: Transaction):
+        """Index a newly inserted transaction if its user is loaded"""
+        merchant = _merchant_of(transaction.merchant, transaction.description)
+        if not merchant or transaction.amount is None or transaction.date is None:
+            return
+        if transaction.status == TransactionStatus.REJECTED.value:
+            return
+        with self._lock:
+            buckets = self._users.get(transaction.user_id)
+            if buckets is not None:
+                self._insert(
+                    buckets,
+                    transaction.id,
+                    transaction.user_id,
+                    transaction.amount,
+                    merchant,
+                    stats.naive_utc(transaction.date),
+                    _reference_of(transaction.description),
+                )
+
+    def apply_change(self, before: Optional[Dict[str, Any]], after: Optional[Dict[str, Any]]):
+        """Forget a transaction once it is rejected, so it is no longer a duplicate candidate"""
+        if not after or after.get("status") != TransactionStatus.REJECTED.value:
+            return
+        with self._lock:
+            buckets = self._users.get(after["user_id"])
+            if buckets is None:
+                return
+            for key, entries in list(buckets.items()):
+                kept = [entry for entry in entries if entry[0] != after["id"]]
+                if len(kept) != len(entries):
+                    if kept:
+                        buckets[key] = kept
+                    else:
+                        del buckets[key]
+
+    def find(
+        self,
+        db: Session,
+        user_id: int,
+        amount: Optional[float],
+        merchant: Optional[str],
+        date: Optional[datetime],
+        description: Optional[str] = None,
+        exclude_id: Optional[int] = None,
+    ) -> List[Dict[str, Any]]:
+        """Earlier transactions matching this one within the tolerances"""
+        merchant = _merchant_of(merchant, description)
+        if not user_id or not merchant or amount is None or date is None:
+            return []
+        date = stats.naive_utc(date)
+        reference = _reference_of(description)
+
+        buckets = self._buckets(db, user_id)
+        _, rounded, _, day = self._key(user_id, amount, merchant, date)
+
+        matches = []
+        with self._lock:
+            for day_offset in range(-DAY_TOLERANCE, DAY_TOLERANCE + 1):
+                for amount_offset in (-1, 0, 1):
+                    key = (user_id, rounded + amount_offset, merchant, day + day_offset)
+                    for other_id, other_amount, other_date, other_reference in buckets.get(key, ()):
+                        if other_id == exclude_id:
+                            continue
+                        match = _match_type(amount, date, reference, other_amount, other_date, other_reference)
+                        if match:
+                            matches.append({
+                                "transaction_id": other_id,
+                                "amount": other_amount,
+                                "date": other_date.isoformat(),
+                                "match": match,
+                            })
+        return sorted(matches, key=lambda m: (m["match"] == "near", m["match"] != "exact", m["date"]))
+
+    def invalidate(self, user_id: Optional[int] = None):
+        with self._lock:
+            if user_id is None:
+                self._users.clear()
+            else:
+                self._users.pop(user_id, None)
+
+
+def find_duplicate_clusters(
+    db: Session,
+    user_id: Optional[int] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Scan history for groups of duplicate transactions
+
+    Sorts by (user, merchant, amount) and chains neighbours whose amounts
+    are within AMOUNT_TOLERANCE, then re-sorts each chain by date and splits
+    it wherever consecutive dates are more than DAY_TOLERANCE apart. This is
+    O(n log n) rather than a pairwise comparison.
+    """
+    query = db.query(
+        Transaction.id,
+        Transaction.user_id,
+        Transaction.amount,
+        Transaction.merchant,
+        Transaction.description,
+        Transaction.date,
+    ).filter(
+        Transaction.amount.isnot(None),
+        Transaction.date.isnot(None),
+        Transaction.status != TransactionStatus.REJECTED.value,
+    )
+    if user_id is not None:
+        query = query.filter(Transaction.user_id == user_id)
+    if start is not None:
+        query = query.filter(Transaction.date >= start)
+    if end is not None:
+        query = query.filter(Transaction.date <= end)
+
+    df = pd.DataFrame(query.all(), columns=["id", "user_id", "amount", "merchant", "description", "date"])
+    if df.empty:
+        return []
+    df["merchant_key"] = [_merchant_of(m, d) for m, d in zip(df["merchant"], df["description"])]
+    df = df[df["merchant_key"] != ""]
+    df["day"] = pd.to_datetime(df["date"], utc=True).dt.tz_localize(None).dt.normalize()
+
+    # Chain by amount within (user, merchant)
+    df = df.sort_values(["user_id", "merchant_key", "amount"], kind="mergesort")
+    same_group = (df["user_id"].eq(df["user_id"].shift())) & (df["merchant_key"].eq(df["merchant_key"].shift()))
+    amount_break = ~same_group | (df["amount"].diff() > AMOUNT_TOLERANCE)
+    df["amount_chain"] = amount_break.cumsum()
+
+    # Split each amount chain by date gaps
+    df = df.sort_values(["amount_chain", "day", "id"], kind="mergesort")
+    gap = df["day"].diff().dt.days
+    date_break = df["amount_chain"].ne(df["amount_chain"].shift()) | (gap > DAY_TOLERANCE)
+    df["cluster"] = date_break.cumsum()
+
+    sizes = df.groupby("cluster")["id"].transform("size")
+    clustered = df[sizes > 1]
+
+    clusters = []
+    for _, group in clustered.groupby("cluster", sort=False):
+        amounts = group["amount"].to_numpy()
+        clusters.append({
+            "user_id": int(group["user_id"].iloc[0]),
+            "merchant": group["merchant"].iloc[0] or group["description"].iloc[0],
+            "transaction_ids": group["id"].astype(int).tolist(),
+            "count": len(group),
+            "amount": float(amounts[0]),
+            "exact": bool(np.all(np.round(amounts, 2) == round(float(amounts[0]), 2)) and group["day"].nunique() == 1),
+            "first_date": group["date"].min().isoformat(),
+            "last_date": group["date"].max().isoformat(),
+        })
+    clusters.sort(key=lambda c: (-c["count"], c["user_id"]))
+    return clusters
+
+
+duplicate_index = DuplicateIndex(window_days=settings.duplicate_window_days)
@@ -0,0 +1,193 @@
+"""
+Foreign exchange rates - conversion of amounts to the base currency
+"""
+from typing import Dict, Any, Optional, List, Iterable, Tuple
+from datetime import date as date_type, datetime, timezone
+from sqlalchemy import and_, func, or_
+from sqlalchemy.orm import Session
+from app.config import settings
+from app.models import FxRate, Transaction
+import numpy as np
+import threading
+import logging
+import time
+import csv
+
+logger = logging.getLogger(__name__)
+
+RateRow = Tuple[str, datetime, float]  # (currency, date, units of base currency per unit)
+
+
+def day_ordinal(value) -> int:
+    """Day ordinal of a date, datetime or ISO string; today when unknown"""
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value.replace("Z", "+00:00"))
+        except ValueError:
+            value = None
+    if isinstance(value, datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc)
+        return value.toordinal()
+    if isinstance(value, date_type):
+        return value.toordinal()
+    return datetime.utcnow().toordinal()
+
+
+def _currency(code: Optional[str]) -> str:
+    return (code or settings.base_currency).strip().upper()
+
+
+class FxRates:
+    """
+    Date-indexed conversion rates to the base currency, cached in memory
+
+    Per currency, rates are kept as parallel arrays of day ordinals and
+    rates; a lookup is a binary search for the latest rate on or before
+    the date (the earliest rate for older dates). The cache is reloaded
+    from the fx_rates table when stale, like the fraud rule set.
+    """
+
+    def __init__(self, base_currency: str = "USD", refresh_seconds: int = 300):
+        self.base_currency = base_currency.upper()
+        self.refresh_seconds = refresh_seconds
+        self._days: Dict[str, np.ndarray] = {}
+        self._rates: Dict[str, np.ndarray] = {}
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def currencies(self) -> List[str]:
+        return sorted(self._days)
+
+    def load(self, rows: Iterable[RateRow]):
+        """Build and swap in a new rate table"""
+        by_currency: Dict[str, Dict[int, float]] = {}
+        for currency, day, rate in rows:
+            if rate is None or rate <= 0:
+                continue
+            by_currency.setdefault(_currency(currency), {})[day_ordinal(day)] = float(rate)
+
+        days, rates = {}, {}
+        for currency, series in by_currency.items():
+            ordered = sorted(series)
+            days[currency] = np.array(ordered, dtype=np.int64)
+            rates[currency] = np.array([series[d] for d in ordered], dtype=np.float64)
+
+        self._days, self._rates = days, rates
+        self._loaded_at = time.monotonic()
+
+    def refresh(self, db: Session, force: bool = False):
+        """Reload rates from the database if the cached table is stale"""
+        if not force and time.monotonic() - self._loaded_at < self.refresh_seconds:
+            return
+
+        with self._lock:
+            if not force and time.monotonic() - self._loaded_at < self.refresh_seconds:
+                return
+            self.load(db.query(FxRate.currency, FxRate.date, FxRate.rate).all())
+
+    def invalidate(self):
+        """Force the next refresh to reload from the database"""
+        self._loaded_at = 0.0
+
+    def rate(self, currency: Optional[str], date=None) -> Optional[float]:
+        """Units of base currency per unit of currency on a date, None when unknown"""
+        currency = _currency(currency)
+        if currency == self.base_currency:
+            return 1.0
+        days = self._days.get(currency)
+        if days is None:
+            return None
+        i = max(int(np.searchsorted(days, day_ordinal(date), side="right")) - 1, 0)
+        return float(self._rates[currency][i])
+
+    def convert(self, amount: Optional[float], currency: Optional[str], date=None) -> Optional[float]:
+        """Amount in the base currency, None when there is no rate for the currency"""
+        if amount is None:
+            return None
+        rate = self.rate(currency, date)
+        return round(amount * rate, 2) if rate is not None else None
+
+    def convert_many(self, amounts: np.ndarray, currencies: np.ndarray, days: np.ndarray) -> np.ndarray:
+        """Vectorized convert over day ordinals; NaN where no rate is known"""
+        amounts = np.asarray(amounts, dtype=np.float64)
+        currencies = np.array([_currency(c) for c in currencies], dtype=object)
+        days = np.asarray(days, dtype=np.int64)
+        result = np.full(len(amounts), np.nan)
+
+        for currency in np.unique(currencies):
+            mask = currencies == currency
+            if currency == self.base_currency:
+                result[mask] = amounts[mask]
+                continue
+            known = self._days.get(currency)
+            if known is None:
+                continue
+            index = np.maximum(np.searchsorted(known, days[mask], side="right") - 1, 0)
+            result[mask] = amounts[mask] * self._rates[currency][index]
+        return np.round(result, 2)
+
+
+def read_rates_file(path: str) -> List[RateRow]:
+    """
+    Rates from a CSV file with date, currency and rate columns
+
+    rate is units of the base currency per unit of currency, e.g.
+    "2024-01-02,EUR,1.0945" when the base currency is USD.
+    """
+    rows = []
+    with open(path, newline="") as f:
+        for line in csv.DictReader(f):
+            rows.append((
+                _currency(line["currency"]),
+                datetime.fromisoformat(line["date"].strip()),
+                float(line["rate"]),
+            ))
+    return rows
+
+
+def base_amount_of(data: Dict[str, Any]) -> float:
+    """
+    Base-currency amount of a transaction or receipt dict
+
+    Uses the stored base_amount when present; otherwise converts amount
+    (or total) at the rate of its date, keeping the raw amount when no
+    rate is known for the currency.
+    """
+    if data.get("base_amount") is not None:
+        return data["base_amount"]
+    amount = data.get("amount") or data.get("total") or 0.0
+    converted = fx_rates.convert(amount, data.get("currency"), data.get("date"))
+    return converted if converted is not None else amount
+
+
+def stored_base_amount(row) -> Optional[float]:
+    """base_amount of a Transaction or Receipt row, falling back to its raw amount"""
+    if row.base_amount is not None:
+        return row.base_amount
+    if row.amount is not None:
+        return row.amount
+    return getattr(row, "total", None)
+
+
+def base_amount_column(model=Transaction):
+    """Stored base amount, or the raw amount for rows without one, labelled "amount" """
+    return func.coalesce(model.base_amount, model.amount).label("amount")
+
+
+def base_amount_between(model, low: float, high: float):
+    """
+    Filter on the base amount being in [low, high], using the raw amount for rows without one
+
+    Written as an OR rather than over coalesce() so the base_amount branch
+    can still use the amount-band indexes.
+    """
+    raw = func.coalesce(model.amount, model.total) if model is not Transaction else model.amount
+    return or_(
+        model.base_amount.between(low, high),
+        and_(model.base_amount.is_(None), raw.between(low, high)),
+    )
+
+
+fx_rates = FxRates(base_currency=settings.base_currency, refresh_seconds=settings.fx_refresh_seconds)
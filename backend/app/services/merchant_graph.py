@@ -0,0 +1,417 @@
+"""
+Bipartite user-merchant graph for collusion and shell-vendor detection
+"""
+from typing import Dict, Any, Optional, List, Tuple, Set
+from datetime import datetime
+from sqlalchemy.orm import Session
+from app.config import settings
+from app.models import Transaction, TransactionStatus
+from app.services import stats
+from app.services.fx import base_amount_column
+from app.services.merchants import merchant_index
+from itertools import islice
+import numpy as np
+import pandas as pd
+import threading
+import logging
+import time
+import os
+
+logger = logging.getLogger(__name__)
+
+MIN_GRAPH_USERS = 50  # Below this many users every shared merchant looks rare, so the graph is not scored
+RARE_MERCHANT_SHARE = 0.02  # Merchants used by at most this share of all users are "rare"...
+RARE_MERCHANT_MAX_USERS = 5  # ...and by no more than this many
+RING_MIN_SHARED = 2  # Rare merchants a small group must share to look like a ring
+NEW_EDGE_DAYS = 7  # Edges first seen this recently are "new"
+NEW_EDGE_BURST = 3  # New users at one merchant within NEW_EDGE_DAYS that count as a burst
+NEW_EDGE_MIN_SHARE = 0.5  # ...when they are at least this share of the merchant's users
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+def _seconds(date: datetime) -> float:
+    return (stats.naive_utc(date) - _EPOCH).total_seconds()
+
+
+class MerchantGraph:
+    """
+    Immutable CSR snapshot of the graph
+
+    Edges are sorted by (user, merchant), so user adjacency is a slice of
+    the edge arrays; merchant adjacency goes through a second, merchant-
+    sorted permutation of the same edges.
+    """
+
+    def __init__(
+        self,
+        user_ids: np.ndarray,
+        merchants: np.ndarray,
+        user_ptr: np.ndarray,
+        edge_merchant: np.ndarray,
+        edge_count: np.ndarray,
+        edge_amount: np.ndarray,
+        edge_first_seen: np.ndarray,
+        built_at: float,
+    ):
+        self.user_ids = user_ids
+        self.merchants = merchants
+        self.user_ptr = user_ptr
+        self.edge_merchant = edge_merchant
+        self.edge_count = edge_count
+        self.edge_amount = edge_amount
+        self.edge_first_seen = edge_first_seen
+        self.built_at = built_at
+
+        # Merchant-side adjacency (CSC)
+        edge_user = np.repeat(np.arange(len(user_ids)), np.diff(user_ptr))
+        self.merchant_order = np.argsort(edge_merchant, kind="stable")
+        self.merchant_users = edge_user[self.merchant_order]
+        self.merchant_ptr = np.searchsorted(
+            edge_merchant[self.merchant_order], np.arange(len(merchants) + 1)
+        )
+        self.fan_in = np.diff(self.merchant_ptr)
+
+        self.user_index = {int(u): i for i, u in enumerate(user_ids.tolist())}
+        self.merchant_index = {m: i for i, m in enumerate(merchants.tolist())}
+
+    @property
+    def edge_total(self) -> int:
+        return len(self.edge_merchant)
+
+    def user_merchants(self, user: int) -> np.ndarray:
+        return self.edge_merchant[self.user_ptr[user]:self.user_ptr[user + 1]]
+
+    def merchant_users_of(self, merchant: int) -> np.ndarray:
+        return self.merchant_users[self.merchant_ptr[merchant]:self.merchant_ptr[merchant + 1]]
+
+    def merchant_first_seen(self, merchant: int) -> np.ndarray:
+        return self.edge_first_seen[self.merchant_order[self.merchant_ptr[merchant]:self.merchant_ptr[merchant + 1]]]
+
+    @classmethod
+    def from_edges(
+        cls,
+        user_ids: np.ndarray,
+        merchants: List[str],
+        amounts: np.ndarray,
+        seconds: np.ndarray,
+        counts: Optional[np.ndarray] = None,
+    ) -> "MerchantGraph":
+        """
+        Aggregate (user, merchant) rows into a graph
+
+        Rows are single transactions, or partial edges carrying their
+        transaction count, amount total and first-seen time.
+        """
+        merchant_codes, merchant_names = pd.factorize(np.asarray(merchants, dtype=object))
+        users, user_codes = np.unique(np.asarray(user_ids, dtype=np.int64), return_inverse=True)
+        n_merchants = max(len(merchant_names), 1)
+        if counts is None:
+            counts = np.ones(len(merchant_codes))
+
+        keys = user_codes.astype(np.int64) * n_merchants + merchant_codes
+        edges, edge_of_row = np.unique(keys, return_inverse=True)
+        edge_user = edges // n_merchants
+        return cls(
+            user_ids=users,
+            merchants=np.asarray(merchant_names, dtype=str),
+            user_ptr=np.searchsorted(edge_user, np.arange(len(users) + 1)),
+            edge_merchant=(edges % n_merchants).astype(np.int64),
+            edge_count=np.bincount(edge_of_row, weights=counts, minlength=len(edges)).astype(np.int64),
+            edge_amount=np.bincount(edge_of_row, weights=amounts, minlength=len(edges)),
+            edge_first_seen=pd.Series(seconds).groupby(edge_of_row).min().to_numpy(),
+            built_at=time.time(),
+        )
+
+    def save(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp = f"{path}.tmp"
+        with open(tmp, "wb") as f:
+            np.savez(
+                f,
+                user_ids=self.user_ids,
+                merchants=self.merchants,
+                user_ptr=self.user_ptr,
+                edge_merchant=self.edge_merchant,
+                edge_count=self.edge_count,
+                edge_amount=self.edge_amount,
+                edge_first_seen=self.edge_first_seen,
+                built_at=np.array(self.built_at),
+            )
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str) -> "MerchantGraph":
+        with np.load(path) as data:
+            return cls(
+                data["user_ids"],
+                data["merchants"],
+                data["user_ptr"],
+                data["edge_merchant"],
+                data["edge_count"],
+                data["edge_amount"],
+                data["edge_first_seen"],
+                float(data["built_at"]),
+            )
+
+
+def _aggregate_edges(frame: pd.DataFrame) -> pd.DataFrame:
+    """Collapse (user, merchant) rows into one partial edge each"""
+    return frame.groupby(["user_id", "merchant"], sort=False, as_index=False).agg(
+        count=("count", "sum"), amount=("amount", "sum"), seconds=("seconds", "min")
+    )
+
+
+def build_graph(db: Session, chunk_size: int = 10000) -> MerchantGraph:
+    """
+    Build the full graph from transaction history, streaming rows in chunks
+
+    Merchants are canonical merchants, as recorded live. Each chunk is
+    collapsed to its edges, and the partial edges are merged whenever they
+    outgrow the edges merged so far, so memory follows the number of
+    edges rather than transactions.
+    """
+    merchant_index.warm(db)
+    rows = iter(db.query(
+        Transaction.user_id, Transaction.merchant, base_amount_column(), Transaction.date
+    ).filter(
+        Transaction.status != TransactionStatus.REJECTED.value,
+        Transaction.merchant.isnot(None),
+        Transaction.date.isnot(None),
+    ).yield_per(chunk_size))
+
+    merged = pd.DataFrame(columns=["user_id", "merchant", "count", "amount", "seconds"])
+    pending: List[pd.DataFrame] = []
+    pending_rows = 0
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            break
+        frame = pd.DataFrame({
+            "user_id": [row.user_id for row in chunk],
+            "merchant": merchant_index.canonical_many(row.merchant for row in chunk),
+            "count": 1,
+            "amount": [row.amount or 0.0 for row in chunk],
+            "seconds": [_seconds(row.date) for row in chunk],
+        })
+        edges = _aggregate_edges(frame[frame["merchant"] != ""])
+        pending.append(edges)
+        pending_rows += len(edges)
+        if pending_rows > max(len(merged), chunk_size):
+            merged = _aggregate_edges(pd.concat([merged, *pending], ignore_index=True))
+            pending, pending_rows = [], 0
+    if pending:
+        merged = _aggregate_edges(pd.concat([merged, *pending], ignore_index=True))
+
+    return MerchantGraph.from_edges(
+        merged["user_id"].to_numpy(dtype=np.int64),
+        merged["merchant"].tolist(),
+        merged["amount"].to_numpy(dtype=np.float64),
+        merged["seconds"].to_numpy(dtype=np.float64),
+        counts=merged["count"].to_numpy(dtype=np.float64),
+    )
+
+
+class GraphStore:
+    """
+    The current graph snapshot plus edges recorded since it was built
+
+    Snapshots are rebuilt offline and picked up by mtime, new transactions
+    are added to a small in-memory delta until the next rebuild.
+    """
+
+    def __init__(self, path: str, reload_seconds: int):
+        self.path = path
+        self.reload_seconds = reload_seconds
+        self._graph: Optional[MerchantGraph] = None
+        self._mtime: Optional[float] = None
+        self._checked_at = 0.0
+        # (user_id, merchant) -> [count, amount, first_seen, recorded_at]
+        self._delta: Dict[Tuple[int, str], List[float]] = {}
+        self._delta_by_merchant: Dict[str, Set[int]] = {}
+        self._delta_by_user: Dict[int, Set[str]] = {}
+        self._lock = threading.Lock()
+
+    def graph(self) -> Optional[MerchantGraph]:
+        if time.monotonic() - self._checked_at >= self.reload_seconds:
+            self._reload_if_changed()
+        return self._graph
+
+    def _reload_if_changed(self):
+        with self._lock:
+            self._checked_at = time.monotonic()
+            try:
+                mtime = os.stat(self.path).st_mtime
+            except FileNotFoundError:
+                return
+            if mtime == self._mtime:
+                return
+            try:
+                graph = MerchantGraph.load(self.path)
+            except Exception as e:
+                logger.error(f"Failed to load merchant graph: {e}")
+                return
+            self._graph, self._mtime = graph, mtime
+            # Edges recorded before the build are already in the snapshot
+            self._delta = {k: v for k, v in self._delta.items() if v[3] >= graph.built_at}
+            self._delta_by_merchant, self._delta_by_user = {}, {}
+            for user_id, merchant in self._delta:
+                self._index_delta(user_id, merchant)
+            logger.info(f"Loaded merchant graph: {graph.edge_total} edges")
+
+    def _index_delta(self, user_id: int, merchant: str):
+        self._delta_by_merchant.setdefault(merchant, set()).add(user_id)
+        self._delta_by_user.setdefault(user_id, set()).add(merchant)
+
+    def record(self, user_id: Optional[int], merchant: Optional[str], amount: Optional[float], date: Optional[datetime]):
+        """Add a new transaction's edge to the delta"""
+        merchant = merchant_index.canonical(merchant)
+        if not user_id or not merchant or date is None:
+            return
+        seen = _seconds(date)
+        with self._lock:
+            edge = self._delta.get((user_id, merchant))
+            if edge is None:
+                self._delta[(user_id, merchant)] = [1, amount or 0.0, seen, time.time()]
+                self._index_delta(user_id, merchant)
+            else:
+                edge[0] += 1
+                edge[1] += amount or 0.0
+                edge[2] = min(edge[2], seen)
+                edge[3] = time.time()
+
+    def _merchant_users(self, graph: Optional[MerchantGraph], merchant: str) -> Dict[int, float]:
+        """user_id -> first seen, for every user of a merchant"""
+        users: Dict[int, float] = {}
+        if graph is not None and merchant in graph.merchant_index:
+            m = graph.merchant_index[merchant]
+            codes = graph.merchant_users_of(m)
+            for user_id, first in zip(graph.user_ids[codes].tolist(), graph.merchant_first_seen(m).tolist()):
+                users[user_id] = first
+        for user_id in self._delta_by_merchant.get(merchant, ()):
+            first = self._delta[(user_id, merchant)][2]
+            users[user_id] = min(users.get(user_id, first), first)
+        return users
+
+    def _user_count(self, graph: Optional[MerchantGraph]) -> int:
+        users = set(self._delta_by_user)
+        if graph is not None:
+            users.update(graph.user_index)
+        return len(users)
+
+    @staticmethod
+    def _rare_limit(user_count: int) -> int:
+        """Most users a rare merchant may have, relative to the population"""
+        return min(int(user_count * RARE_MERCHANT_SHARE), RARE_MERCHANT_MAX_USERS)
+
+    def _rare_merchants_of(self, graph: Optional[MerchantGraph], user_id: int, limit: int) -> Set[str]:
+        rare = set()
+        if graph is not None and user_id in graph.user_index:
+            codes = graph.user_merchants(graph.user_index[user_id])
+            rare.update(graph.merchants[codes[graph.fan_in[codes] <= limit]].tolist())
+        for merchant in self._delta_by_user.get(user_id, ()):
+            if len(self._merchant_users(graph, merchant)) <= limit:
+                rare.add(merchant)
+        return rare
+
+    def features(self, user_id: Optional[int], merchant: Optional[str], now: Optional[datetime] = None) -> Dict[str, Any]:
+        """Graph features for a (user, merchant) edge, empty while the graph is too small to judge"""
+        merchant = merchant_index.canonical(merchant)
+        if not user_id or not merchant:
+            return {}
+        graph = self.graph()
+        now_seconds = _seconds(now or datetime.utcnow())
+        recent = now_seconds - NEW_EDGE_DAYS * 86400
+
+        with self._lock:
+            user_count = self._user_count(graph)
+            if user_count < MIN_GRAPH_USERS:
+                return {}
+            rare_limit = self._rare_limit(user_count)
+            users = self._merchant_users(graph, merchant)
+            fan_in = len(users)
+            first_seen = users.get(user_id)
+            new_edges = sum(1 for first in users.values() if first >= recent)
+
+            shared_rare: List[str] = []
+            cluster: List[int] = []
+            if 2 <= fan_in <= rare_limit:
+                # Other rare merchants this small group of users has in common
+                cluster = sorted(users)
+                counts: Dict[str, int] = {}
+                for member in cluster:
+                    for other in self._rare_merchants_of(graph, member, rare_limit):
+                        if other != merchant:
+                            counts[other] = counts.get(other, 0) + 1
+                shared_rare = sorted(m for m, n in counts.items() if n >= 2)
+
+        return {
+            "merchant": merchant,
+            "fan_in": fan_in,
+            "edge_new": first_seen is None or first_seen >= recent,
+            "merchant_new_edges": new_edges,
+            "shared_rare_merchants": shared_rare,
+            "cluster_users": cluster,
+        }
+
+    def find_rings(self) -> List[Dict[str, Any]]:
+        """
+        Groups of users connected through several rare merchants
+
+        Users are joined (union-find) through rare merchants; components
+        that share at least RING_MIN_SHARED rare merchants are returned.
+        """
+        graph = self.graph()
+        if graph is None or len(graph.user_ids) < MIN_GRAPH_USERS:
+            return []
+
+        rare = np.flatnonzero((graph.fan_in >= 2) & (graph.fan_in <= self._rare_limit(len(graph.user_ids))))
+        parent = list(range(len(graph.user_ids)))
+
+        def find(x: int) -> int:
+            while parent[x] != x:
+                parent[x] = parent[parent[x]]
+                x = parent[x]
+            return x
+
+        for m in rare.tolist():
+            members = graph.merchant_users_of(m).tolist()
+            root = find(members[0])
+            for member in members[1:]:
+                parent[find(member)] = root
+
+        components: Dict[int, Dict[str, Any]] = {}
+        for m in rare.tolist():
+            members = graph.merchant_users_of(m).tolist()
+            component = components.setdefault(find(members[0]), {"users": set(), "merchants": []})
+            component["users"].update(members)
+            component["merchants"].append(str(graph.merchants[m]))
+
+        rings = [
+            {
+                "user_ids": sorted(int(graph.user_ids[u]) for u in c["users"]),
+                "merchants": sorted(c["merchants"]),
+                "user_count": len(c["users"]),
+                "merchant_count": len(c["merchants"]),
+            }
+            for c in components.values()
+            if len(c["merchants"]) >= RING_MIN_SHARED
+        ]
+        return sorted(rings, key=lambda r: (-r["merchant_count"], -r["user_count"]))
+
+    def info(self) -> Dict[str, Any]:
+        graph = self._graph
+        return {
+            "loaded": graph is not None,
+            "users": len(graph.user_ids) if graph is not None else 0,
+            "merchants": len(graph.merchants) if graph is not None else 0,
+            "edges": graph.edge_total if graph is not None else 0,
+            "delta_edges": len(self._delta),
+            "built_at": datetime.utcfromtimestamp(graph.built_at).isoformat() if graph is not None else None,
+        }
+
+
+graph_store = GraphStore(
+    path=os.path.join(settings.model_dir, "merchant_graph.npz"),
+    reload_seconds=settings.anomaly_model_reload_seconds,
+)
@@ -0,0 +1,200 @@
+"""
+Merchant name normalization and canonical merchant resolution
+"""
+from typing import Dict, Optional, List, Set, Iterable, Tuple
+from collections import Counter
+from functools import lru_cache
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from app.models import Transaction
+import pandas as pd
+import threading
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+CANONICAL_SIMILARITY = 0.75  # Names at least this similar share a canonical merchant
+MATCH_SIMILARITY = 0.6  # Similarity at which two merchant names are considered the same
+MAX_POSTING = 5000  # Trigrams shared by more names than this are too common to rank by
+MAX_CANONICAL = 200000
+WARM_MERCHANTS = 50000  # Most frequent merchants loaded on warm-up
+
+# Card processor / wallet prefixes, e.g. "SQ *BLUE BOTTLE" or "TST* CAFE"
+_PROCESSOR_PREFIX = re.compile(
+    r"^(sq|tst|sp|pp|paypal|pwp|py|dd|ddbr|ic|in|bt|cke|gglpay|google|apple\s?pay|ach|pos|checkcard)\s*\*\s*"
+)
+# Bank statement prefixes, e.g. "POS DEBIT 12/03 SHELL OIL"
+_BANK_PREFIX = re.compile(r"^(?:(?:pos|debit|recurring|checkcard|purchase|authorized on)\s+|\d{2}/\d{2}\s+)+")
+_CARD_SUFFIX = re.compile(r"(x{2,}|\*{2,})\d{2,4}|\b(card|ending in)\s*\d{4}\b")
+_STORE_NUMBER = re.compile(r"#\s*\d+|\b(store|str|unit|loc|no)\s*\d+\b|\b[a-z]?\d{3,}\b")
+_NON_ALNUM = re.compile(r"[^a-z0-9]+")
+
+_NOISE_WORDS = frozenset([
+    "inc", "llc", "ltd", "co", "corp", "com", "the", "us", "usa", "mktp", "marketplace", "online",
+])
+_WORD_ALIASES = {
+    "amzn": "amazon",
+    "sbux": "starbucks",
+    "mcdonald": "mcdonalds",
+    "wm": "walmart",
+}
+_PHRASE_ALIASES = {
+    "wal mart": "walmart",
+    "walmart supercenter": "walmart",
+    "mc donalds": "mcdonalds",
+    "uber trip": "uber",
+    "lyft ride": "lyft",
+}
+
+
+@lru_cache(maxsize=100000)
+def normalize_merchant(merchant: Optional[str]) -> str:
+    """
+    Deterministic cleanup of a raw merchant string
+
+    Lowercases, strips processor prefixes, reference codes after '*',
+    card suffixes and store numbers, drops legal/noise words and applies
+    known aliases, so "AMZN MKTP US*2X4" and "Amazon.com" both become
+    "amazon".
+    """
+    name = (merchant or "").lower().replace("'", "").strip()
+    name = _BANK_PREFIX.sub("", name)
+    name = _PROCESSOR_PREFIX.sub("", name)
+    head, star, _ = name.partition("*")
+    if star and head.strip():
+        name = head  # Reference code after the star
+    name = _CARD_SUFFIX.sub(" ", name)
+    name = _STORE_NUMBER.sub(" ", name)
+    words = [
+        _WORD_ALIASES.get(word, word)
+        for word in _NON_ALNUM.sub(" ", name).split()
+        if word not in _NOISE_WORDS
+    ]
+    name = " ".join(words)
+    return _PHRASE_ALIASES.get(name, name)
+
+
+def trigrams(name: str) -> Set[str]:
+    padded = f"  {name} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _dice(a: Set[str], b: Set[str]) -> float:
+    if not a or not b:
+        return 0.0
+    return 2 * len(a & b) / (len(a) + len(b))
+
+
+@lru_cache(maxsize=100000)
+def _similarity(a: str, b: str) -> float:
+    if a == b:
+        return 1.0
+    words_a, words_b = set(a.split()), set(b.split())
+    if words_a <= words_b or words_b <= words_a:
+        return 0.9  # "starbucks" vs "starbucks coffee"
+    return _dice(trigrams(a), trigrams(b))
+
+
+class MerchantIndex:
+    """
+    Canonical merchants with a character-trigram inverted index
+
+    A normalized name maps to the most similar known canonical merchant
+    (trigram Dice coefficient), or becomes canonical itself. Decisions are
+    cached, so each distinct name is resolved once per process.
+    """
+
+    def __init__(self):
+        self._names: List[str] = []
+        self._grams: List[Set[str]] = []
+        self._postings: Dict[str, List[int]] = {}
+        self._canonical: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    def _add(self, name: str):
+        index = len(self._names)
+        grams = trigrams(name)
+        self._names.append(name)
+        self._grams.append(grams)
+        for gram in grams:
+            self._postings.setdefault(gram, []).append(index)
+        self._canonical[name] = name
+
+    def search(self, name: str, limit: int = 5) -> List[Tuple[str, float]]:
+        """Most similar canonical merchants to a normalized name"""
+        grams = trigrams(name)
+        shared: Counter = Counter()
+        for gram in grams:
+            posting = self._postings.get(gram)
+            if posting and len(posting) <= MAX_POSTING:
+                shared.update(posting)
+        # Only the names sharing the most grams can have the highest Dice score
+        scored = [
+            (self._names[i], 2 * n / (len(grams) + len(self._grams[i])))
+            for i, n in shared.most_common(limit * 4)
+        ]
+        return sorted(scored, key=lambda s: (-s[1], s[0]))[:limit]
+
+    def canonical(self, merchant: Optional[str]) -> str:
+        """Canonical merchant for a raw name, "" when there is none"""
+        name = normalize_merchant(merchant)
+        if not name:
+            return ""
+        found = self._canonical.get(name)
+        if found is not None:
+            return found
+
+        with self._lock:
+            found = self._canonical.get(name)
+            if found is not None:
+                return found
+            matches = self.search(name, limit=1)
+            if matches and matches[0][1] >= CANONICAL_SIMILARITY:
+                found = self._canonical[name] = matches[0][0]
+            elif len(self._names) < MAX_CANONICAL:
+                self._add(name)
+                found = name
+            else:
+                found = name
+            return found
+
+    def canonical_many(self, merchants: Iterable[Optional[str]]) -> List[str]:
+        """canonical() over many names, resolving each distinct name once"""
+        codes, uniques = pd.factorize(pd.Series(list(merchants), dtype=object).fillna(""))
+        resolved = [self.canonical(name) for name in uniques]
+        return [resolved[code] for code in codes]
+
+    def similarity(self, a: Optional[str], b: Optional[str]) -> float:
+        """0..1 similarity of two raw merchant names, cached per normalized pair"""
+        a, b = normalize_merchant(a), normalize_merchant(b)
+        if not a or not b:
+            return 0.0
+        if self.canonical(a) == self.canonical(b):
+            return 1.0
+        return _similarity(*sorted((a, b)))
+
+    def matches(self, a: Optional[str], b: Optional[str]) -> bool:
+        return self.similarity(a, b) >= MATCH_SIMILARITY
+
+    def warm(self, db: Session, limit: int = WARM_MERCHANTS):
+        """
+        Seed canonical merchants, most frequent first
+
+        Frequent spellings become canonical before their rarer variants are
+        resolved, which keeps canonical names stable across restarts.
+        """
+        rows = db.query(Transaction.merchant, func.count(Transaction.id)).filter(
+            Transaction.merchant.isnot(None)
+        ).group_by(Transaction.merchant).order_by(
+            func.count(Transaction.id).desc(), Transaction.merchant
+        ).limit(limit).all()
+        for merchant, _ in rows:
+            self.canonical(merchant)
+        logger.info(f"Merchant index warmed: {len(self._names)} canonical merchants")
+
+
+merchant_index = MerchantIndex()
@@ -0,0 +1,100 @@
+"""
+OCR worker pool - bounded, awaitable receipt text extraction
+"""
+from typing import Dict, Any, Optional
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from app.config import settings
+from PIL import Image
+import pytesseract
+import numpy as np
+import threading
+import asyncio
+import logging
+import time
+import os
+
+logger = logging.getLogger(__name__)
+
+TIMING_HISTORY = 500  # Recent jobs kept for latency percentiles
+
+
+class OcrPool:
+    """
+    Runs tesseract off the event loop with at most `workers` jobs at a time
+
+    Each pytesseract call spawns a tesseract subprocess and waits for it,
+    so worker threads spend their time outside the GIL and one per core
+    saturates the CPU. Jobs beyond the limit wait in the executor's queue;
+    queue depth and per-job wait/run times are tracked for stats().
+    """
+
+    def __init__(self, workers: Optional[int] = None):
+        self.workers = workers or os.cpu_count() or 1
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="ocr")
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._running = 0
+        self._completed = 0
+        self._failed = 0
+        self._wait_ms: deque = deque(maxlen=TIMING_HISTORY)
+        self._run_ms: deque = deque(maxlen=TIMING_HISTORY)
+
+    async def extract_text(self, file_path: str) -> str:
+        """OCR an image file; raises whatever PIL or tesseract raised"""
+        with self._lock:
+            self._queued += 1
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._run, file_path, time.perf_counter())
+
+    def _run(self, file_path: str, submitted: float) -> str:
+        started = time.perf_counter()
+        with self._lock:
+            self._queued -= 1
+            self._running += 1
+            self._wait_ms.append((started - submitted) * 1000)
+
+        ok = False
+        try:
+            with Image.open(file_path) as image:
+                text = pytesseract.image_to_string(image)
+            ok = True
+            return text
+        finally:
+            elapsed = (time.perf_counter() - started) * 1000
+            with self._lock:
+                self._running -= 1
+                if ok:
+                    self._completed += 1
+                    self._run_ms.append(elapsed)
+                else:
+                    self._failed += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            wait_ms = np.array(self._wait_ms)
+            run_ms = np.array(self._run_ms)
+            counts = {
+                "workers": self.workers,
+                "queued": self._queued,
+                "running": self._running,
+                "completed": self._completed,
+                "failed": self._failed,
+            }
+
+        def percentiles(values: np.ndarray) -> Dict[str, float]:
+            if len(values) == 0:
+                return {"p50": 0.0, "p95": 0.0, "max": 0.0}
+            return {
+                "p50": float(np.percentile(values, 50)),
+                "p95": float(np.percentile(values, 95)),
+                "max": float(values.max()),
+            }
+
+        return {**counts, "wait_ms": percentiles(wait_ms), "run_ms": percentiles(run_ms)}
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+ocr_pool = OcrPool(workers=settings.ocr_workers)
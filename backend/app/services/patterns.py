@@ -0,0 +1,306 @@
+"""
+Spending pattern detection - threshold splitting, round amounts and Benford's law
+"""
+from typing import Dict, Any, Optional, List, Iterable
+from datetime import datetime
+from sqlalchemy import or_
+from sqlalchemy.orm import Session
+from app.config import settings
+from app.models import Alert, Transaction, TransactionStatus
+from app.services.fx import base_amount_column
+from app.services.merchants import normalize_merchant
+from scipy.stats import chi2
+import numpy as np
+import pandas as pd
+import logging
+
+logger = logging.getLogger(__name__)
+
+SPLIT_MIN_SHARE = 0.3  # Charges smaller than this share of the threshold are not split parts
+ROUND_UNIT = 10  # Whole multiples of this are "round"
+ROUND_MAX_SHARE = 0.25  # Natural spending has roughly 1-2% round amounts
+ROUND_MIN_COUNT = 20
+BENFORD_MIN_COUNT = 50  # Benford's law needs a reasonable sample
+BENFORD_MAD_LIMIT = 0.015  # Nigrini's nonconformity cut-off for first digits, an effect size
+BENFORD_P_VALUE = 0.001  # Chi-square significance; small samples deviate by chance far above the MAD cut-off
+BENFORD_EXPECTED = np.log10(1 + 1 / np.arange(1, 10))
+
+COLUMNS = ["id", "user_id", "amount", "merchant", "date"]
+
+
+def load_frame(
+    db: Session, user_ids: Iterable[int], start: datetime, end: Optional[datetime] = None
+) -> pd.DataFrame:
+    """Load non-rejected transactions for a set of users, sorted per user"""
+    query = db.query(
+        Transaction.id,
+        Transaction.user_id,
+        base_amount_column(),
+        Transaction.merchant,
+        Transaction.date,
+    ).filter(
+        Transaction.user_id.in_(list(user_ids)),
+        Transaction.status != TransactionStatus.REJECTED.value,
+        Transaction.amount.isnot(None),
+        Transaction.date >= start,
+    )
+    if end is not None:
+        query = query.filter(Transaction.date <= end)
+    df = pd.DataFrame(query.all(), columns=COLUMNS)
+    df["date"] = pd.to_datetime(df["date"], utc=True).dt.tz_localize(None)
+    return df.sort_values(["user_id", "date", "id"], kind="mergesort").reset_index(drop=True)
+
+
+def find_splits(
+    df: pd.DataFrame, thresholds: List[float], window_hours: float
+) -> List[Dict[str, Any]]:
+    """
+    Sequences of same-merchant charges that each stay under an approval
+    threshold but together exceed it within the window
+
+    Rows are sorted by (user, merchant, date) and every row looks back over
+    its window with one searchsorted, so the scan is O(n log n). A sequence
+    is reported once, against the highest threshold it circumvents.
+    """
+    findings = []
+    reported: List[set] = []
+    if df.empty:
+        return findings
+
+    df = df.assign(merchant_key=[normalize_merchant(m) for m in df["merchant"]])
+    df = df[df["merchant_key"] != ""]
+    window = int(window_hours * 3600)
+
+    for threshold in sorted(thresholds, reverse=True):
+        parts = df[(df["amount"] < threshold) & (df["amount"] >= threshold * SPLIT_MIN_SHARE)]
+        if len(parts) < 2:
+            continue
+        parts = parts.sort_values(["user_id", "merchant_key", "date", "id"], kind="mergesort")
+        group = pd.factorize(list(zip(parts["user_id"], parts["merchant_key"])))[0]
+        seconds = parts["date"].to_numpy().astype("datetime64[s]").astype(np.int64)
+        seconds = seconds - seconds.min()
+        # Offsetting each group past the previous one keeps windows inside their group
+        timeline = group.astype(np.int64) * (int(seconds.max()) + window + 1) + seconds
+
+        amounts = parts["amount"].to_numpy()
+        cumulative = np.concatenate([[0.0], np.cumsum(amounts)])
+        end = np.arange(len(parts))
+        start = np.searchsorted(timeline, timeline - window, side="left")
+        totals = cumulative[end + 1] - cumulative[start]
+        hits = np.flatnonzero((end - start >= 1) & (totals > threshold))
+
+        # Keep the longest sequence ending in each overlapping run
+        ids = parts["id"].to_numpy()
+        last_start = -1
+        for i in hits[::-1]:
+            if last_start != -1 and i >= last_start:
+                continue
+            last_start = start[i]
+            sequence = set(ids[start[i]:i + 1].tolist())
+            if any(sequence <= seen for seen in reported):
+                continue
+            reported.append(sequence)
+            span = parts.iloc[start[i]:i + 1]
+            findings.append({
+                "pattern": "split",
+                "user_id": int(span["user_id"].iloc[0]),
+                "merchant": span["merchant"].iloc[0],
+                "threshold": threshold,
+                "total": float(totals[i]),
+                "count": int(i - start[i] + 1),
+                "transaction_ids": [int(x) for x in ids[start[i]:i + 1]],
+                "severity": "high",
+                "description": (
+                    f"{i - start[i] + 1} charges at {span['merchant'].iloc[0]} totalling ${totals[i]:.2f}, "
+                    f"each under the ${threshold:,.0f} approval limit, within {window_hours:g}h"
+                ),
+            })
+    return findings
+
+
+def first_digit(amount: float) -> int:
+    """Leading digit of an amount, 0 below $1 where Benford's law does not apply"""
+    amount = abs(amount)
+    if amount < 1:
+        return 0
+    return int(amount / 10 ** np.floor(np.log10(amount)))
+
+
+def is_round_amount(amount: float) -> bool:
+    cents = int(round(abs(amount) * 100))
+    return cents >= ROUND_UNIT * 100 and cents % (ROUND_UNIT * 100) == 0
+
+
+def digit_period(now: Optional[datetime] = None) -> str:
+    """Calendar month a per-user digit finding belongs to; each is alerted once per period"""
+    return (now or datetime.utcnow()).strftime("%Y-%m")
+
+
+def _period_start(period: str) -> datetime:
+    return datetime.strptime(period, "%Y-%m")
+
+
+def digit_findings(
+    user_id: int, count: int, round_count: int, digit_counts: Iterable[int], period: str
+) -> List[Dict[str, Any]]:
+    """
+    Round-amount and Benford findings from a user's running counts
+
+    digit_counts holds the number of amounts per first digit 1-9.
+    """
+    findings = []
+    round_share = round_count / max(count, 1)
+    if count >= ROUND_MIN_COUNT and round_share > ROUND_MAX_SHARE:
+        findings.append({
+            "pattern": "round_amounts",
+            "user_id": int(user_id),
+            "share": float(round_share),
+            "count": int(count),
+            "period": period,
+            "severity": "medium",
+            "description": (
+                f"{round_share * 100:.0f}% of {count} transactions are round multiples of ${ROUND_UNIT}"
+            ),
+        })
+
+    digit_counts = np.asarray(list(digit_counts), dtype=np.float64)
+    digit_total = int(digit_counts.sum())
+    if digit_total >= BENFORD_MIN_COUNT:
+        mad = float(np.abs(digit_counts / digit_total - BENFORD_EXPECTED).mean())
+        expected = BENFORD_EXPECTED * digit_total
+        p_value = float(chi2.sf(((digit_counts - expected) ** 2 / expected).sum(), df=8))
+        # The deviation must be both large and unlikely at this sample size
+        if mad > BENFORD_MAD_LIMIT and p_value < BENFORD_P_VALUE:
+            findings.append({
+                "pattern": "benford",
+                "user_id": int(user_id),
+                "mad": mad,
+                "p_value": p_value,
+                "count": digit_total,
+                "period": period,
+                "severity": "medium",
+                "description": (
+                    f"First digits of {digit_total} amounts deviate from Benford's law "
+                    f"(MAD {mad:.3f} > {BENFORD_MAD_LIMIT}, p = {p_value:.1g})"
+                ),
+            })
+    return findings
+
+
+def user_digit_patterns(df: pd.DataFrame, period: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Per-user round-amount share and Benford first-digit deviation"""
+    findings = []
+    if df.empty:
+        return findings
+    period = period or digit_period()
+
+    amounts = df["amount"].abs().to_numpy()
+    users, user_index = np.unique(df["user_id"].to_numpy(), return_inverse=True)
+    counts = np.bincount(user_index, minlength=len(users))
+
+    cents = np.round(amounts * 100).astype(np.int64)
+    is_round = (cents >= ROUND_UNIT * 100) & (cents % (ROUND_UNIT * 100) == 0)
+    round_counts = np.bincount(user_index, weights=is_round, minlength=len(users))
+
+    positive = amounts >= 1
+    digits = np.zeros(len(amounts), dtype=np.int64)
+    digits[positive] = (amounts[positive] / 10 ** np.floor(np.log10(amounts[positive]))).astype(np.int64)
+    digit_counts = np.bincount(
+        user_index[positive] * 10 + digits[positive], minlength=len(users) * 10
+    ).reshape(len(users), 10)[:, 1:]
+
+    for u in np.flatnonzero(counts >= min(ROUND_MIN_COUNT, BENFORD_MIN_COUNT)):
+        findings.extend(digit_findings(users[u], int(counts[u]), int(round_counts[u]), digit_counts[u], period))
+    return findings
+
+
+def detect(
+    df: pd.DataFrame,
+    thresholds: Optional[List[float]] = None,
+    window_hours: Optional[float] = None,
+) -> List[Dict[str, Any]]:
+    """Run every pattern check over a sorted frame of transactions"""
+    return find_splits(
+        df,
+        thresholds or settings.split_thresholds,
+        window_hours or settings.split_window_hours,
+    ) + user_digit_patterns(df)
+
+
+def finding_key(finding: Dict[str, Any]) -> str:
+    """Identity used to avoid alerting on the same pattern twice"""
+    if finding["pattern"] == "split":
+        return (
+            f"split:{finding['user_id']}:{normalize_merchant(finding['merchant'])}:"
+            f"{finding['threshold']:g}:{finding['transaction_ids'][0]}"
+        )
+    if finding.get("period"):
+        return f"{finding['pattern']}:{finding['user_id']}:{finding['period']}"
+    return f"{finding['pattern']}:{finding['user_id']}"
+
+
+def unreported(db: Session, findings: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Drop findings that were already alerted on
+
+    Splits are skipped while their alert is unresolved. Per-user findings
+    with a period are skipped once alerted in that period, even if the alert
+    was resolved, since every later transaction would raise them again.
+    """
+    if not findings:
+        return []
+    user_ids = {f["user_id"] for f in findings}
+    recent = Alert.is_resolved == False
+    periods = {f["period"] for f in findings if f.get("period")}
+    if periods:
+        recent = or_(recent, Alert.created_at >= min(_period_start(p) for p in periods))
+
+    unresolved, alerted = set(), set()
+    for metadata, is_resolved in db.query(Alert.extra_metadata, Alert.is_resolved).filter(
+        Alert.type == "pattern",
+        Alert.user_id.in_(user_ids),
+        recent,
+    ).all():
+        key = ((metadata or {}).get("pattern") or {}).get("key")
+        if key:
+            alerted.add(key)
+            if not is_resolved:
+                unresolved.add(key)
+    # A growing split sequence keeps its first transaction, and so its key
+    return [
+        f for f in findings
+        if finding_key(f) not in (alerted if f.get("period") else unresolved)
+    ]
+
+
+def alert_payload(finding: Dict[str, Any], transactions: Dict[int, Dict[str, Any]]) -> Dict[str, Any]:
+    """NotifierAgent input for a finding"""
+    transaction = {"user_id": finding["user_id"]}
+    if finding.get("transaction_ids"):
+        transaction = transactions.get(finding["transaction_ids"][-1], transaction)
+    return {
+        "transaction": transaction,
+        "alert_type": "pattern",
+        "decision": {
+            "severity": finding["severity"],
+            "risk_score": 0.8 if finding["severity"] == "high" else 0.5,
+            "risk_factors": [finding["description"]],
+            "recommendation": "Review the related transactions for policy circumvention",
+            "pattern": {**finding, "key": finding_key(finding)},
+        },
+    }
+
+
+def transactions_by_id(df: pd.DataFrame, ids: Iterable[int]) -> Dict[int, Dict[str, Any]]:
+    subset = df[df["id"].isin(list(ids))]
+    return {
+        int(row.id): {
+            "id": int(row.id),
+            "user_id": int(row.user_id),
+            "amount": float(row.amount),
+            "merchant": row.merchant,
+            "date": row.date.isoformat(),
+        }
+        for row in subset.itertuples()
+    }
+
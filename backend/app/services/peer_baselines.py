@@ -0,0 +1,163 @@
+"""
+Peer-group baselines per role and category for cold-start anomaly scoring
+"""
+from typing import Dict, Any, Optional, List, Tuple
+from collections import Counter
+from datetime import datetime
+from sqlalchemy.orm import Session
+from app.config import settings
+from app.models import PeerBaseline, Transaction, TransactionStatus, User, UserRole
+from app.services import stats
+from app.services.fx import base_amount_column
+from app.services.merchants import merchant_index
+from app.services.sketch import QuantileSketch
+import threading
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+ALL_CATEGORIES = "*"
+QUANTILES = {"p05": 0.05, "p25": 0.25, "p50": 0.5, "p75": 0.75, "p95": 0.95, "p99": 0.99}
+TOP_MERCHANTS = 200  # Merchants kept per baseline, by popularity
+MIN_PEER_USERS = 3  # Baselines from fewer users are not used for scoring
+
+
+class _Accumulator:
+    """Streaming aggregates for one (role, category) cohort"""
+
+    __slots__ = ("users", "running", "sketch", "merchants", "hours")
+
+    def __init__(self):
+        self.users = set()
+        self.running = stats.RunningStats()
+        self.sketch = QuantileSketch()
+        self.merchants: Counter = Counter()
+        self.hours = [0] * stats.HOURS_PER_WEEK
+
+    def add(self, user_id: int, amount: float, merchant: Optional[str], date: datetime):
+        self.users.add(user_id)
+        stats.welford_add(self.running, amount)
+        self.sketch.add(amount)
+        merchant = merchant_index.canonical(merchant)
+        if merchant:
+            self.merchants[merchant] += 1
+        self.hours[stats.hour_of_week(date)] += 1
+
+    def to_row(self, role: str, category: str) -> PeerBaseline:
+        count = self.running.count
+        median, mad = self.sketch.median_and_mad()
+        return PeerBaseline(
+            role=role,
+            category=category,
+            user_count=len(self.users),
+            transaction_count=count,
+            mean=self.running.mean,
+            std=self.running.std(),
+            median=median,
+            mad=mad,
+            quantiles={name: self.sketch.quantile(q) for name, q in QUANTILES.items()},
+            merchants={m: n / count for m, n in self.merchants.most_common(TOP_MERCHANTS)},
+            tail_merchants=max(len(self.merchants) - TOP_MERCHANTS, 0),
+            hours=[n / count for n in self.hours],
+        )
+
+
+def compute_baselines(db: Session, chunk_size: int = 5000) -> int:
+    """
+    Recompute every peer baseline from the anomaly history window
+
+    Rows are streamed and folded into per-cohort running aggregates, so
+    memory depends on the number of cohorts rather than transactions.
+    The table is replaced in a single commit.
+    """
+    cohorts: Dict[Tuple[str, str], _Accumulator] = {}
+
+    rows = db.query(
+        User.role,
+        Transaction.user_id,
+        base_amount_column(),
+        Transaction.category,
+        Transaction.merchant,
+        Transaction.date,
+    ).join(User, User.id == Transaction.user_id).filter(
+        Transaction.status != TransactionStatus.REJECTED.value,
+        Transaction.category.isnot(None),
+        Transaction.amount.isnot(None),
+        Transaction.date >= stats.window_cutoff(),
+    ).yield_per(chunk_size)
+
+    for row in rows:
+        role = row.role or UserRole.EMPLOYEE.value
+        date = stats.naive_utc(row.date)
+        for category in (row.category, ALL_CATEGORIES):
+            cohort = cohorts.get((role, category))
+            if cohort is None:
+                cohort = cohorts[(role, category)] = _Accumulator()
+            cohort.add(row.user_id, row.amount, row.merchant, date)
+
+    db.query(PeerBaseline).delete()
+    db.add_all(cohort.to_row(role, category) for (role, category), cohort in cohorts.items())
+    db.commit()
+
+    peer_baselines.invalidate()
+    logger.info(f"Computed {len(cohorts)} peer baselines")
+    return len(cohorts)
+
+
+def _as_dict(row: PeerBaseline) -> Dict[str, Any]:
+    return {
+        "role": row.role,
+        "category": row.category,
+        "user_count": row.user_count or 0,
+        "count": row.transaction_count or 0,
+        "mean": row.mean or 0.0,
+        "std": row.std or 0.0,
+        "median": row.median,
+        "mad": row.mad,
+        "quantiles": row.quantiles or {},
+        "merchants": row.merchants or {},
+        "tail_merchants": row.tail_merchants or 0,
+        "hours": row.hours or [],
+    }
+
+
+class PeerBaselineCache:
+    """In-memory copy of the peer baseline table, reloaded periodically"""
+
+    def __init__(self, refresh_seconds: int):
+        self.refresh_seconds = refresh_seconds
+        self._baselines: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+
+    def refresh(self, db: Session, force: bool = False):
+        """Reload baselines from the database if the cached copy is stale"""
+        if not force and time.monotonic() - self._loaded_at < self.refresh_seconds:
+            return
+
+        with self._lock:
+            if not force and time.monotonic() - self._loaded_at < self.refresh_seconds:
+                return
+            self._baselines = {
+                (row.role, row.category): _as_dict(row) for row in db.query(PeerBaseline).all()
+            }
+            self._loaded_at = time.monotonic()
+
+    def invalidate(self):
+        """Force the next refresh to reload from the database"""
+        self._loaded_at = 0.0
+
+    def get(self, db: Session, role: Optional[str], category: str = ALL_CATEGORIES) -> Optional[Dict[str, Any]]:
+        """Baseline for a role and category, if enough peers contributed to it"""
+        self.refresh(db)
+        baseline = self._baselines.get((role or UserRole.EMPLOYEE.value, category))
+        if baseline is None or baseline["user_count"] < MIN_PEER_USERS:
+            return None
+        return baseline
+
+    def all(self) -> List[Dict[str, Any]]:
+        return list(self._baselines.values())
+
+
+peer_baselines = PeerBaselineCache(refresh_seconds=settings.peer_baseline_refresh_seconds)
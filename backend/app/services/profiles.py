@@ -0,0 +1,258 @@
+"""
+In-memory user behaviour profiles with LRU eviction by memory size
+"""
+from typing import Dict, Any, Optional
+from collections import OrderedDict
+from datetime import datetime
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from app.config import settings
+from app.models import Transaction, TransactionStatus, User
+from app.services import stats
+from app.services.fx import base_amount_column
+from app.services.merchants import merchant_index
+from app.services.patterns import first_digit, is_round_amount
+from app.services.sketch import QuantileSketch
+import threading
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# Rough per-entry costs used to keep the cache inside its memory budget
+_BASE_BYTES = 400
+_MERCHANT_BYTES = 120
+_CATEGORY_BYTES = 240
+_SKETCH_BUCKET_BYTES = 100
+_HOURS_BYTES = stats.HOURS_PER_WEEK * 36
+_DIGITS_BYTES = 10 * 36
+
+
+class UserProfile:
+    """Compact view of a user's recent behaviour used by the anomaly checks"""
+
+    __slots__ = (
+        "user_id",
+        "role",
+        "window_start",
+        "loaded_at",
+        "merchants",
+        "merchant_rows",
+        "categories",
+        "category_rows",
+        "amounts",
+        "sketches",
+        "hours",
+        "hour_rows",
+        "round_rows",
+        "digits",
+        "size",
+    )
+
+    def __init__(self, user_id: int, window_start: datetime, role: Optional[str] = None):
+        self.user_id = user_id
+        self.role = role
+        self.window_start = window_start
+        self.loaded_at = time.monotonic()
+        self.merchants: Dict[str, int] = {}  # canonical merchant -> transactions
+        self.merchant_rows = 0
+        self.categories: Dict[str, int] = {}  # category -> transactions
+        self.category_rows = 0
+        self.amounts: Dict[str, stats.RunningStats] = {}  # category -> amount statistics
+        self.sketches: Dict[str, QuantileSketch] = {}  # category -> amount quantiles
+        self.hours = [0] * stats.HOURS_PER_WEEK  # hour-of-week -> transactions
+        self.hour_rows = 0
+        self.round_rows = 0  # round-amount transactions, for the pattern checks
+        self.digits = [0] * 10  # first digit -> transactions, 0 for amounts below $1
+        self.size = _BASE_BYTES + _HOURS_BYTES + _DIGITS_BYTES
+
+    def amount_stats(self, category: str) -> Dict[str, Any]:
+        running = self.amounts.get(category)
+        if running is None:
+            return {"count": 0, "mean": 0.0, "std": 0.0, "median": None, "mad": None}
+        median, mad = self.sketches[category].median_and_mad()
+        return {
+            "count": running.count,
+            "mean": running.mean,
+            "std": running.std(),
+            "median": median,
+            "mad": mad,
+        }
+
+    def amount_percentile(self, category: str, amount: float) -> Optional[float]:
+        sketch = self.sketches.get(category)
+        if sketch is None or sketch.count <= 0:
+            return None
+        return sketch.rank(amount)
+
+    def apply(self, snap: Dict[str, Any], sign: int):
+        """Add (sign=1) or remove (sign=-1) a transaction's contribution"""
+        merchant = merchant_index.canonical(snap.get("merchant"))
+        category = snap["category"]
+
+        if merchant:
+            count = self.merchants.get(merchant, 0) + sign
+            if count > 0:
+                if merchant not in self.merchants:
+                    self.size += _MERCHANT_BYTES + len(merchant)
+                self.merchants[merchant] = count
+            elif merchant in self.merchants:
+                del self.merchants[merchant]
+                self.size -= _MERCHANT_BYTES + len(merchant)
+            self.merchant_rows += sign
+
+        self.categories[category] = self.categories.get(category, 0) + sign
+        self.category_rows += sign
+
+        if snap.get("date") is not None:
+            self.hours[stats.hour_of_week(snap["date"])] += sign
+            self.hour_rows += sign
+
+        self.round_rows += sign * is_round_amount(snap["amount"])
+        self.digits[first_digit(snap["amount"])] += sign
+
+        running = self.amounts.get(category)
+        if running is None:
+            running = self.amounts[category] = stats.RunningStats()
+            self.sketches[category] = QuantileSketch()
+            self.size += _CATEGORY_BYTES + len(category)
+        sketch = self.sketches[category]
+        buckets = sketch.bucket_count()
+        if sign > 0:
+            stats.welford_add(running, snap["amount"])
+            sketch.add(snap["amount"])
+        else:
+            stats.welford_remove(running, snap["amount"])
+            sketch.remove(snap["amount"])
+        self.size += (sketch.bucket_count() - buckets) * _SKETCH_BUCKET_BYTES
+
+
+def load_profile(db: Session, user_id: int) -> UserProfile:
+    """Build a user's profile from the database"""
+    cutoff = stats.window_cutoff()
+    role = db.query(User.role).filter(User.id == user_id).scalar()
+    profile = UserProfile(user_id, cutoff, role)
+
+    # Rows still being processed have no category yet and are added on write
+    counted = (
+        Transaction.user_id == user_id,
+        Transaction.status != TransactionStatus.REJECTED.value,
+        Transaction.category.isnot(None),
+        Transaction.date >= cutoff,
+    )
+
+    for raw, count in db.query(Transaction.merchant, func.count(Transaction.id)).filter(
+        *counted, Transaction.merchant.isnot(None), Transaction.merchant != ""
+    ).group_by(Transaction.merchant).all():
+        name = merchant_index.canonical(raw)
+        if not name:
+            continue
+        if name not in profile.merchants:
+            profile.size += _MERCHANT_BYTES + len(name)
+        profile.merchants[name] = profile.merchants.get(name, 0) + count
+        profile.merchant_rows += count
+
+    for category, count in db.query(Transaction.category, func.count(Transaction.id)).filter(
+        *counted
+    ).group_by(Transaction.category).all():
+        profile.categories[category] = count
+        profile.category_rows += count
+        row = stats.get_row(db, user_id, category)
+        profile.amounts[category] = stats.RunningStats(row.count or 0, row.mean or 0.0, row.m2 or 0.0)
+        sketch = profile.sketches[category] = QuantileSketch.from_dict(row.sketch)
+        profile.size += 2 * _CATEGORY_BYTES + len(category) + sketch.bucket_count() * _SKETCH_BUCKET_BYTES
+
+    for date, amount in db.query(Transaction.date, base_amount_column()).filter(*counted).all():
+        profile.hours[stats.hour_of_week(stats.naive_utc(date))] += 1
+        profile.hour_rows += 1
+        if amount is not None:
+            profile.round_rows += is_round_amount(amount)
+            profile.digits[first_digit(amount)] += 1
+
+    return profile
+
+
+class ProfileCache:
+    """LRU cache of user profiles, bounded by estimated memory and age"""
+
+    def __init__(self, max_bytes: int, ttl_seconds: int):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._profiles: "OrderedDict[int, UserProfile]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, db: Session, user_id: int) -> UserProfile:
+        """Return the cached profile, loading it on a miss"""
+        with self._lock:
+            profile = self._profiles.get(user_id)
+            if profile is not None and time.monotonic() - profile.loaded_at < self.ttl_seconds:
+                self._profiles.move_to_end(user_id)
+                self.hits += 1
+                return profile
+            self.misses += 1
+
+        profile = load_profile(db, user_id)
+
+        with self._lock:
+            self._discard(user_id)
+            self._profiles[user_id] = profile
+            self._bytes += profile.size
+            self._evict()
+        return profile
+
+    def apply_change(self, before: Optional[Dict[str, Any]], after: Optional[Dict[str, Any]]):
+        """Write-through update of cached profiles for a transaction change"""
+        if before and after and stats.same_contribution(before, after):
+            return
+
+        with self._lock:
+            for snap, sign in ((before, -1), (after, 1)):
+                if not snap:
+                    continue
+                profile = self._profiles.get(snap.get("user_id"))
+                if profile is None or not stats.is_counted(snap, profile.window_start):
+                    continue
+                previous_size = profile.size
+                profile.apply(snap, sign)
+                self._bytes += profile.size - previous_size
+            self._evict()
+
+    def invalidate(self, user_id: Optional[int] = None):
+        """Drop one profile, or all of them"""
+        with self._lock:
+            if user_id is None:
+                self._profiles.clear()
+                self._bytes = 0
+            else:
+                self._discard(user_id)
+
+    def info(self) -> Dict[str, Any]:
+        return {
+            "profiles": len(self._profiles),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+    def _discard(self, user_id: int):
+        profile = self._profiles.pop(user_id, None)
+        if profile is not None:
+            self._bytes -= profile.size
+
+    def _evict(self):
+        while self._bytes > self.max_bytes and len(self._profiles) > 1:
+            _, profile = self._profiles.popitem(last=False)
+            self._bytes -= profile.size
+            self.evictions += 1
+
+
+profile_cache = ProfileCache(
+    max_bytes=settings.profile_cache_max_bytes,
+    ttl_seconds=settings.profile_ttl_seconds,
+)
@@ -0,0 +1,78 @@
+"""
+Content-addressed receipt files - parse result cache and duplicate uploads
+"""
+from typing import Dict, Any, Optional, List
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from app.config import settings
+from app.models import Receipt, ReceiptParseCache
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def cacheable(parsed_data: Optional[Dict[str, Any]]) -> bool:
+    """Only error-free parses at or above the confidence threshold are reused; others are retried"""
+    return (
+        bool(parsed_data)
+        and "error" not in parsed_data
+        and (parsed_data.get("confidence") or 0.0) >= settings.confidence_threshold
+    )
+
+
+def lookup(db: Session, digest: str) -> Optional[ReceiptParseCache]:
+    """Cached OCR text and parse result for a file's content, counting the hit"""
+    entry = db.query(ReceiptParseCache).filter(ReceiptParseCache.content_hash == digest).first()
+    if entry is None or not cacheable(entry.parsed_data):
+        return None
+    entry.hits = (entry.hits or 0) + 1
+    return entry
+
+
+def store(db: Session, digest: str, raw_text: Optional[str], parsed_data: Dict[str, Any]):
+    """Remember a good parse; a concurrent upload of the same file may have won the race"""
+    if not cacheable(parsed_data):
+        return
+    try:
+        entry = db.query(ReceiptParseCache).filter(ReceiptParseCache.content_hash == digest).first()
+        if entry is None:
+            db.add(ReceiptParseCache(content_hash=digest, raw_text=raw_text, parsed_data=parsed_data, hits=0))
+        else:
+            # Replaces a parse cached before the quality check existed
+            entry.raw_text = raw_text
+            entry.parsed_data = parsed_data
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+
+
+def other_uploads(db: Session, digest: str, user_id: int) -> List[Receipt]:
+    """Earlier receipts with the same content uploaded by other users"""
+    return db.query(Receipt).filter(
+        Receipt.content_hash == digest,
+        Receipt.user_id != user_id,
+    ).order_by(Receipt.id).all()
+
+
+def duplicate_alert_payload(receipt: Receipt, others: List[Receipt]) -> Dict[str, Any]:
+    """NotifierAgent input for a receipt file already submitted by someone else"""
+    return {
+        "transaction": {
+            "user_id": receipt.user_id,
+            "amount": receipt.base_amount if receipt.base_amount is not None else receipt.amount,
+            "merchant": receipt.merchant,
+            "date": receipt.date.isoformat() if receipt.date else None,
+        },
+        "alert_type": "duplicate_receipt",
+        "decision": {
+            "severity": "high",
+            "risk_score": 0.7,
+            "risk_factors": [
+                f"Same file was uploaded by user #{other.user_id} as receipt #{other.id}"
+                for other in others
+            ],
+            "recommendation": "Check whether the same expense is being claimed by more than one employee",
+            "receipt_id": receipt.id,
+            "duplicate_of": [other.id for other in others],
+        },
+    }
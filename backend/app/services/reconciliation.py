@@ -0,0 +1,626 @@
+"""
+Batch receipt reconciliation - globally best receipt-to-transaction assignment
+"""
+from typing import Dict, Any, Optional, List, Tuple, Iterable, Sequence
+from datetime import datetime, timedelta
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import Session
+from scipy.optimize import linear_sum_assignment
+from app.config import settings
+from app.models import Receipt, SweepWatermark, Transaction
+from app.services import stats
+from app.services.fx import base_amount_between, stored_base_amount
+from app.services.merchants import merchant_index
+import numpy as np
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+AMOUNT_TOLERANCE = 0.01  # Same 1% band as single-receipt matching
+AMOUNT_WEIGHT = 0.5
+MERCHANT_WEIGHT = 0.3
+DATE_WEIGHT = 0.2
+
+_IN_CLAUSE_CHUNK = 500
+_WINDOW_CHUNK = 100  # Users per candidate query, each with its own date window
+
+GROUP_CONVERSION_CENTS = 1  # Rounding allowed per part when rows were converted from different currencies
+GROUP_MAX_CANDIDATES = 6  # Closest-dated candidates per anchor; more of them make chance sums likely
+_DEADLINE_CHECK_NODES = 256
+
+SWEEP_WATERMARK = "reconcile_sweep"
+ALERT_WATERMARK = "reconcile_mismatch_alerts"
+SWEEP_OVERLAP = timedelta(seconds=5)  # Re-read rows committed while the previous run started
+
+
+def score_pairs(receipts: List[Receipt], transactions: List[Transaction]) -> List[Tuple[int, int, float]]:
+    """
+    Sparse (receipt index, transaction index, score) edges for one user
+
+    Only pairs inside the amount band and the date window get an edge, so
+    each receipt is compared with a handful of transactions found by
+    binary search over the amount-sorted transactions.
+    """
+    if not receipts or not transactions:
+        return []
+
+    base = [stored_base_amount(txn) for txn in transactions]
+    order = sorted(range(len(transactions)), key=lambda j: base[j])
+    amounts = np.array([base[j] for j in order])
+    window = settings.reconcile_window_days * 86400
+
+    edges = []
+    for i, receipt in enumerate(receipts):
+        amount = stored_base_amount(receipt)
+        tolerance = max(amount * AMOUNT_TOLERANCE, 0.01)
+        lo = np.searchsorted(amounts, amount - tolerance, side="left")
+        hi = np.searchsorted(amounts, amount + tolerance, side="right")
+        receipt_date = stats.naive_utc(receipt.date or receipt.created_at)
+
+        for k in range(lo, hi):
+            j = order[k]
+            txn = transactions[j]
+            date_score = 1.0
+            if receipt_date and txn.date:
+                seconds = abs((stats.naive_utc(txn.date) - receipt_date).total_seconds())
+                if seconds > window:
+                    continue
+                date_score = 1.0 - seconds / (window + 86400)
+            score = (
+                AMOUNT_WEIGHT * (1.0 - abs(base[j] - amount) / (tolerance * 2))
+                + MERCHANT_WEIGHT * merchant_index.similarity(receipt.merchant, txn.merchant)
+                + DATE_WEIGHT * date_score
+            )
+            edges.append((i, j, score))
+    return edges
+
+
+class _SearchTimeout(Exception):
+    pass
+
+
+def find_subset(
+    target: float, amounts: Sequence[float], max_items: int, deadline: float, part_cents: int = 0
+) -> Optional[List[int]]:
+    """
+    Indices of 2 to max_items amounts that sum to target in cents
+
+    The sum must be exact, or within part_cents per chosen amount when the
+    amounts carry conversion rounding. Bounded subset-sum: depth-first
+    over the amounts sorted largest first, pruning a branch once the
+    remaining sum is overshot or can no longer be reached by the largest
+    items left, and memoizing (position, remaining, items left) states
+    that failed. Returns None when there is no such subset or the
+    deadline (time.perf_counter()) passes first.
+    """
+    tolerance = part_cents * max_items  # Loosest bound, for pruning
+    goal = round(target * 100)
+    order = sorted(
+        (i for i, a in enumerate(amounts) if 0 < a and round(a * 100) <= goal + tolerance),
+        key=lambda i: -amounts[i],
+    )
+    cents = [round(amounts[i] * 100) for i in order]
+    prefix = [0]
+    for c in cents:
+        prefix.append(prefix[-1] + c)
+    n = len(cents)
+    failed = set()
+    nodes = 0
+
+    def best(start: int, count: int) -> int:
+        # Largest sum reachable with count items from start on (items are sorted)
+        return prefix[min(start + count, n)] - prefix[start]
+
+    def search(pos: int, remaining: int, left: int, chosen: List[int]) -> Optional[List[int]]:
+        nonlocal nodes
+        if len(chosen) >= 2 and abs(remaining) <= part_cents * len(chosen):
+            return list(chosen)
+        if left == 0 or pos == n or best(pos, left) < remaining - tolerance:
+            return None
+        key = (pos, remaining, left)
+        if key in failed:
+            return None
+        nodes += 1
+        if nodes % _DEADLINE_CHECK_NODES == 0 and time.perf_counter() > deadline:
+            raise _SearchTimeout()
+
+        for k in range(pos, n):
+            if best(k, left) < remaining - tolerance:
+                break  # Later items are smaller still
+            if cents[k] > remaining + tolerance:
+                continue
+            chosen.append(k)
+            found = search(k + 1, remaining - cents[k], left - 1, chosen)
+            if found:
+                return found
+            chosen.pop()
+        failed.add(key)
+        return None
+
+    try:
+        found = search(0, goal, max_items, [])
+    except _SearchTimeout:
+        return None
+    return [order[k] for k in found] if found else None
+
+
+def _amounts(row) -> Tuple[Optional[float], str, Optional[float]]:
+    """(raw amount, currency, base amount) of a receipt or transaction row"""
+    raw = row.amount if row.amount is not None else getattr(row, "total", None)
+    return raw, (row.currency or settings.base_currency).upper(), stored_base_amount(row)
+
+
+def group_amounts(anchor: Tuple, members: Sequence[Tuple]) -> Tuple[float, List[float], int]:
+    """
+    Target, part amounts and per-part tolerance in cents for a split/combined search
+
+    anchor and members are _amounts() tuples. When all rows share one
+    currency their raw amounts must add up exactly; otherwise base amounts
+    are compared with a cent of conversion rounding per part.
+    """
+    if len({anchor[1]} | {m[1] for m in members}) == 1:
+        return anchor[0] or 0.0, [m[0] or 0.0 for m in members], 0
+    return anchor[2] or 0.0, [m[2] or 0.0 for m in members], GROUP_CONVERSION_CENTS
+
+
+def _group_candidates(anchor, others: List, others_base: List[float], used: set, window: float) -> List[int]:
+    """Unused rows of the anchor's merchant inside its date window, closest dates first"""
+    anchor_date = stats.naive_utc(anchor.date or getattr(anchor, "created_at", None))
+    candidates = []
+    for j, other in enumerate(others):
+        if j in used or not others_base[j]:
+            continue
+        if not merchant_index.matches(anchor.merchant, other.merchant):
+            continue
+        other_date = stats.naive_utc(other.date or getattr(other, "created_at", None))
+        seconds = abs((other_date - anchor_date).total_seconds()) if anchor_date and other_date else 0.0
+        if seconds <= window:
+            candidates.append((seconds, j))
+    candidates.sort()
+    return [j for _, j in candidates[:GROUP_MAX_CANDIDATES]]
+
+
+def match_groups(
+    receipts: List[Receipt],
+    transactions: List[Transaction],
+    receipts_used: set,
+    transactions_used: set,
+    deadline: Optional[float] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Split and combined matches among one user's rows left over after assignment
+
+    A split is one receipt covering several charges (a hotel folio), a
+    combined match one charge covering several receipts. Members must share
+    the anchor's merchant and date window and their amounts must add up to
+    the anchor's. Every subset search has its own time limit, and the whole
+    call stops at deadline, so heavy users cannot stall a run. Matched
+    indices are added to the used sets.
+    """
+    started = time.perf_counter()
+    deadline = deadline or started + settings.reconcile_group_budget_ms / 1000
+    timeout = settings.reconcile_group_timeout_ms / 1000
+    max_items = settings.reconcile_group_max_items
+    window = settings.reconcile_window_days * 86400
+    receipt_amounts = [_amounts(r) for r in receipts]
+    transaction_amounts = [_amounts(t) for t in transactions]
+    receipt_base = [a[2] or 0.0 for a in receipt_amounts]
+    transaction_base = [a[2] or 0.0 for a in transaction_amounts]
+
+    groups = []
+    sides = (
+        ("split", receipts, receipt_amounts, receipt_base, receipts_used,
+         transactions, transaction_amounts, transaction_base, transactions_used),
+        ("combined", transactions, transaction_amounts, transaction_base, transactions_used,
+         receipts, receipt_amounts, receipt_base, receipts_used),
+    )
+    for kind, anchors, anchor_amounts, anchor_base, anchors_used, others, others_amounts, others_base, others_used in sides:
+        for i, anchor in enumerate(anchors):
+            now = time.perf_counter()
+            if now > deadline:
+                return groups
+            if i in anchors_used or not anchor_base[i]:
+                continue
+            candidates = _group_candidates(anchor, others, others_base, others_used, window)
+            if len(candidates) < 2:
+                continue
+            target, parts, part_cents = group_amounts(anchor_amounts[i], [others_amounts[j] for j in candidates])
+            found = find_subset(target, parts, max_items, min(now + timeout, deadline), part_cents)
+            if not found:
+                continue
+            members = sorted((candidates[k] for k in found), key=lambda j: -others_base[j])
+            anchors_used.add(i)
+            others_used.update(members)
+            groups.append({"type": kind, "anchor": i, "members": members})
+    return groups
+
+
+def find_split(
+    db: Session,
+    user_id: int,
+    receipt: Tuple[Optional[float], str, Optional[float]],
+    merchant: Optional[str],
+    date: Optional[datetime],
+) -> Optional[List[Transaction]]:
+    """
+    Unreconciled charges of a user that one receipt may cover together
+
+    receipt is its (raw amount, currency, base amount). Candidates are the
+    user's charges at the receipt's merchant inside its date window,
+    smaller than the receipt, read through the reconcile index. Returns
+    the charges largest first, or None.
+    """
+    amount = receipt[2]
+    if not amount:
+        return None
+    center = stats.naive_utc(date) or datetime.utcnow()
+    window = timedelta(days=settings.reconcile_window_days)
+    rows = db.query(Transaction).filter(
+        Transaction.user_id == user_id,
+        Transaction.is_reconciled == False,
+        base_amount_between(
+            Transaction, 0.01, amount + GROUP_CONVERSION_CENTS * settings.reconcile_group_max_items / 100
+        ),
+        Transaction.date >= center - window,
+        Transaction.date <= center + window,
+    ).all()
+    candidates = sorted(
+        (t for t in rows if merchant_index.matches(merchant, t.merchant)),
+        key=lambda t: abs((stats.naive_utc(t.date) - center).total_seconds()),
+    )[:GROUP_MAX_CANDIDATES]
+    if len(candidates) < 2:
+        return None
+
+    target, parts, part_cents = group_amounts(receipt, [_amounts(t) for t in candidates])
+    found = find_subset(
+        target,
+        parts,
+        settings.reconcile_group_max_items,
+        time.perf_counter() + settings.reconcile_group_timeout_ms / 1000,
+        part_cents,
+    )
+    if not found:
+        return None
+    return sorted((candidates[k] for k in found), key=lambda t: -stored_base_amount(t))
+
+
+def assign(edges: List[Tuple[int, int, float]]) -> List[Tuple[int, int, float]]:
+    """
+    Maximum-score one-to-one assignment over sparse edges
+
+    The problem is solved on the dense block of receipts and transactions
+    that have at least one edge; pairs without an edge score zero and are
+    dropped from the result.
+    """
+    if not edges:
+        return []
+    rows = sorted({i for i, _, _ in edges})
+    cols = sorted({j for _, j, _ in edges})
+    row_index = {r: k for k, r in enumerate(rows)}
+    col_index = {c: k for k, c in enumerate(cols)}
+
+    matrix = np.zeros((len(rows), len(cols)))
+    for i, j, score in edges:
+        matrix[row_index[i], col_index[j]] = score
+
+    assigned_rows, assigned_cols = linear_sum_assignment(matrix, maximize=True)
+    return [
+        (rows[r], cols[c], float(matrix[r, c]))
+        for r, c in zip(assigned_rows, assigned_cols)
+        if matrix[r, c] > 0
+    ]
+
+
+def _pending_filter(query):
+    return query.filter(
+        Receipt.transaction_id.is_(None),
+        Receipt.is_processed == True,
+        (Receipt.amount.isnot(None)) | (Receipt.total.isnot(None)),
+    )
+
+
+def pending_receipts(
+    db: Session, user_id: Optional[int] = None, user_ids: Optional[List[int]] = None
+) -> Dict[int, List[Receipt]]:
+    """Processed receipts with an amount and no transaction yet, per user"""
+    if user_id is not None:
+        user_ids = [user_id]
+
+    queries = [_pending_filter(db.query(Receipt))]
+    if user_ids is not None:
+        queries = [
+            queries[0].filter(Receipt.user_id.in_(user_ids[i:i + _IN_CLAUSE_CHUNK]))
+            for i in range(0, len(user_ids), _IN_CLAUSE_CHUNK)
+        ]
+
+    by_user: Dict[int, List[Receipt]] = {}
+    for query in queries:
+        for receipt in query.order_by(Receipt.user_id, Receipt.id):
+            by_user.setdefault(receipt.user_id, []).append(receipt)
+    return by_user
+
+
+def _candidate_transactions(db: Session, by_user: Dict[int, List[Receipt]]) -> Dict[int, List[Transaction]]:
+    """
+    Unreconciled transactions of the same users, within the window of each user's receipts
+
+    Every user is bounded by their own receipt dates, so one user's old
+    receipt does not pull every other user's history into the sweep.
+    """
+    window = timedelta(days=settings.reconcile_window_days)
+    bounds = []
+    for owner in sorted(by_user):
+        dates = [stats.naive_utc(r.date or r.created_at) for r in by_user[owner] if r.date or r.created_at]
+        if dates:
+            bounds.append(and_(
+                Transaction.user_id == owner,
+                Transaction.date >= min(dates) - window,
+                Transaction.date <= max(dates) + window,
+            ))
+        else:
+            bounds.append(Transaction.user_id == owner)
+
+    by_user_transactions: Dict[int, List[Transaction]] = {}
+    for i in range(0, len(bounds), _WINDOW_CHUNK):
+        query = db.query(Transaction).filter(
+            Transaction.is_reconciled == False,
+            or_(*bounds[i:i + _WINDOW_CHUNK]),
+        )
+        for txn in query:
+            by_user_transactions.setdefault(txn.user_id, []).append(txn)
+    return by_user_transactions
+
+
+def group_links(
+    group: Dict[str, Any], receipts: List[Receipt], transactions: List[Transaction]
+) -> List[Tuple[Receipt, Transaction, float]]:
+    """
+    (receipt, transaction, score) links of a split or combined match
+
+    Members come largest first, so the anchor's own link points at its
+    largest member. Members share the anchor's merchant and date window,
+    so the score only discounts conversion rounding in the amounts.
+    """
+    if group["type"] == "split":
+        anchor = receipts[group["anchor"]]
+        pairs = [(anchor, transactions[j]) for j in group["members"]]
+        members = [transactions[j] for j in group["members"]]
+    else:
+        anchor = transactions[group["anchor"]]
+        pairs = [(receipts[j], anchor) for j in group["members"]]
+        members = [receipts[j] for j in group["members"]]
+    target, parts, part_cents = group_amounts(_amounts(anchor), [_amounts(m) for m in members])
+    tolerance = max(part_cents * len(parts), 1) / 100
+    score = AMOUNT_WEIGHT * (1.0 - abs(sum(parts) - target) / (tolerance * 2)) + MERCHANT_WEIGHT + DATE_WEIGHT
+    return [(receipt, txn, score) for receipt, txn in pairs]
+
+
+def _match(
+    db: Session, by_user: Dict[int, List[Receipt]]
+) -> Tuple[List[Tuple[Receipt, Transaction, float]], List[Dict[str, Any]]]:
+    """One-to-one assignment per user, then split/combined matches among the leftovers"""
+    transactions = _candidate_transactions(db, by_user)
+    links, groups = [], []
+    for owner, receipts in by_user.items():
+        candidates = transactions.get(owner, [])
+        edges = score_pairs(receipts, candidates)
+        receipts_used, transactions_used = set(), set()
+        for i, j, score in assign(edges):
+            links.append((receipts[i], candidates[j], score))
+            receipts_used.add(i)
+            transactions_used.add(j)
+
+        for group in match_groups(receipts, candidates, receipts_used, transactions_used):
+            members = group_links(group, receipts, candidates)
+            links.extend(members)
+            groups.append({
+                "type": group["type"],
+                "user_id": owner,
+                "receipt_ids": sorted({r.id for r, _, _ in members}),
+                "transaction_ids": sorted({t.id for _, t, _ in members}),
+            })
+    return links, groups
+
+
+def link_all(db: Session, links: Iterable[Tuple[Receipt, Transaction, float]]):
+    """
+    Write both sides of every link with one bulk UPDATE per table (not committed)
+
+    A row in several links (split and combined matches) keeps its first one.
+    """
+    transactions: Dict[int, Dict[str, Any]] = {}
+    receipts: Dict[int, Dict[str, Any]] = {}
+    for receipt, txn, _ in links:
+        transactions.setdefault(txn.id, {"id": txn.id, "receipt_id": receipt.id, "is_reconciled": True})
+        receipts.setdefault(receipt.id, {"id": receipt.id, "transaction_id": txn.id})
+    if transactions:
+        db.bulk_update_mappings(Transaction, list(transactions.values()))
+        db.bulk_update_mappings(Receipt, list(receipts.values()))
+
+
+def _link_summary(links: List[Tuple[Receipt, Transaction, float]]) -> List[Dict[str, Any]]:
+    return [
+        {"receipt_id": receipt.id, "transaction_id": txn.id, "user_id": txn.user_id, "score": round(score, 4)}
+        for receipt, txn, score in links
+    ]
+
+
+def reconcile_batch(db: Session, user_id: Optional[int] = None, dry_run: bool = False) -> Dict[str, Any]:
+    """
+    Match all pending receipts to unreconciled transactions at once
+
+    Each user's receipts and transactions form a separate assignment
+    problem, so one receipt never takes a transaction another receipt fits
+    better. All links are committed together, or none on error.
+    """
+    started = time.perf_counter()
+    by_user = pending_receipts(db, user_id)
+    links, groups = _match(db, by_user)
+
+    if not dry_run:
+        try:
+            link_all(db, links)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+
+    return {
+        "receipts": sum(len(r) for r in by_user.values()),
+        "matched": len({receipt.id for receipt, _, _ in links}),
+        "links": _link_summary(links),
+        "groups": groups,
+        "seconds": time.perf_counter() - started,
+        "dry_run": dry_run,
+    }
+
+
+def get_watermark(db: Session, name: str) -> SweepWatermark:
+    mark = db.query(SweepWatermark).filter(SweepWatermark.name == name).first()
+    if mark is None:
+        mark = SweepWatermark(name=name)
+        db.add(mark)
+    return mark
+
+
+def changed_users(db: Session, since: datetime) -> List[int]:
+    """
+    Users with a pending receipt or an unreconciled transaction changed since a time
+
+    Only these users can have a new match; everyone else's receipts were
+    already compared with the same transactions by an earlier sweep.
+    """
+    receipts = _pending_filter(db.query(Receipt.user_id)).filter(
+        or_(Receipt.created_at >= since, Receipt.updated_at >= since)
+    )
+    transactions = db.query(Transaction.user_id).filter(
+        Transaction.is_reconciled == False,
+        or_(Transaction.created_at >= since, Transaction.updated_at >= since),
+    )
+    return sorted({u for (u,) in receipts.distinct()} | {u for (u,) in transactions.distinct()})
+
+
+def overdue_receipts(db: Session, after: datetime, cutoff: datetime) -> List[Receipt]:
+    """Pending receipts uploaded in (after, cutoff], i.e. newly past the grace period"""
+    return _pending_filter(db.query(Receipt)).filter(
+        Receipt.created_at > after,
+        Receipt.created_at <= cutoff,
+    ).order_by(Receipt.created_at, Receipt.id).all()
+
+
+def mismatch_alert_payload(receipt: Receipt, grace_hours: int) -> Dict[str, Any]:
+    """NotifierAgent input for a receipt no transaction matched"""
+    return {
+        "transaction": {
+            "user_id": receipt.user_id,
+            "amount": stored_base_amount(receipt),
+            "merchant": receipt.merchant,
+            "date": receipt.date.isoformat() if receipt.date else None,
+        },
+        "alert_type": "mismatch",
+        "decision": {
+            "severity": "medium",
+            "risk_score": 0.3,
+            "risk_factors": [f"No transaction matched this receipt within {grace_hours}h of upload"],
+            "recommendation": "Attach the receipt to its transaction, or check whether the expense was charged",
+            "receipt_id": receipt.id,
+        },
+    }
+
+
+def sweep(db: Session, dry_run: bool = False, now: Optional[datetime] = None) -> Dict[str, Any]:
+    """
+    Incremental reconciliation pass, meant to run periodically
+
+    Only users whose receipts or transactions changed since the previous
+    run's watermark are re-matched; their pending receipts are assigned
+    together and linked with bulk updates. Receipts still unmatched
+    reconcile_grace_hours after upload are returned as mismatch alert
+    payloads, each exactly once: a second watermark tracks the upload time
+    up to which receipts have been alerted on. Links and the sweep
+    watermark are committed together; the alert watermark is left for
+    mark_alerted, once the alerts are persisted.
+    """
+    started = time.perf_counter()
+    now = now or datetime.utcnow()
+    grace_hours = settings.reconcile_grace_hours
+
+    mark = get_watermark(db, SWEEP_WATERMARK)
+    alert_mark = get_watermark(db, ALERT_WATERMARK)
+
+    if mark.position is None:
+        user_ids = None  # First run: everyone
+    else:
+        user_ids = changed_users(db, stats.naive_utc(mark.position) - SWEEP_OVERLAP)
+
+    by_user = pending_receipts(db, user_ids=user_ids)
+    links, groups = _match(db, by_user)
+
+    # Receipts linked in this run are no longer pending once flushed
+    linked = {receipt.id for receipt, _, _ in links}
+    cutoff = now - timedelta(hours=grace_hours)
+    alerted_until = (
+        stats.naive_utc(alert_mark.position)
+        if alert_mark.position is not None
+        # Do not alert on the whole backlog when the sweeper is first enabled
+        else cutoff - timedelta(days=settings.reconcile_window_days)
+    )
+    overdue = [
+        receipt
+        for receipt in overdue_receipts(db, alerted_until, cutoff)
+        if receipt.id not in linked
+    ] if cutoff > alerted_until else []
+
+    result = {
+        "users": len(by_user) if user_ids is None else len(user_ids),
+        "receipts": sum(len(r) for r in by_user.values()),
+        "matched": len(linked),
+        "links": _link_summary(links),
+        "groups": groups,
+        "alerts": [mismatch_alert_payload(receipt, grace_hours) for receipt in overdue],
+        # Upload times of the alerted receipts, and the alert watermark before and after them
+        "alert_uploads": [stats.naive_utc(receipt.created_at).isoformat() for receipt in overdue],
+        "alerted_until": alerted_until.isoformat(),
+        "alert_position": max(cutoff, alerted_until).isoformat(),
+        "since": mark.position.isoformat() if mark.position else None,
+        "seconds": 0.0,
+        "dry_run": dry_run,
+    }
+
+    if dry_run:
+        db.rollback()
+    else:
+        try:
+            link_all(db, links)
+            mark.position = now
+            mark.last_run_at = now
+            mark.last_result = {"users": result["users"], "matched": result["matched"]}
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+
+    result["seconds"] = time.perf_counter() - started
+    return result
+
+
+def mark_alerted(db: Session, position: datetime, alerted: int, now: Optional[datetime] = None):
+    """
+    Advance the mismatch alert watermark to an upload time
+
+    Called once the alerts for receipts uploaded up to position are
+    persisted, so a failed notification is retried by the next sweep
+    rather than lost. The watermark never moves backwards.
+    """
+    alert_mark = get_watermark(db, ALERT_WATERMARK)
+    current = stats.naive_utc(alert_mark.position)
+    if current is None or position > current:
+        alert_mark.position = position
+    alert_mark.last_run_at = now or datetime.utcnow()
+    alert_mark.last_result = {"alerts": alerted}
+    try:
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
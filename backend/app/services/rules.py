@@ -0,0 +1,327 @@
+"""
+Fraud rules engine - Compiles declarative rules into Python closures
+"""
+from typing import Dict, Any, Optional, List, Callable, Iterable
+from datetime import datetime
+from sqlalchemy.orm import Session
+from app.config import settings
+from app.models import FraudRule
+from app.services import stats
+from app.services.fx import base_amount_of
+import operator
+import threading
+import logging
+import time
+import re
+
+logger = logging.getLogger(__name__)
+
+# Fields a rule condition can reference, and how their values are compared
+RULE_FIELDS = {
+    "amount": "number",
+    "hour": "number",
+    "weekday": "number",  # Monday = 0
+    "velocity_count_5m": "number",
+    "velocity_amount_5m": "number",
+    "velocity_count_1h": "number",
+    "velocity_amount_1h": "number",
+    "velocity_count_24h": "number",
+    "velocity_amount_24h": "number",
+    "user_merchant_velocity_count_5m": "number",
+    "user_merchant_velocity_count_1h": "number",
+    "user_merchant_velocity_count_24h": "number",
+    "merchant": "string",
+    "description": "string",
+    "category": "string",
+    "currency": "string",
+    "source": "string",
+    "user_role": "string",
+}
+
+VELOCITY_FIELDS = {field for field in RULE_FIELDS if "velocity_" in field}
+CLASSIFICATION_FIELDS = {"category"}  # Only known once the classifier has run
+
+RULE_ACTIONS = ("score", "flag")
+
+SEVERITY_ORDER = ["low", "medium", "high", "critical"]
+
+_NUMBER_OPS = {
+    "eq": operator.eq,
+    "ne": operator.ne,
+    "gt": operator.gt,
+    "gte": operator.ge,
+    "lt": operator.lt,
+    "lte": operator.le,
+}
+
+_STRING_OPS = {
+    "eq": operator.eq,
+    "ne": operator.ne,
+    "contains": operator.contains,
+    "startswith": str.startswith,
+    "endswith": str.endswith,
+}
+
+
+class RuleCompileError(ValueError):
+    """Raised when a rule definition cannot be compiled"""
+
+
+def _compile_condition(condition: Dict[str, Any]) -> Callable[[Dict[str, Any]], bool]:
+    """Compile a single condition into a predicate over a rule context"""
+    field = condition.get("field")
+    op = condition.get("op")
+    value = condition.get("value")
+
+    kind = RULE_FIELDS.get(field)
+    if kind is None:
+        raise RuleCompileError(f"Unknown rule field: {field}")
+
+    try:
+        if kind == "number":
+            if op == "between":
+                low, high = float(value[0]), float(value[1])
+
+                def check(ctx, _field=field, _low=low, _high=high):
+                    x = ctx.get(_field)
+                    return x is not None and _low <= x <= _high
+                return check
+
+            if op in ("in", "not_in"):
+                values = frozenset(float(v) for v in value)
+                negate = op == "not_in"
+
+                def check(ctx, _field=field, _values=values, _negate=negate):
+                    x = ctx.get(_field)
+                    return x is not None and ((x in _values) != _negate)
+                return check
+
+            compare = _NUMBER_OPS.get(op)
+            if compare is None:
+                raise RuleCompileError(f"Unsupported operator '{op}' for numeric field {field}")
+            number = float(value)
+
+            def check(ctx, _field=field, _compare=compare, _value=number):
+                x = ctx.get(_field)
+                return x is not None and _compare(x, _value)
+            return check
+
+        # String fields are compared case-insensitively
+        if op in ("in", "not_in"):
+            values = frozenset(str(v).lower() for v in value)
+            negate = op == "not_in"
+
+            def check(ctx, _field=field, _values=values, _negate=negate):
+                x = ctx.get(_field)
+                return x is not None and ((x in _values) != _negate)
+            return check
+
+        if op == "regex":
+            pattern = re.compile(str(value), re.IGNORECASE)
+
+            def check(ctx, _field=field, _search=pattern.search):
+                x = ctx.get(_field)
+                return x is not None and _search(x) is not None
+            return check
+
+        compare = _STRING_OPS.get(op)
+        if compare is None:
+            raise RuleCompileError(f"Unsupported operator '{op}' for text field {field}")
+        text = str(value).lower()
+
+        def check(ctx, _field=field, _compare=compare, _value=text):
+            x = ctx.get(_field)
+            return x is not None and _compare(x, _value)
+        return check
+
+    except RuleCompileError:
+        raise
+    except (TypeError, ValueError, IndexError, re.error) as e:
+        raise RuleCompileError(f"Invalid value for {field} {op}: {e}")
+
+
+class CompiledRule:
+    """A fraud rule compiled into a list of predicates"""
+
+    __slots__ = (
+        "id", "name", "weight", "severity", "action", "priority", "fields", "after_classification", "_conditions"
+    )
+
+    def __init__(
+        self,
+        rule_id: Optional[int],
+        name: str,
+        conditions: List[Dict[str, Any]],
+        weight: float = 0.0,
+        severity: str = "medium",
+        action: str = "score",
+        priority: int = 100,
+    ):
+        if not conditions:
+            raise RuleCompileError("A rule needs at least one condition")
+        if action not in RULE_ACTIONS:
+            raise RuleCompileError(f"Unsupported rule action: {action}")
+        if severity not in SEVERITY_ORDER:
+            raise RuleCompileError(f"Unsupported rule severity: {severity}")
+
+        self.id = rule_id
+        self.name = name
+        self.weight = float(weight or 0.0)
+        self.severity = severity
+        self.action = action
+        self.priority = priority
+        self.fields = frozenset(c.get("field") for c in conditions)
+        self.after_classification = bool(self.fields & CLASSIFICATION_FIELDS)
+        self._conditions = tuple(_compile_condition(c) for c in conditions)
+
+    def matches(self, context: Dict[str, Any]) -> bool:
+        """Check whether every condition holds for the context"""
+        for condition in self._conditions:
+            if not condition(context):
+                return False
+        return True
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "name": self.name,
+            "weight": self.weight,
+            "severity": self.severity,
+            "action": self.action,
+        }
+
+
+def compile_rule(rule: FraudRule) -> CompiledRule:
+    """Compile a stored rule"""
+    return CompiledRule(
+        rule_id=rule.id,
+        name=rule.name,
+        conditions=rule.conditions or [],
+        weight=rule.weight,
+        severity=rule.severity or "medium",
+        action=rule.action or "score",
+        priority=rule.priority if rule.priority is not None else 100,
+    )
+
+
+def build_context(
+    transaction: Dict[str, Any],
+    user_role: Optional[str] = None,
+    velocity: Optional[Dict[str, float]] = None,
+) -> Dict[str, Any]:
+    """
+    Flatten a transaction into the values rule conditions are evaluated against
+
+    Amounts are in the base currency and times in UTC, like the velocity
+    totals and the rest of scoring.
+    """
+    context = {
+        "amount": base_amount_of(transaction),
+        "merchant": (transaction.get("merchant") or "").lower() or None,
+        "description": (transaction.get("description") or "").lower() or None,
+        "category": (transaction.get("category") or "").lower() or None,
+        "currency": (transaction.get("currency") or "").lower() or None,
+        "source": (transaction.get("source") or "").lower() or None,
+        "user_role": (user_role or "").lower() or None,
+        "hour": None,
+        "weekday": None,
+    }
+
+    date_str = transaction.get("date")
+    if date_str:
+        try:
+            date = stats.naive_utc(datetime.fromisoformat(date_str.replace("Z", "+00:00")))
+            context["hour"] = date.hour
+            context["weekday"] = date.weekday()
+        except (TypeError, ValueError):
+            pass
+
+    if velocity:
+        context.update(velocity)
+
+    return context
+
+
+class RuleEngine:
+    """Holds the compiled active rule set and evaluates transactions against it"""
+
+    def __init__(self, refresh_seconds: int = 30):
+        self.refresh_seconds = refresh_seconds
+        self._rules: List[CompiledRule] = []
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+        self.uses_velocity = False
+        self.uses_classification = False
+
+    @property
+    def rules(self) -> List[CompiledRule]:
+        return self._rules
+
+    def load(self, rules: Iterable[FraudRule]):
+        """Compile and swap in a new rule set"""
+        compiled = []
+        for rule in rules:
+            try:
+                compiled.append(compile_rule(rule))
+            except RuleCompileError as e:
+                logger.error(f"Skipping fraud rule {rule.id} ({rule.name}): {e}")
+
+        compiled.sort(key=lambda r: r.priority)
+        self._rules = compiled
+        self.uses_velocity = any(r.fields & VELOCITY_FIELDS for r in compiled)
+        self.uses_classification = any(r.after_classification for r in compiled)
+        self._loaded_at = time.monotonic()
+
+    def refresh(self, db: Session, force: bool = False):
+        """Reload active rules from the database if the cached set is stale"""
+        if not force and time.monotonic() - self._loaded_at < self.refresh_seconds:
+            return
+
+        with self._lock:
+            if not force and time.monotonic() - self._loaded_at < self.refresh_seconds:
+                return
+            rules = db.query(FraudRule).filter(FraudRule.is_active == True).all()
+            self.load(rules)
+
+    def invalidate(self):
+        """Force the next refresh to reload from the database"""
+        self._loaded_at = 0.0
+
+    def evaluate(self, context: Dict[str, Any], stage: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Evaluate the rule set against a context
+
+        stage "pre" evaluates only rules that do not depend on the
+        classification, "post" only those that do; None evaluates all.
+        """
+        rules = self._rules
+        if stage is not None:
+            rules = [rule for rule in rules if rule.after_classification == (stage == "post")]
+        matched = [rule for rule in rules if rule.matches(context)]
+
+        severity = None
+        for rule in matched:
+            if severity is None or SEVERITY_ORDER.index(rule.severity) > SEVERITY_ORDER.index(severity):
+                severity = rule.severity
+
+        return {
+            "matched_rules": [rule.to_dict() for rule in matched],
+            "risk_score": min(sum(rule.weight for rule in matched), 1.0),
+            "severity": severity,
+            "flag": any(rule.action == "flag" for rule in matched),
+        }
+
+
+def merge_evaluations(first: Dict[str, Any], second: Dict[str, Any]) -> Dict[str, Any]:
+    """Combine the evaluations of two rule stages as if evaluated together"""
+    severities = [e.get("severity") for e in (first, second) if e.get("severity") in SEVERITY_ORDER]
+    return {
+        **first,
+        "matched_rules": first.get("matched_rules", []) + second.get("matched_rules", []),
+        "risk_score": min(first.get("risk_score", 0.0) + second.get("risk_score", 0.0), 1.0),
+        "severity": max(severities, key=SEVERITY_ORDER.index) if severities else None,
+        "flag": bool(first.get("flag")) or bool(second.get("flag")),
+    }
+
+
+rule_engine = RuleEngine(refresh_seconds=settings.rules_refresh_seconds)
@@ -0,0 +1,172 @@
+"""
+Streaming quantile sketch for robust amount statistics
+"""
+from typing import Dict, Any, Optional, List, Tuple
+import math
+
+# Values closer to zero than this are counted as zero
+_MIN_VALUE = 1e-9
+RELATIVE_ACCURACY = 0.01  # Default; also the floor of the MAD relative to the median
+
+
+class QuantileSketch:
+    """
+    Relative-error quantile sketch over log-spaced buckets (DDSketch style)
+
+    Any quantile is returned within `relative_accuracy` of a true sample
+    value. Memory is bounded by `max_buckets` per sign, adds and removes
+    are O(1), and sketches merge by adding bucket counts.
+    """
+
+    __slots__ = ("relative_accuracy", "max_buckets", "_log_gamma", "positive", "negative", "zero_count", "count")
+
+    def __init__(self, relative_accuracy: float = RELATIVE_ACCURACY, max_buckets: int = 512):
+        self.relative_accuracy = relative_accuracy
+        self.max_buckets = max_buckets
+        gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(gamma)
+        self.positive: Dict[int, int] = {}
+        self.negative: Dict[int, int] = {}
+        self.zero_count = 0
+        self.count = 0
+
+    def _key(self, magnitude: float) -> int:
+        return math.ceil(math.log(magnitude) / self._log_gamma)
+
+    def _value(self, key: int) -> float:
+        # Midpoint of the bucket (gamma^(k-1), gamma^k] in relative terms
+        return 2 * math.exp(key * self._log_gamma) / (1 + math.exp(self._log_gamma))
+
+    def _store(self, x: float) -> Tuple[Optional[Dict[int, int]], int]:
+        if abs(x) < _MIN_VALUE:
+            return None, 0
+        store = self.positive if x > 0 else self.negative
+        key = self._key(abs(x))
+        # Buckets below a collapsed floor live in the floor bucket
+        if len(store) >= self.max_buckets:
+            floor = min(store)
+            key = max(key, floor)
+        return store, key
+
+    def add(self, x: float, weight: int = 1):
+        store, key = self._store(x)
+        self.count += weight
+        if store is None:
+            self.zero_count += weight
+            return
+        store[key] = store.get(key, 0) + weight
+        if len(store) > self.max_buckets:
+            self._collapse(store)
+
+    def remove(self, x: float, weight: int = 1):
+        store, key = self._store(x)
+        if store is None:
+            if self.zero_count >= weight:
+                self.zero_count -= weight
+                self.count -= weight
+            return
+        if key not in store and store and key < min(store):
+            # Value was folded into the lowest bucket by a collapse
+            key = min(store)
+        current = store.get(key, 0)
+        if current <= 0:
+            return
+        if current <= weight:
+            del store[key]
+            self.count -= current
+        else:
+            store[key] = current - weight
+            self.count -= weight
+
+    def _collapse(self, store: Dict[int, int]):
+        """Fold the lowest buckets together to respect the bucket budget"""
+        keys = sorted(store)
+        excess = len(keys) - self.max_buckets
+        target = keys[excess]
+        for key in keys[:excess]:
+            store[target] += store.pop(key)
+
+    def merge(self, other: "QuantileSketch"):
+        for key, count in other.positive.items():
+            self.positive[key] = self.positive.get(key, 0) + count
+        for key, count in other.negative.items():
+            self.negative[key] = self.negative.get(key, 0) + count
+        self.zero_count += other.zero_count
+        self.count += other.count
+        for store in (self.positive, self.negative):
+            if len(store) > self.max_buckets:
+                self._collapse(store)
+
+    def bucket_count(self) -> int:
+        return len(self.positive) + len(self.negative)
+
+    def _buckets(self) -> List[Tuple[float, int]]:
+        """(value, count) pairs in ascending value order"""
+        buckets = [(-self._value(k), c) for k, c in sorted(self.negative.items(), reverse=True)]
+        if self.zero_count:
+            buckets.append((0.0, self.zero_count))
+        buckets.extend((self._value(k), c) for k, c in sorted(self.positive.items()))
+        return buckets
+
+    @staticmethod
+    def _weighted_quantile(buckets: List[Tuple[float, int]], total: int, q: float) -> float:
+        rank = q * (total - 1)
+        seen = 0
+        for value, count in buckets:
+            seen += count
+            if seen > rank:
+                return value
+        return buckets[-1][0]
+
+    def quantile(self, q: float) -> Optional[float]:
+        if self.count <= 0:
+            return None
+        return self._weighted_quantile(self._buckets(), self.count, q)
+
+    def rank(self, x: float) -> float:
+        """Fraction of values at or below x"""
+        if self.count <= 0:
+            return 0.0
+        below = sum(count for value, count in self._buckets() if value <= x)
+        return below / self.count
+
+    def median_and_mad(self) -> Tuple[Optional[float], Optional[float]]:
+        """
+        Median and median absolute deviation
+
+        Deviations are taken between bucket midpoints, so a tight cluster
+        inside one bucket has a MAD of 0 and a few neighbouring buckets give
+        a MAD quantized to their spacing. The MAD is floored at the
+        sketch's resolution, relative_accuracy times the median.
+        """
+        if self.count <= 0:
+            return None, None
+        buckets = self._buckets()
+        median = self._weighted_quantile(buckets, self.count, 0.5)
+        deviations = sorted((abs(value - median), count) for value, count in buckets)
+        mad = self._weighted_quantile(deviations, self.count, 0.5)
+        return median, max(mad, self.relative_accuracy * abs(median))
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "relative_accuracy": self.relative_accuracy,
+            "max_buckets": self.max_buckets,
+            "positive": {str(k): c for k, c in self.positive.items()},
+            "negative": {str(k): c for k, c in self.negative.items()},
+            "zero_count": self.zero_count,
+            "count": self.count,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Optional[Dict[str, Any]]) -> "QuantileSketch":
+        if not data:
+            return cls()
+        sketch = cls(
+            relative_accuracy=data.get("relative_accuracy", RELATIVE_ACCURACY),
+            max_buckets=data.get("max_buckets", 512),
+        )
+        sketch.positive = {int(k): c for k, c in data.get("positive", {}).items()}
+        sketch.negative = {int(k): c for k, c in data.get("negative", {}).items()}
+        sketch.zero_count = data.get("zero_count", 0)
+        sketch.count = data.get("count", 0)
+        return sketch
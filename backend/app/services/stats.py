@@ -0,0 +1,226 @@
+"""
+Running per-user, per-category amount statistics for O(1) z-scores
+"""
+from typing import Dict, Any, Optional
+from datetime import datetime, timedelta, timezone
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from app.config import settings
+from app.models import Transaction, TransactionStatus, UserCategoryStats
+from app.services.fx import base_amount_column
+from app.services.sketch import QuantileSketch
+import logging
+import math
+
+logger = logging.getLogger(__name__)
+
+# Expired transactions are only subtracted once the window has slid this far
+EXPIRY_SLACK = timedelta(days=1)
+HOURS_PER_WEEK = 168
+
+
+def naive_utc(value: Optional[datetime]) -> Optional[datetime]:
+    """Normalize a datetime to naive UTC, the way it is stored"""
+    if value is not None and value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def hour_of_week(date: datetime) -> int:
+    """0 = Monday 00:00, 167 = Sunday 23:00"""
+    return date.weekday() * 24 + date.hour
+
+
+def window_cutoff(now: Optional[datetime] = None) -> datetime:
+    """Start of the anomaly history window"""
+    return (now or datetime.utcnow()) - timedelta(days=settings.anomaly_history_days)
+
+
+def is_counted(snap: Optional[Dict[str, Any]], window_start: datetime) -> bool:
+    """Whether a transaction contributes to its user/category statistics"""
+    return bool(
+        snap
+        and snap.get("category")
+        and snap.get("amount") is not None
+        and snap.get("status") != TransactionStatus.REJECTED.value
+        and snap.get("date") is not None
+        and snap["date"] >= window_start
+    )
+
+
+def same_contribution(before: Dict[str, Any], after: Dict[str, Any]) -> bool:
+    """Whether a change leaves the transaction's contribution untouched"""
+    rejected = TransactionStatus.REJECTED.value
+    return (
+        all(before.get(k) == after.get(k) for k in ("user_id", "category", "amount", "date"))
+        and (before.get("status") == rejected) == (after.get("status") == rejected)
+    )
+
+
+class RunningStats:
+    """In-memory count/mean/M2 triple with the same shape as a stats row"""
+
+    __slots__ = ("count", "mean", "m2")
+
+    def __init__(self, count: int = 0, mean: float = 0.0, m2: float = 0.0):
+        self.count = count
+        self.mean = mean
+        self.m2 = m2
+
+    def std(self) -> float:
+        return math.sqrt(max(self.m2 / self.count, 0.0)) if self.count > 0 else 0.0
+
+
+def welford_add(row, x: float):
+    """Welford update with a new value"""
+    count = (row.count or 0) + 1
+    delta = x - (row.mean or 0.0)
+    mean = (row.mean or 0.0) + delta / count
+    row.m2 = (row.m2 or 0.0) + delta * (x - mean)
+    row.mean = mean
+    row.count = count
+
+
+def welford_remove(row, x: float):
+    """Inverse Welford update removing a previously added value"""
+    count = (row.count or 0) - 1
+    if count <= 0:
+        row.count, row.mean, row.m2 = 0, 0.0, 0.0
+        return
+    mean = (row.count * row.mean - x) / count
+    row.m2 = max((row.m2 or 0.0) - (x - row.mean) * (x - mean), 0.0)
+    row.mean = mean
+    row.count = count
+
+
+def _counted_amounts(
+    db: Session, user_id: int, category: str, start: datetime, end: Optional[datetime] = None
+):
+    """Amounts of counted transactions for a user/category within a date range"""
+    query = db.query(base_amount_column()).filter(
+        Transaction.user_id == user_id,
+        Transaction.category == category,
+        Transaction.status != TransactionStatus.REJECTED.value,
+        Transaction.date >= start,
+    )
+    if end is not None:
+        query = query.filter(Transaction.date < end)
+    return [amount for (amount,) in query.all() if amount is not None]
+
+
+def _seed(db: Session, user_id: int, category: str) -> UserCategoryStats:
+    """Build the statistics row for a user/category from history, once"""
+    cutoff = window_cutoff()
+    row = UserCategoryStats(
+        user_id=user_id, category=category, count=0, mean=0.0, m2=0.0, window_start=cutoff
+    )
+    sketch = QuantileSketch()
+    for amount in _counted_amounts(db, user_id, category, cutoff):
+        welford_add(row, amount)
+        sketch.add(amount)
+    row.sketch = sketch.to_dict()
+
+    db.add(row)
+    try:
+        db.commit()
+    except IntegrityError:
+        # Another worker seeded it first
+        db.rollback()
+        row = db.query(UserCategoryStats).filter(
+            UserCategoryStats.user_id == user_id,
+            UserCategoryStats.category == category,
+        ).one()
+    return row
+
+
+def _expire(db: Session, row: UserCategoryStats):
+    """Slide the window forward, subtracting transactions that aged out"""
+    cutoff = window_cutoff()
+    window_start = naive_utc(row.window_start)
+    if window_start is not None and cutoff - window_start < EXPIRY_SLACK:
+        return
+
+    if window_start is not None:
+        sketch = QuantileSketch.from_dict(row.sketch)
+        for amount in _counted_amounts(db, row.user_id, row.category, window_start, cutoff):
+            welford_remove(row, amount)
+            sketch.remove(amount)
+        row.sketch = sketch.to_dict()
+    row.window_start = cutoff
+    db.commit()
+
+
+def _backfill_sketch(db: Session, row: UserCategoryStats):
+    """Build the sketch for a row created before sketches were tracked"""
+    sketch = QuantileSketch()
+    for amount in _counted_amounts(db, row.user_id, row.category, naive_utc(row.window_start)):
+        sketch.add(amount)
+    row.sketch = sketch.to_dict()
+    db.commit()
+
+
+def get_row(db: Session, user_id: int, category: str) -> UserCategoryStats:
+    """Fetch the up-to-date statistics row for a user and category"""
+    row = db.query(UserCategoryStats).filter(
+        UserCategoryStats.user_id == user_id,
+        UserCategoryStats.category == category,
+    ).first()
+
+    if row is None:
+        row = _seed(db, user_id, category)
+    else:
+        if row.sketch is None:
+            _backfill_sketch(db, row)
+        _expire(db, row)
+    return row
+
+
+def get_stats(db: Session, user_id: int, category: str) -> Dict[str, Any]:
+    """Read the windowed count/mean/std for a user and category"""
+    row = get_row(db, user_id, category)
+
+    count = row.count or 0
+    variance = (row.m2 or 0.0) / count if count > 0 else 0.0
+    median, mad = QuantileSketch.from_dict(row.sketch).median_and_mad()
+    return {
+        "count": count,
+        "mean": row.mean or 0.0,
+        "std": math.sqrt(max(variance, 0.0)),
+        "median": median,
+        "mad": mad,
+    }
+
+
+def apply_change(
+    db: Session, before: Optional[Dict[str, Any]], after: Optional[Dict[str, Any]]
+):
+    """
+    Update statistics for a transaction insert or change
+
+    Must be called in the same session as the change so both commit together.
+    Rows that have not been seeded yet are skipped, they are built from the
+    committed history on first read.
+    """
+    if before and after and same_contribution(before, after):
+        return
+
+    for snap, sign in ((before, -1), (after, 1)):
+        if not snap or not snap.get("category") or not snap.get("user_id"):
+            continue
+
+        row = db.query(UserCategoryStats).filter(
+            UserCategoryStats.user_id == snap["user_id"],
+            UserCategoryStats.category == snap["category"],
+        ).first()
+        if row is None or not is_counted(snap, naive_utc(row.window_start)):
+            continue
+
+        # JSON columns are not mutation-tracked, so the sketch is reassigned
+        sketch = QuantileSketch.from_dict(row.sketch)
+        if sign > 0:
+            welford_add(row, snap["amount"])
+            sketch.add(snap["amount"])
+        else:
+            welford_remove(row, snap["amount"])
+            sketch.remove(snap["amount"])
+        row.sketch = sketch.to_dict()
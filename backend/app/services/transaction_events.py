@@ -0,0 +1,46 @@
+"""
+Fan-out of transaction writes to derived statistics and caches
+"""
+from typing import Dict, Any, Optional
+from sqlalchemy.orm import Session
+from app.models import Transaction
+from app.services import stats
+from app.services.duplicates import duplicate_index
+from app.services.fx import stored_base_amount
+from app.services.merchant_graph import graph_store
+from app.services.profiles import profile_cache
+from app.services.velocity import velocity_tracker
+
+
+def snapshot(transaction: Transaction) -> Dict[str, Any]:
+    """Capture the fields of a transaction that derived state depends on"""
+    return {
+        "id": transaction.id,
+        "user_id": transaction.user_id,
+        "category": transaction.category,
+        "merchant": transaction.merchant,
+        "amount": stored_base_amount(transaction),
+        "status": transaction.status,
+        "date": stats.naive_utc(transaction.date),
+    }
+
+
+def on_transaction_created(transaction: Transaction):
+    """Record a newly inserted transaction before the agent pipeline runs"""
+    amount = stored_base_amount(transaction)
+    velocity_tracker.record(transaction.user_id, transaction.merchant, amount, transaction.date)
+    duplicate_index.add(transaction)
+    graph_store.record(transaction.user_id, transaction.merchant, amount, transaction.date)
+
+
+def on_transaction_change(
+    db: Session, before: Optional[Dict[str, Any]], after: Optional[Dict[str, Any]]
+):
+    """
+    Propagate a transaction insert (before=None) or change
+
+    Call in the same session as the change, before committing.
+    """
+    stats.apply_change(db, before, after)
+    profile_cache.apply_change(before, after)
+    duplicate_index.apply_change(before, after)
@@ -0,0 +1,243 @@
+"""
+Sliding-window velocity counters per user, merchant and user-merchant pair
+"""
+from typing import Dict, Any, Optional, List, Tuple
+from datetime import datetime, timedelta
+from sqlalchemy.orm import Session
+from app.config import settings
+from app.models import Transaction
+from app.services import stats
+from app.services.fx import base_amount_column
+from app.services.merchants import merchant_index
+import threading
+import logging
+import json
+import os
+
+logger = logging.getLogger(__name__)
+
+# Window label -> length in seconds
+WINDOWS = {"5m": 5 * 60, "1h": 60 * 60, "24h": 24 * 60 * 60}
+BUCKETS_PER_WINDOW = 30  # Window edges are accurate to 1/30th of the window
+DATE_ONLY_WINDOWS = ("24h",)  # Windows that count rows entered without a time of day
+SNAPSHOT_VERSION = 2  # 2: merchant keys are canonical merchants
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+def _seconds(date: datetime) -> float:
+    return (stats.naive_utc(date) - _EPOCH).total_seconds()
+
+
+def is_date_only(date: datetime) -> bool:
+    """
+    Whether a timestamp carries no time of day
+
+    Manual entries are dated midnight UTC, so a day's worth of them would
+    land in one bucket of the short windows and look like a burst.
+    """
+    date = stats.naive_utc(date)
+    return date.hour == date.minute == date.second == date.microsecond == 0
+
+
+def windows_for(date: datetime) -> List[str]:
+    """Windows a transaction at this time is counted in and checked against"""
+    return list(DATE_ONLY_WINDOWS) if is_date_only(date) else list(WINDOWS)
+
+
+def user_key(user_id: int) -> str:
+    return f"u:{user_id}"
+
+
+def merchant_key(merchant: str) -> str:
+    return f"m:{merchant}"
+
+
+def pair_key(user_id: int, merchant: str) -> str:
+    return f"p:{user_id}:{merchant}"
+
+
+class _Ring:
+    """Fixed ring of time buckets holding a count and a sum each"""
+
+    __slots__ = ("width", "stamps", "counts", "sums")
+
+    def __init__(self, width: float):
+        self.width = width
+        self.stamps = [-1] * BUCKETS_PER_WINDOW  # Absolute bucket number held by each slot
+        self.counts = [0] * BUCKETS_PER_WINDOW
+        self.sums = [0.0] * BUCKETS_PER_WINDOW
+
+    def add(self, t: float, amount: float):
+        bucket = int(t // self.width)
+        slot = bucket % BUCKETS_PER_WINDOW
+        if self.stamps[slot] > bucket:
+            return  # Older than anything the ring still covers
+        if self.stamps[slot] < bucket:
+            self.stamps[slot], self.counts[slot], self.sums[slot] = bucket, 0, 0.0
+        self.counts[slot] += 1
+        self.sums[slot] += amount
+
+    def total(self, t: float) -> Tuple[int, float]:
+        """Count and sum of the buckets ending at time t"""
+        newest = int(t // self.width)
+        oldest = newest - BUCKETS_PER_WINDOW
+        count, amount = 0, 0.0
+        for stamp, c, s in zip(self.stamps, self.counts, self.sums):
+            if oldest < stamp <= newest:
+                count += c
+                amount += s
+        return count, amount
+
+    def latest(self) -> float:
+        """End time of the newest bucket"""
+        return (max(self.stamps) + 1) * self.width
+
+
+class VelocityTracker:
+    """
+    In-memory sliding-window counters, never touching the database on lookup
+
+    Each key keeps one ring of buckets per window, so memory per key is
+    fixed. Merchants are keyed by canonical merchant, like the profiles, so
+    spelling variants of one merchant share counters.
+
+    State lives in the process and assumes a single API worker: a worker
+    only counts the transactions it received, and every worker writes the
+    same snapshot file. It is warmed from the snapshot plus rows created
+    since at startup, and snapshotted periodically.
+    """
+
+    def __init__(self, snapshot_path: str):
+        self.snapshot_path = snapshot_path
+        self._keys: Dict[str, List[_Ring]] = {}
+        self._lock = threading.Lock()
+
+    def _rings(self, key: str) -> List[_Ring]:
+        rings = self._keys.get(key)
+        if rings is None:
+            rings = self._keys[key] = [
+                _Ring(length / BUCKETS_PER_WINDOW) for length in WINDOWS.values()
+            ]
+        return rings
+
+    def record(self, user_id: Optional[int], merchant: Optional[str], amount: Optional[float], date: Optional[datetime]):
+        """Count one transaction against its user, merchant and pair"""
+        if date is None or amount is None:
+            return
+        t = _seconds(date)
+        windows = windows_for(date)
+        merchant = merchant_index.canonical(merchant)
+        keys = []
+        if user_id:
+            keys.append(user_key(user_id))
+        if merchant:
+            keys.append(merchant_key(merchant))
+            if user_id:
+                keys.append(pair_key(user_id, merchant))
+
+        with self._lock:
+            for key in keys:
+                for label, ring in zip(WINDOWS, self._rings(key)):
+                    if label in windows:
+                        ring.add(t, amount)
+
+    def window_totals(self, key: str, date: datetime) -> Dict[str, Dict[str, float]]:
+        """{window: {"count", "amount"}} for a key as of a time"""
+        t = _seconds(date)
+        with self._lock:
+            rings = self._keys.get(key)
+            totals = [ring.total(t) for ring in rings] if rings else [(0, 0.0)] * len(WINDOWS)
+        return {
+            label: {"count": count, "amount": amount}
+            for label, (count, amount) in zip(WINDOWS, totals)
+        }
+
+    def lookup(self, user_id: Optional[int], merchant: Optional[str], date: datetime) -> Dict[str, Dict[str, Dict[str, float]]]:
+        """Velocity for a transaction's user, merchant and user-merchant pair"""
+        merchant = merchant_index.canonical(merchant)
+        empty = {label: {"count": 0, "amount": 0.0} for label in WINDOWS}
+        return {
+            "user": self.window_totals(user_key(user_id), date) if user_id else empty,
+            "merchant": self.window_totals(merchant_key(merchant), date) if merchant else empty,
+            "pair": self.window_totals(pair_key(user_id, merchant), date) if user_id and merchant else empty,
+        }
+
+    def prune(self, now: Optional[datetime] = None) -> int:
+        """Drop keys with no activity inside the longest window"""
+        horizon = _seconds(now or datetime.utcnow()) - max(WINDOWS.values())
+        with self._lock:
+            stale = [key for key, rings in self._keys.items() if rings[-1].latest() < horizon]
+            for key in stale:
+                del self._keys[key]
+        return len(stale)
+
+    def snapshot(self) -> Dict[str, Any]:
+        self.prune()
+        with self._lock:
+            keys = {
+                key: [[list(ring.stamps), list(ring.counts), list(ring.sums)] for ring in rings]
+                for key, rings in self._keys.items()
+            }
+        return {
+            "version": SNAPSHOT_VERSION,
+            "windows": WINDOWS,
+            "buckets": BUCKETS_PER_WINDOW,
+            "saved_at": datetime.utcnow().isoformat(),
+            "keys": keys,
+        }
+
+    def save(self):
+        """Write a snapshot atomically"""
+        data = self.snapshot()
+        os.makedirs(os.path.dirname(self.snapshot_path) or ".", exist_ok=True)
+        tmp = f"{self.snapshot_path}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp, self.snapshot_path)
+
+    def load(self) -> Optional[datetime]:
+        """Restore the last snapshot, returning when it was taken"""
+        try:
+            with open(self.snapshot_path) as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.error(f"Could not read velocity snapshot: {e}")
+            return None
+
+        if (
+            data.get("version") != SNAPSHOT_VERSION
+            or data.get("windows") != WINDOWS
+            or data.get("buckets") != BUCKETS_PER_WINDOW
+        ):
+            logger.warning("Ignoring velocity snapshot with a different layout")
+            return None
+
+        with self._lock:
+            self._keys = {}
+            for key, saved in data["keys"].items():
+                rings = self._rings(key)
+                for ring, (stamps, counts, sums) in zip(rings, saved):
+                    ring.stamps, ring.counts, ring.sums = stamps, counts, sums
+        return datetime.fromisoformat(data["saved_at"])
+
+    def warm(self, db: Session) -> int:
+        """Load the snapshot, then replay transactions created since it was taken"""
+        saved_at = self.load()
+        query = db.query(
+            Transaction.user_id, Transaction.merchant, base_amount_column(), Transaction.date
+        ).filter(Transaction.date >= datetime.utcnow() - timedelta(seconds=max(WINDOWS.values())))
+        if saved_at is not None:
+            query = query.filter(Transaction.created_at >= saved_at)
+
+        replayed = 0
+        for row in query.yield_per(1000):
+            self.record(row.user_id, row.merchant, row.amount, row.date)
+            replayed += 1
+        logger.info(f"Velocity tracker warmed: {len(self._keys)} keys, {replayed} rows replayed")
+        return replayed
+
+
+velocity_tracker = VelocityTracker(settings.velocity_snapshot_path)